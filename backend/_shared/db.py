@@ -0,0 +1,558 @@
+'''
+Canonical source of the code blocks every backend function carries a copy of. Each
+function directory is deployed on its own, so handlers cannot import this module;
+instead each section below is pasted verbatim between matching markers in
+backend/<function>/index.py. Edit a section here, then run
+python backend/_shared/sync.py to rewrite the copies; --check fails when any copy
+has drifted from this file.
+'''
+import json
+import functools
+import os
+import base64
+import hashlib
+import hmac
+import itertools
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Set, Tuple, Callable, Iterator
+import psycopg2
+
+# >>> shared: instrumentation
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+
+_request_timing = threading.local()
+
+
+def param_shape(value: Any) -> Any:
+    '''Types and sizes of query parameters, so slow-query logs never carry user data'''
+    if isinstance(value, dict):
+        return {key: param_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'{type(value).__name__}[{len(value)}]'
+        return [param_shape(item) for item in value]
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def add_timing(phase: str, seconds: float) -> None:
+    phases = getattr(_request_timing, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def tag_action(action: Any) -> None:
+    '''Name the action once the handler has parsed it from the body'''
+    if getattr(_request_timing, 'phases', None) is not None:
+        _request_timing.action = f'{_request_timing.method} {action}'
+
+
+def record_query(query: Any, params: Any, seconds: float) -> None:
+    add_timing('execute', seconds)
+    queries = getattr(_request_timing, 'queries', None)
+    if queries is not None:
+        queries.append(round(seconds * 1000, 3))
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        text = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+        print(json.dumps({'slow_query': {
+            'function': getattr(_request_timing, 'function', None),
+            'action': getattr(_request_timing, 'action', None),
+            'ms': round(seconds * 1000, 3),
+            'query': ' '.join(text.split())[:500],
+            'params': param_shape(params)
+        }}))
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    if getattr(_request_timing, 'phases', None) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - started)
+
+
+class _TimedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - started)
+    
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchall(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+
+
+_timed_cursor_classes: Dict[type, type] = {}
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''Connection whose cursors, whatever their cursor_factory, report execute and fetch time'''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursor_classes.get(base)
+        if timed is None:
+            timed = _timed_cursor_classes[base] = type(f'Timed{base.__name__}', (_TimedCursorMixin, base), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+INSTRUMENTED = REQUEST_TIMING or SLOW_QUERY_MS > 0
+CONNECTION_FACTORY = TimedConnection if INSTRUMENTED else None
+
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''
+    Wrap a handler so each request is timed by phase (connect, execute, fetch, serialize,
+    other). With REQUEST_TIMING=1 the phases go to a structured log line and a Server-Timing
+    header. When neither REQUEST_TIMING nor SLOW_QUERY_MS is set the handler is returned untouched.
+    '''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        if not INSTRUMENTED:
+            return handler
+        
+        @functools.wraps(handler)
+        def timed_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            query_params = event.get('queryStringParameters') or {}
+            _request_timing.function = function_name
+            _request_timing.method = event.get('httpMethod', 'GET')
+            _request_timing.action = f"{_request_timing.method} {query_params.get('action') or query_params.get('feed') or ''}".rstrip()
+            _request_timing.phases = phases = {}
+            _request_timing.queries = queries = []
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+            finally:
+                total = time.perf_counter() - started
+                _request_timing.phases = None
+                _request_timing.queries = None
+            
+            if REQUEST_TIMING:
+                phases['other'] = max(0.0, total - sum(phases.values()))
+                phases['total'] = total
+                print(json.dumps({'timing': {
+                    'function': function_name,
+                    'action': _request_timing.action,
+                    'status': response.get('statusCode'),
+                    'ms': {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+                    'queries_ms': queries
+                }}))
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items())
+                headers['Timing-Allow-Origin'] = '*'
+            return response
+        return timed_handler
+    return decorate
+# <<< shared: instrumentation
+
+
+# >>> shared: pool
+# Caps the idle connections kept between invocations, not checkouts: every concurrent
+# invocation on an instance holds its own connection, so open connections track request
+# concurrency. Bound that with the platform's per-instance concurrency or a server-side pooler.
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_db_pool: Dict[str, List[Tuple[Any, float]]] = {}
+_db_pool_lock = threading.Lock()
+DB_POOL_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'discarded': 0}
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _ping(conn: Any) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(dsn: str) -> Any:
+    '''
+    Take an idle pooled connection for dsn or open a new one; a miss never waits for a
+    connection to be released, see DB_POOL_MAX_SIZE. Connections idle longer than
+    DB_POOL_CHECK_AFTER seconds are pinged before reuse.
+    '''
+    started = time.perf_counter()
+    while True:
+        with _db_pool_lock:
+            idle = _db_pool.get(dsn)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            break
+        conn, released_at = entry
+        if not conn.closed and (time.monotonic() - released_at < DB_POOL_CHECK_AFTER or _ping(conn)):
+            DB_POOL_STATS['hits'] += 1
+            add_timing('connect', time.perf_counter() - started)
+            return conn
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+    
+    DB_POOL_STATS['misses'] += 1
+    if INSTRUMENTED:
+        print(json.dumps({'db_pool': DB_POOL_STATS}))
+    conn = psycopg2.connect(dsn, connection_factory=CONNECTION_FACTORY)
+    add_timing('connect', time.perf_counter() - started)
+    return conn
+
+
+def release_connection(conn: Any, dsn: str) -> None:
+    '''
+    Roll back any unfinished transaction and keep conn for the next warm invocation.
+    Broken connections and connections over DB_POOL_MAX_SIZE are closed instead.
+    '''
+    if conn is None:
+        return
+    try:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    
+    if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+        return
+    
+    with _db_pool_lock:
+        idle = _db_pool.setdefault(dsn, [])
+        if len(idle) < DB_POOL_MAX_SIZE:
+            idle.append((conn, time.monotonic()))
+            return
+    _close_quietly(conn)
+# <<< shared: pool
+
+
+# >>> shared: read_your_writes
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', '10'))
+READ_YOUR_WRITES_MAX_USERS = 10000
+# Pins travel through the client, so they are signed; every function shares the auth secret
+READ_YOUR_WRITES_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+
+_recent_writers: 'OrderedDict[str, float]' = OrderedDict()
+_recent_writers_lock = threading.Lock()
+
+
+def _read_pin_signature(user_id: Optional[str], until: str) -> str:
+    digest = hmac.new(READ_YOUR_WRITES_SECRET.encode(), f'read-primary|{user_id or ""}|{until}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+
+def mark_write(user_id: Optional[str]) -> Dict[str, str]:
+    '''
+    Pin user_id's reads on this instance to the primary for READ_YOUR_WRITES_WINDOW seconds.
+    Returns the X-Read-Primary-Until response header, "<until>:<signature>" bound to the
+    user, so the client can carry the pin to other functions and instances by echoing it
+    but cannot mint or extend one. Without a secret only the instance-local pin applies.
+    '''
+    until = time.time() + READ_YOUR_WRITES_WINDOW
+    if user_id:
+        with _recent_writers_lock:
+            _recent_writers[str(user_id)] = until
+            _recent_writers.move_to_end(str(user_id))
+            while _recent_writers and (
+                len(_recent_writers) > READ_YOUR_WRITES_MAX_USERS or next(iter(_recent_writers.values())) <= time.time()
+            ):
+                _recent_writers.popitem(last=False)
+    if not READ_YOUR_WRITES_SECRET:
+        return {}
+    value = '%.3f' % until
+    return {
+        'X-Read-Primary-Until': f'{value}:{_read_pin_signature(user_id, value)}',
+        'Access-Control-Expose-Headers': 'X-Read-Primary-Until'
+    }
+
+
+def reads_pinned_to_primary(user_id: Optional[str], headers: Dict[str, Any]) -> bool:
+    now = time.time()
+    client_pin = headers.get('x-read-primary-until') or headers.get('X-Read-Primary-Until')
+    if client_pin and READ_YOUR_WRITES_SECRET and client_pin.count(':') == 1:
+        value, signature = client_pin.split(':')
+        try:
+            # Values beyond one window are not something we issued; ignore them
+            if (now < float(value) <= now + READ_YOUR_WRITES_WINDOW
+                    and hmac.compare_digest(signature.encode(), _read_pin_signature(user_id, value).encode())):
+                return True
+        except ValueError:
+            pass
+    if not user_id:
+        return False
+    with _recent_writers_lock:
+        until = _recent_writers.get(str(user_id))
+    return until is not None and now < until
+# <<< shared: read_your_writes
+
+
+# >>> shared: replica
+DATABASE_REPLICA_URLS = [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '5'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '10'))
+
+_replica_health: Dict[str, Tuple[float, Optional[float]]] = {}
+_replica_turn = itertools.count()
+REPLICA_STATS: Dict[str, int] = {'replica': 0, 'pinned': 0, 'fallbacks': 0}
+
+
+def replica_lag(conn: Any) -> Optional[float]:
+    '''Seconds of replay lag, 0 once the replica has applied all WAL it received; None if the check fails'''
+    try:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            ''')
+            lag = float(cur.fetchone()[0])
+        conn.rollback()
+        return lag
+    except psycopg2.Error:
+        return None
+
+
+def get_read_connection(user_id: Optional[str], headers: Dict[str, Any]) -> Tuple[Any, str]:
+    '''
+    Connection for a read-only request and the dsn to release it under. Replicas from
+    DATABASE_REPLICA_URLS are tried round-robin; one that fails to connect or lags more
+    than REPLICA_MAX_LAG seconds is skipped until it is checked again REPLICA_CHECK_INTERVAL
+    seconds later. The primary serves the read when no replica is usable or the caller
+    wrote within READ_YOUR_WRITES_WINDOW.
+    '''
+    primary = os.environ.get('DATABASE_URL')
+    if not DATABASE_REPLICA_URLS:
+        return get_connection(primary), primary
+    if reads_pinned_to_primary(user_id, headers):
+        REPLICA_STATS['pinned'] += 1
+        return get_connection(primary), primary
+    
+    first = next(_replica_turn)
+    for offset in range(len(DATABASE_REPLICA_URLS)):
+        index = (first + offset) % len(DATABASE_REPLICA_URLS)
+        dsn = DATABASE_REPLICA_URLS[index]
+        now = time.monotonic()
+        checked_at, lag = _replica_health.get(dsn, (None, None))
+        check_due = checked_at is None or now - checked_at >= REPLICA_CHECK_INTERVAL
+        if not check_due and (lag is None or lag > REPLICA_MAX_LAG):
+            continue
+        try:
+            conn = get_connection(dsn)
+        except psycopg2.Error:
+            _replica_health[dsn] = (now, None)
+            print(json.dumps({'replica_unavailable': index}))
+            continue
+        if check_due:
+            lag = replica_lag(conn)
+            _replica_health[dsn] = (now, lag)
+            if lag is None or lag > REPLICA_MAX_LAG:
+                print(json.dumps({'replica_lagging': index, 'lag_seconds': lag}))
+                release_connection(conn, dsn)
+                continue
+        REPLICA_STATS['replica'] += 1
+        return conn, dsn
+    
+    REPLICA_STATS['fallbacks'] += 1
+    return get_connection(primary), primary
+# <<< shared: replica
+
+
+# >>> shared: prepared
+PREPARED_STATEMENTS = os.environ.get('PREPARED_STATEMENTS', '1') == '1'
+PREPARED_STATS_LOG_EVERY = int(os.environ.get('PREPARED_STATS_LOG_EVERY', '1000'))
+
+_statements: Dict[str, Tuple[str, str]] = {}
+_prepared_on: 'weakref.WeakKeyDictionary[Any, Set[str]]' = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+PREPARED_STATS: Dict[str, Dict[str, float]] = {}
+_prepared_calls = itertools.count(1)
+
+
+def prepared(name: str, sql: str) -> str:
+    '''
+    Register a hot statement under name. sql uses %s placeholders like any other query
+    here; they are numbered $1..$n for PREPARE. Returns name for execute_prepared.
+    '''
+    numbered = itertools.count(1)
+    _statements[name] = (sql, re.sub(r'%s', lambda _: f'${next(numbered)}', sql))
+    PREPARED_STATS[name] = {'calls': 0, 'prepares': 0, 'ms': 0.0}
+    return name
+
+
+def _prepare(cur: Any, name: str) -> None:
+    cur.execute(f'PREPARE {name} AS {_statements[name][1]}')
+    PREPARED_STATS[name]['prepares'] += 1
+
+
+def execute_prepared(cur: Any, name: str, params: Tuple[Any, ...] = ()) -> None:
+    '''
+    EXECUTE a registered statement on cur, preparing it first on connections that have not
+    seen it yet. Each pooled connection keeps its own set, so a reconnect or a discarded
+    connection simply prepares again on first use. If the server has lost the statement
+    and nothing else ran in the transaction yet, it is re-prepared and retried once.
+    PREPARED_STATEMENTS=0 sends the plain query instead, e.g. behind a transaction pooler.
+    '''
+    stats = PREPARED_STATS[name]
+    started = time.perf_counter()
+    if not PREPARED_STATEMENTS:
+        cur.execute(_statements[name][0], params)
+    else:
+        conn = cur.connection
+        with _prepared_lock:
+            names = _prepared_on.setdefault(conn, set())
+        fresh_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        call = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f'EXECUTE {name}'
+        if name not in names:
+            _prepare(cur, name)
+            names.add(name)
+        try:
+            cur.execute(call, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            names.discard(name)
+            if not fresh_transaction:
+                raise
+            conn.rollback()
+            _prepare(cur, name)
+            names.add(name)
+            cur.execute(call, params)
+    stats['calls'] += 1
+    stats['ms'] += (time.perf_counter() - started) * 1000
+    if PREPARED_STATS_LOG_EVERY and next(_prepared_calls) % PREPARED_STATS_LOG_EVERY == 0:
+        print(json.dumps({'prepared_statements': {
+            key: {'calls': value['calls'], 'prepares': value['prepares'], 'ms': round(value['ms'], 3)}
+            for key, value in PREPARED_STATS.items()
+        }}))
+
+
+def prepare_all(conn: Any) -> None:
+    '''
+    PREPARE every registered statement conn has not seen yet, in one round trip per
+    statement, and commit. Lets a caller warm a connection up front instead of paying
+    the extra PREPARE on each statement's first use.
+    '''
+    if not PREPARED_STATEMENTS:
+        return
+    with _prepared_lock:
+        names = _prepared_on.setdefault(conn, set())
+    with conn.cursor() as cur:
+        for name in _statements:
+            if name not in names:
+                _prepare(cur, name)
+                names.add(name)
+    conn.commit()
+# <<< shared: prepared
+
+
+# >>> shared: auth
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+AUTH_ALLOW_USER_ID_HEADER = os.environ.get('AUTH_ALLOW_USER_ID_HEADER', '0') == '1'
+
+
+class InvalidAuthToken(Exception):
+    '''An X-Auth-Token was sent but is malformed, forged or expired; answered with 401'''
+
+
+def _b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def verify_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    '''Return the payload of an auth-issued token if its HMAC and expiry check out, without a database call'''
+    if not AUTH_TOKEN_SECRET or token.count('.') != 1:
+        return None
+    payload_part, signature = token.split('.')
+    expected = base64.urlsafe_b64encode(
+        hmac.new(AUTH_TOKEN_SECRET.encode(), payload_part.encode(), hashlib.sha256).digest()
+    ).decode().rstrip('=')
+    # Bytes, not str: compare_digest raises TypeError on non-ASCII text
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    try:
+        payload = json.loads(_b64url_decode(payload_part))
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or 'uid' not in payload or payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+
+def resolve_identity(headers: Dict[str, Any], anonymous_on_invalid: bool = False) -> Tuple[Optional[str], Optional[int]]:
+    '''
+    (user_id, channel_id) from a signed X-Auth-Token; raises InvalidAuthToken if the token
+    does not verify, unless anonymous_on_invalid is set: public reads use it so a stale or
+    expired token still gets the anonymous response. Without a token the raw X-User-Id
+    header is only trusted when AUTH_ALLOW_USER_ID_HEADER=1 (local development and the
+    bench), and then the channel is unknown.
+    '''
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    if token:
+        payload = verify_auth_token(token)
+        if payload:
+            return str(payload['uid']), payload.get('cid')
+        if not anonymous_on_invalid:
+            raise InvalidAuthToken()
+        return None, None
+    if AUTH_ALLOW_USER_ID_HEADER:
+        return headers.get('x-user-id') or headers.get('X-User-Id'), None
+    return None, None
+# <<< shared: auth
+
+
+# >>> shared: user_channel_cache
+USER_CHANNEL_CACHE_SIZE = int(os.environ.get('USER_CHANNEL_CACHE_SIZE', '1024'))
+
+_user_channel_cache: 'OrderedDict[str, int]' = OrderedDict()
+_user_channel_cache_lock = threading.Lock()
+
+
+def cached_user_channel(user_id: str) -> Optional[int]:
+    with _user_channel_cache_lock:
+        channel_id = _user_channel_cache.get(user_id)
+        if channel_id is not None:
+            _user_channel_cache.move_to_end(user_id)
+        return channel_id
+
+
+def cache_user_channel(user_id: str, channel_id: int) -> None:
+    '''Remember user -> channel; the mapping is fixed at registration, so entries never go stale'''
+    with _user_channel_cache_lock:
+        _user_channel_cache[user_id] = channel_id
+        _user_channel_cache.move_to_end(user_id)
+        while len(_user_channel_cache) > USER_CHANNEL_CACHE_SIZE:
+            _user_channel_cache.popitem(last=False)
+# <<< shared: user_channel_cache
\ No newline at end of file
@@ -0,0 +1,77 @@
+'''
+Copy the sections of backend/_shared/db.py into every backend/<function>/index.py that
+carries them. A handler opts into a section by containing its marker pair; the text
+between the markers is replaced with the canonical one. Run before deploying:
+
+    python backend/_shared/sync.py           # rewrite drifted copies
+    python backend/_shared/sync.py --check   # exit 1 if any copy differs from db.py
+'''
+import argparse
+import glob
+import os
+import re
+import sys
+from typing import Dict, List
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(SHARED_DIR)
+CANONICAL_PATH = os.path.join(SHARED_DIR, 'db.py')
+SECTION_PATTERN = re.compile(r'^# >>> shared: (\w+)[^\n]*\n(.*?)^# <<< shared: \1$', re.MULTILINE | re.DOTALL)
+
+
+def read_sections(source: str) -> Dict[str, str]:
+    '''Section name -> body between its markers; a name may appear only once'''
+    sections: Dict[str, str] = {}
+    for match in SECTION_PATTERN.finditer(source):
+        if match.group(1) in sections:
+            raise ValueError(f'section {match.group(1)} appears twice')
+        sections[match.group(1)] = match.group(2)
+    if source.count('# >>> shared: ') != len(sections):
+        raise ValueError('unbalanced shared section markers')
+    return sections
+
+
+def sync_source(source: str, canonical: Dict[str, str]) -> str:
+    '''Return source with every marked section replaced by its canonical body'''
+    def replace(match: 're.Match[str]') -> str:
+        name = match.group(1)
+        if name not in canonical:
+            raise ValueError(f'unknown shared section {name}')
+        header = match.group(0)[:match.start(2) - match.start(0)]
+        return f'{header}{canonical[name]}# <<< shared: {name}'
+
+    read_sections(source)
+    return SECTION_PATTERN.sub(replace, source)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='only report drifted copies')
+    args = parser.parse_args()
+
+    with open(CANONICAL_PATH) as f:
+        canonical = read_sections(f.read())
+
+    drifted: List[str] = []
+    for path in sorted(glob.glob(os.path.join(BACKEND_DIR, '*', 'index.py'))):
+        with open(path) as f:
+            source = f.read()
+        try:
+            synced = sync_source(source, canonical)
+        except ValueError as e:
+            sys.exit(f'{os.path.relpath(path, BACKEND_DIR)}: {e}')
+        if synced == source:
+            continue
+        drifted.append(os.path.relpath(path, BACKEND_DIR))
+        if not args.check:
+            with open(path, 'w') as f:
+                f.write(synced)
+
+    for path in drifted:
+        print(f"{'drifted' if args.check else 'synced'}: {path}")
+    if args.check and drifted:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,433 @@
 import json
+import functools
 import os
+import base64
+import hmac
+import itertools
+import threading
+import time
 import hashlib
 import secrets
-from typing import Dict, Any
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
 import psycopg2
 import psycopg2.extras
 
+# >>> shared: instrumentation (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+
+_request_timing = threading.local()
+
+
+def param_shape(value: Any) -> Any:
+    '''Types and sizes of query parameters, so slow-query logs never carry user data'''
+    if isinstance(value, dict):
+        return {key: param_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'{type(value).__name__}[{len(value)}]'
+        return [param_shape(item) for item in value]
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def add_timing(phase: str, seconds: float) -> None:
+    phases = getattr(_request_timing, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def tag_action(action: Any) -> None:
+    '''Name the action once the handler has parsed it from the body'''
+    if getattr(_request_timing, 'phases', None) is not None:
+        _request_timing.action = f'{_request_timing.method} {action}'
+
+
+def record_query(query: Any, params: Any, seconds: float) -> None:
+    add_timing('execute', seconds)
+    queries = getattr(_request_timing, 'queries', None)
+    if queries is not None:
+        queries.append(round(seconds * 1000, 3))
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        text = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+        print(json.dumps({'slow_query': {
+            'function': getattr(_request_timing, 'function', None),
+            'action': getattr(_request_timing, 'action', None),
+            'ms': round(seconds * 1000, 3),
+            'query': ' '.join(text.split())[:500],
+            'params': param_shape(params)
+        }}))
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    if getattr(_request_timing, 'phases', None) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - started)
+
+
+class _TimedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - started)
+    
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchall(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+
+
+_timed_cursor_classes: Dict[type, type] = {}
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''Connection whose cursors, whatever their cursor_factory, report execute and fetch time'''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursor_classes.get(base)
+        if timed is None:
+            timed = _timed_cursor_classes[base] = type(f'Timed{base.__name__}', (_TimedCursorMixin, base), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+INSTRUMENTED = REQUEST_TIMING or SLOW_QUERY_MS > 0
+CONNECTION_FACTORY = TimedConnection if INSTRUMENTED else None
+
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''
+    Wrap a handler so each request is timed by phase (connect, execute, fetch, serialize,
+    other). With REQUEST_TIMING=1 the phases go to a structured log line and a Server-Timing
+    header. When neither REQUEST_TIMING nor SLOW_QUERY_MS is set the handler is returned untouched.
+    '''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        if not INSTRUMENTED:
+            return handler
+        
+        @functools.wraps(handler)
+        def timed_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            query_params = event.get('queryStringParameters') or {}
+            _request_timing.function = function_name
+            _request_timing.method = event.get('httpMethod', 'GET')
+            _request_timing.action = f"{_request_timing.method} {query_params.get('action') or query_params.get('feed') or ''}".rstrip()
+            _request_timing.phases = phases = {}
+            _request_timing.queries = queries = []
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+            finally:
+                total = time.perf_counter() - started
+                _request_timing.phases = None
+                _request_timing.queries = None
+            
+            if REQUEST_TIMING:
+                phases['other'] = max(0.0, total - sum(phases.values()))
+                phases['total'] = total
+                print(json.dumps({'timing': {
+                    'function': function_name,
+                    'action': _request_timing.action,
+                    'status': response.get('statusCode'),
+                    'ms': {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+                    'queries_ms': queries
+                }}))
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items())
+                headers['Timing-Allow-Origin'] = '*'
+            return response
+        return timed_handler
+    return decorate
+# <<< shared: instrumentation
+
+
+# >>> shared: pool (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+# Caps the idle connections kept between invocations, not checkouts: every concurrent
+# invocation on an instance holds its own connection, so open connections track request
+# concurrency. Bound that with the platform's per-instance concurrency or a server-side pooler.
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_db_pool: Dict[str, List[Tuple[Any, float]]] = {}
+_db_pool_lock = threading.Lock()
+DB_POOL_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'discarded': 0}
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _ping(conn: Any) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(dsn: str) -> Any:
+    '''
+    Take an idle pooled connection for dsn or open a new one; a miss never waits for a
+    connection to be released, see DB_POOL_MAX_SIZE. Connections idle longer than
+    DB_POOL_CHECK_AFTER seconds are pinged before reuse.
+    '''
+    started = time.perf_counter()
+    while True:
+        with _db_pool_lock:
+            idle = _db_pool.get(dsn)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            break
+        conn, released_at = entry
+        if not conn.closed and (time.monotonic() - released_at < DB_POOL_CHECK_AFTER or _ping(conn)):
+            DB_POOL_STATS['hits'] += 1
+            add_timing('connect', time.perf_counter() - started)
+            return conn
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+    
+    DB_POOL_STATS['misses'] += 1
+    if INSTRUMENTED:
+        print(json.dumps({'db_pool': DB_POOL_STATS}))
+    conn = psycopg2.connect(dsn, connection_factory=CONNECTION_FACTORY)
+    add_timing('connect', time.perf_counter() - started)
+    return conn
+
+
+def release_connection(conn: Any, dsn: str) -> None:
+    '''
+    Roll back any unfinished transaction and keep conn for the next warm invocation.
+    Broken connections and connections over DB_POOL_MAX_SIZE are closed instead.
+    '''
+    if conn is None:
+        return
+    try:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    
+    if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+        return
+    
+    with _db_pool_lock:
+        idle = _db_pool.setdefault(dsn, [])
+        if len(idle) < DB_POOL_MAX_SIZE:
+            idle.append((conn, time.monotonic()))
+            return
+    _close_quietly(conn)
+# <<< shared: pool
+
+
+# >>> shared: read_your_writes (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', '10'))
+READ_YOUR_WRITES_MAX_USERS = 10000
+# Pins travel through the client, so they are signed; every function shares the auth secret
+READ_YOUR_WRITES_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+
+_recent_writers: 'OrderedDict[str, float]' = OrderedDict()
+_recent_writers_lock = threading.Lock()
+
+
+def _read_pin_signature(user_id: Optional[str], until: str) -> str:
+    digest = hmac.new(READ_YOUR_WRITES_SECRET.encode(), f'read-primary|{user_id or ""}|{until}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+
+def mark_write(user_id: Optional[str]) -> Dict[str, str]:
+    '''
+    Pin user_id's reads on this instance to the primary for READ_YOUR_WRITES_WINDOW seconds.
+    Returns the X-Read-Primary-Until response header, "<until>:<signature>" bound to the
+    user, so the client can carry the pin to other functions and instances by echoing it
+    but cannot mint or extend one. Without a secret only the instance-local pin applies.
+    '''
+    until = time.time() + READ_YOUR_WRITES_WINDOW
+    if user_id:
+        with _recent_writers_lock:
+            _recent_writers[str(user_id)] = until
+            _recent_writers.move_to_end(str(user_id))
+            while _recent_writers and (
+                len(_recent_writers) > READ_YOUR_WRITES_MAX_USERS or next(iter(_recent_writers.values())) <= time.time()
+            ):
+                _recent_writers.popitem(last=False)
+    if not READ_YOUR_WRITES_SECRET:
+        return {}
+    value = '%.3f' % until
+    return {
+        'X-Read-Primary-Until': f'{value}:{_read_pin_signature(user_id, value)}',
+        'Access-Control-Expose-Headers': 'X-Read-Primary-Until'
+    }
+
+
+def reads_pinned_to_primary(user_id: Optional[str], headers: Dict[str, Any]) -> bool:
+    now = time.time()
+    client_pin = headers.get('x-read-primary-until') or headers.get('X-Read-Primary-Until')
+    if client_pin and READ_YOUR_WRITES_SECRET and client_pin.count(':') == 1:
+        value, signature = client_pin.split(':')
+        try:
+            # Values beyond one window are not something we issued; ignore them
+            if (now < float(value) <= now + READ_YOUR_WRITES_WINDOW
+                    and hmac.compare_digest(signature.encode(), _read_pin_signature(user_id, value).encode())):
+                return True
+        except ValueError:
+            pass
+    if not user_id:
+        return False
+    with _recent_writers_lock:
+        until = _recent_writers.get(str(user_id))
+    return until is not None and now < until
+# <<< shared: read_your_writes
+
+
+# >>> shared: replica (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+DATABASE_REPLICA_URLS = [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '5'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '10'))
+
+_replica_health: Dict[str, Tuple[float, Optional[float]]] = {}
+_replica_turn = itertools.count()
+REPLICA_STATS: Dict[str, int] = {'replica': 0, 'pinned': 0, 'fallbacks': 0}
+
+
+def replica_lag(conn: Any) -> Optional[float]:
+    '''Seconds of replay lag, 0 once the replica has applied all WAL it received; None if the check fails'''
+    try:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            ''')
+            lag = float(cur.fetchone()[0])
+        conn.rollback()
+        return lag
+    except psycopg2.Error:
+        return None
+
+
+def get_read_connection(user_id: Optional[str], headers: Dict[str, Any]) -> Tuple[Any, str]:
+    '''
+    Connection for a read-only request and the dsn to release it under. Replicas from
+    DATABASE_REPLICA_URLS are tried round-robin; one that fails to connect or lags more
+    than REPLICA_MAX_LAG seconds is skipped until it is checked again REPLICA_CHECK_INTERVAL
+    seconds later. The primary serves the read when no replica is usable or the caller
+    wrote within READ_YOUR_WRITES_WINDOW.
+    '''
+    primary = os.environ.get('DATABASE_URL')
+    if not DATABASE_REPLICA_URLS:
+        return get_connection(primary), primary
+    if reads_pinned_to_primary(user_id, headers):
+        REPLICA_STATS['pinned'] += 1
+        return get_connection(primary), primary
+    
+    first = next(_replica_turn)
+    for offset in range(len(DATABASE_REPLICA_URLS)):
+        index = (first + offset) % len(DATABASE_REPLICA_URLS)
+        dsn = DATABASE_REPLICA_URLS[index]
+        now = time.monotonic()
+        checked_at, lag = _replica_health.get(dsn, (None, None))
+        check_due = checked_at is None or now - checked_at >= REPLICA_CHECK_INTERVAL
+        if not check_due and (lag is None or lag > REPLICA_MAX_LAG):
+            continue
+        try:
+            conn = get_connection(dsn)
+        except psycopg2.Error:
+            _replica_health[dsn] = (now, None)
+            print(json.dumps({'replica_unavailable': index}))
+            continue
+        if check_due:
+            lag = replica_lag(conn)
+            _replica_health[dsn] = (now, lag)
+            if lag is None or lag > REPLICA_MAX_LAG:
+                print(json.dumps({'replica_lagging': index, 'lag_seconds': lag}))
+                release_connection(conn, dsn)
+                continue
+        REPLICA_STATS['replica'] += 1
+        return conn, dsn
+    
+    REPLICA_STATS['fallbacks'] += 1
+    return get_connection(primary), primary
+# <<< shared: replica
+
+
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', str(30 * 24 * 3600)))
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', '200000'))
+# Accounts created before passwords were stored have no hash; the first login sets it.
+# That is no weaker than the username-only login those accounts had.
+AUTH_CLAIM_LEGACY_ACCOUNTS = os.environ.get('AUTH_CLAIM_LEGACY_ACCOUNTS', '1') == '1'
+
+
+def hash_password(password: str) -> str:
+    '''Salted PBKDF2-SHA256, stored as pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>'''
+    salt = secrets.token_bytes(16)
+    derived = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PASSWORD_HASH_ITERATIONS)
+    return f'pbkdf2_sha256${PASSWORD_HASH_ITERATIONS}${salt.hex()}${derived.hex()}'
+
+
+def check_password(password: str, stored: Optional[str]) -> bool:
+    '''Constant-time check against a hash_password value; accounts without a hash never match'''
+    try:
+        scheme, iterations, salt, expected = (stored or '').split('$')
+        if scheme != 'pbkdf2_sha256':
+            return False
+        derived = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(derived.hex().encode(), expected.encode())
+
+
+def issue_auth_token(user_id: int, channel_id: Optional[int]) -> str:
+    '''
+    Stateless token: base64url(JSON payload) + "." + base64url(HMAC-SHA256). Other functions
+    verify it with the shared AUTH_TOKEN_SECRET and read user and channel ids without a query,
+    so there is no token to issue without a secret.
+    '''
+    if not AUTH_TOKEN_SECRET:
+        raise RuntimeError('AUTH_TOKEN_SECRET is not configured')
+    payload = json.dumps({'uid': user_id, 'cid': channel_id, 'exp': int(time.time()) + AUTH_TOKEN_TTL}, separators=(',', ':'))
+    payload_part = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+    signature = base64.urlsafe_b64encode(
+        hmac.new(AUTH_TOKEN_SECRET.encode(), payload_part.encode(), hashlib.sha256).digest()
+    ).decode().rstrip('=')
+    return f'{payload_part}.{signature}'
+
+
+@instrumented('auth')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: User registration and authentication
@@ -20,7 +442,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Read-Primary-Until',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -36,13 +458,30 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    # Other functions reject any token not signed with the shared secret, so fail before
+    # creating an account or answering a login with a token nobody accepts
+    if not AUTH_TOKEN_SECRET:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Auth token secret not configured'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = None
+    db_url = database_url
     try:
-        conn = psycopg2.connect(database_url)
-        cur = conn.cursor()
-        
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action', 'login')
+            tag_action(action)
+            
+            # Login only reads, so it may be served by a replica
+            if action == 'login':
+                conn, db_url = get_read_connection(None, event.get('headers') or {})
+            else:
+                conn = get_connection(database_url)
+            cur = conn.cursor()
             
             if action == 'register':
                 username = body_data.get('username')
@@ -57,28 +496,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                password_hash = hashlib.sha256(password.encode()).hexdigest()
+                password_hash = hash_password(password)
                 avatar_url = f'https://api.dicebear.com/7.x/avataaars/svg?seed={username}'
                 
+                # User and channel in one round trip; the channel insert reads the new user id from the CTE
                 cur.execute(
-                    "INSERT INTO users (username, email, avatar_url) VALUES (%s, %s, %s) RETURNING id, username, email, avatar_url, is_admin",
-                    (username, email, avatar_url)
+                    """WITH new_user AS (
+                           INSERT INTO users (username, email, avatar_url, password_hash) VALUES (%s, %s, %s, %s)
+                           RETURNING id, username, email, avatar_url, is_admin
+                       ), new_channel AS (
+                           INSERT INTO channels (user_id, name, description, avatar_url)
+                           SELECT id, %s, %s, avatar_url FROM new_user
+                           RETURNING id
+                       )
+                       SELECT u.id, u.username, u.email, u.avatar_url, u.is_admin, c.id
+                       FROM new_user u, new_channel c""",
+                    (username, email, avatar_url, password_hash, f'Канал {username}', f'Канал пользователя {username}')
                 )
                 user = cur.fetchone()
                 
-                cur.execute(
-                    "INSERT INTO channels (user_id, name, description, avatar_url) VALUES (%s, %s, %s, %s) RETURNING id",
-                    (user[0], f'Канал {username}', f'Канал пользователя {username}', avatar_url)
-                )
-                channel = cur.fetchone()
-                
                 conn.commit()
                 
-                auth_token = secrets.token_urlsafe(32)
+                auth_token = issue_auth_token(user[0], user[5])
                 
                 return {
                     'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **mark_write(str(user[0]))},
                     'body': json.dumps({
                         'user': {
                             'id': user[0],
@@ -87,7 +530,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             'avatar_url': user[3],
                             'is_admin': user[4]
                         },
-                        'channel_id': channel[0],
+                        'channel_id': user[5],
                         'auth_token': auth_token
                     }),
                     'isBase64Encoded': False
@@ -105,13 +548,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cur.execute(
-                    "SELECT u.id, u.username, u.email, u.avatar_url, u.is_admin, c.id FROM users u LEFT JOIN channels c ON c.user_id = u.id WHERE u.username = %s",
-                    (username,)
-                )
+                login_query = "SELECT u.id, u.username, u.email, u.avatar_url, u.is_admin, c.id, u.password_hash FROM users u LEFT JOIN channels c ON c.user_id = u.id WHERE u.username = %s"
+                cur.execute(login_query, (username,))
                 user_data = cur.fetchone()
                 
-                if not user_data:
+                if not user_data and db_url != database_url:
+                    # The account may have been registered moments ago and not reached the replica yet
+                    cur.close()
+                    release_connection(conn, db_url)
+                    conn, db_url = None, database_url
+                    conn = get_connection(database_url)
+                    cur = conn.cursor()
+                    cur.execute(login_query, (username,))
+                    user_data = cur.fetchone()
+                
+                if user_data and user_data[6] is None and AUTH_CLAIM_LEGACY_ACCOUNTS:
+                    # Legacy account: set its password on the primary, once
+                    if db_url != database_url:
+                        cur.close()
+                        release_connection(conn, db_url)
+                        conn, db_url = None, database_url
+                        conn = get_connection(database_url)
+                        cur = conn.cursor()
+                    cur.execute(
+                        "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash IS NULL RETURNING password_hash",
+                        (hash_password(password), user_data[0])
+                    )
+                    claimed = cur.fetchone()
+                    conn.commit()
+                    if claimed:
+                        user_data = user_data[:6] + (claimed[0],)
+                    else:
+                        # Another login claimed it first; check against the hash it stored
+                        cur.execute("SELECT password_hash FROM users WHERE id = %s", (user_data[0],))
+                        user_data = user_data[:6] + (cur.fetchone()[0],)
+                
+                # Unknown users and wrong passwords get the same answer
+                if not user_data or not check_password(password, user_data[6]):
                     return {
                         'statusCode': 401,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -119,7 +592,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                auth_token = secrets.token_urlsafe(32)
+                auth_token = issue_auth_token(user_data[0], user_data[5])
                 
                 return {
                     'statusCode': 200,
@@ -138,9 +611,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
         
-        cur.close()
-        conn.close()
-        
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -154,4 +624,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+    finally:
+        release_connection(conn, db_url)
\ No newline at end of file
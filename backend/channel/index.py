@@ -1,13 +1,622 @@
 import json
+import functools
 import os
-from typing import Dict, Any
+import base64
+import hashlib
+import hmac
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
 from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+# >>> shared: instrumentation (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+
+_request_timing = threading.local()
+
+
+def param_shape(value: Any) -> Any:
+    '''Types and sizes of query parameters, so slow-query logs never carry user data'''
+    if isinstance(value, dict):
+        return {key: param_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'{type(value).__name__}[{len(value)}]'
+        return [param_shape(item) for item in value]
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def add_timing(phase: str, seconds: float) -> None:
+    phases = getattr(_request_timing, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def tag_action(action: Any) -> None:
+    '''Name the action once the handler has parsed it from the body'''
+    if getattr(_request_timing, 'phases', None) is not None:
+        _request_timing.action = f'{_request_timing.method} {action}'
+
+
+def record_query(query: Any, params: Any, seconds: float) -> None:
+    add_timing('execute', seconds)
+    queries = getattr(_request_timing, 'queries', None)
+    if queries is not None:
+        queries.append(round(seconds * 1000, 3))
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        text = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+        print(json.dumps({'slow_query': {
+            'function': getattr(_request_timing, 'function', None),
+            'action': getattr(_request_timing, 'action', None),
+            'ms': round(seconds * 1000, 3),
+            'query': ' '.join(text.split())[:500],
+            'params': param_shape(params)
+        }}))
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    if getattr(_request_timing, 'phases', None) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - started)
+
+
+class _TimedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - started)
+    
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchall(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+
+
+_timed_cursor_classes: Dict[type, type] = {}
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''Connection whose cursors, whatever their cursor_factory, report execute and fetch time'''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursor_classes.get(base)
+        if timed is None:
+            timed = _timed_cursor_classes[base] = type(f'Timed{base.__name__}', (_TimedCursorMixin, base), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+INSTRUMENTED = REQUEST_TIMING or SLOW_QUERY_MS > 0
+CONNECTION_FACTORY = TimedConnection if INSTRUMENTED else None
+
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''
+    Wrap a handler so each request is timed by phase (connect, execute, fetch, serialize,
+    other). With REQUEST_TIMING=1 the phases go to a structured log line and a Server-Timing
+    header. When neither REQUEST_TIMING nor SLOW_QUERY_MS is set the handler is returned untouched.
+    '''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        if not INSTRUMENTED:
+            return handler
+        
+        @functools.wraps(handler)
+        def timed_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            query_params = event.get('queryStringParameters') or {}
+            _request_timing.function = function_name
+            _request_timing.method = event.get('httpMethod', 'GET')
+            _request_timing.action = f"{_request_timing.method} {query_params.get('action') or query_params.get('feed') or ''}".rstrip()
+            _request_timing.phases = phases = {}
+            _request_timing.queries = queries = []
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+            finally:
+                total = time.perf_counter() - started
+                _request_timing.phases = None
+                _request_timing.queries = None
+            
+            if REQUEST_TIMING:
+                phases['other'] = max(0.0, total - sum(phases.values()))
+                phases['total'] = total
+                print(json.dumps({'timing': {
+                    'function': function_name,
+                    'action': _request_timing.action,
+                    'status': response.get('statusCode'),
+                    'ms': {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+                    'queries_ms': queries
+                }}))
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items())
+                headers['Timing-Allow-Origin'] = '*'
+            return response
+        return timed_handler
+    return decorate
+# <<< shared: instrumentation
+
+
+# >>> shared: pool (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+# Caps the idle connections kept between invocations, not checkouts: every concurrent
+# invocation on an instance holds its own connection, so open connections track request
+# concurrency. Bound that with the platform's per-instance concurrency or a server-side pooler.
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_db_pool: Dict[str, List[Tuple[Any, float]]] = {}
+_db_pool_lock = threading.Lock()
+DB_POOL_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'discarded': 0}
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _ping(conn: Any) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(dsn: str) -> Any:
+    '''
+    Take an idle pooled connection for dsn or open a new one; a miss never waits for a
+    connection to be released, see DB_POOL_MAX_SIZE. Connections idle longer than
+    DB_POOL_CHECK_AFTER seconds are pinged before reuse.
+    '''
+    started = time.perf_counter()
+    while True:
+        with _db_pool_lock:
+            idle = _db_pool.get(dsn)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            break
+        conn, released_at = entry
+        if not conn.closed and (time.monotonic() - released_at < DB_POOL_CHECK_AFTER or _ping(conn)):
+            DB_POOL_STATS['hits'] += 1
+            add_timing('connect', time.perf_counter() - started)
+            return conn
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+    
+    DB_POOL_STATS['misses'] += 1
+    if INSTRUMENTED:
+        print(json.dumps({'db_pool': DB_POOL_STATS}))
+    conn = psycopg2.connect(dsn, connection_factory=CONNECTION_FACTORY)
+    add_timing('connect', time.perf_counter() - started)
+    return conn
+
+
+def release_connection(conn: Any, dsn: str) -> None:
+    '''
+    Roll back any unfinished transaction and keep conn for the next warm invocation.
+    Broken connections and connections over DB_POOL_MAX_SIZE are closed instead.
+    '''
+    if conn is None:
+        return
+    try:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    
+    if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+        return
+    
+    with _db_pool_lock:
+        idle = _db_pool.setdefault(dsn, [])
+        if len(idle) < DB_POOL_MAX_SIZE:
+            idle.append((conn, time.monotonic()))
+            return
+    _close_quietly(conn)
+# <<< shared: pool
+
+
+# >>> shared: read_your_writes (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', '10'))
+READ_YOUR_WRITES_MAX_USERS = 10000
+# Pins travel through the client, so they are signed; every function shares the auth secret
+READ_YOUR_WRITES_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+
+_recent_writers: 'OrderedDict[str, float]' = OrderedDict()
+_recent_writers_lock = threading.Lock()
+
+
+def _read_pin_signature(user_id: Optional[str], until: str) -> str:
+    digest = hmac.new(READ_YOUR_WRITES_SECRET.encode(), f'read-primary|{user_id or ""}|{until}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+
+def mark_write(user_id: Optional[str]) -> Dict[str, str]:
+    '''
+    Pin user_id's reads on this instance to the primary for READ_YOUR_WRITES_WINDOW seconds.
+    Returns the X-Read-Primary-Until response header, "<until>:<signature>" bound to the
+    user, so the client can carry the pin to other functions and instances by echoing it
+    but cannot mint or extend one. Without a secret only the instance-local pin applies.
+    '''
+    until = time.time() + READ_YOUR_WRITES_WINDOW
+    if user_id:
+        with _recent_writers_lock:
+            _recent_writers[str(user_id)] = until
+            _recent_writers.move_to_end(str(user_id))
+            while _recent_writers and (
+                len(_recent_writers) > READ_YOUR_WRITES_MAX_USERS or next(iter(_recent_writers.values())) <= time.time()
+            ):
+                _recent_writers.popitem(last=False)
+    if not READ_YOUR_WRITES_SECRET:
+        return {}
+    value = '%.3f' % until
+    return {
+        'X-Read-Primary-Until': f'{value}:{_read_pin_signature(user_id, value)}',
+        'Access-Control-Expose-Headers': 'X-Read-Primary-Until'
+    }
+
+
+def reads_pinned_to_primary(user_id: Optional[str], headers: Dict[str, Any]) -> bool:
+    now = time.time()
+    client_pin = headers.get('x-read-primary-until') or headers.get('X-Read-Primary-Until')
+    if client_pin and READ_YOUR_WRITES_SECRET and client_pin.count(':') == 1:
+        value, signature = client_pin.split(':')
+        try:
+            # Values beyond one window are not something we issued; ignore them
+            if (now < float(value) <= now + READ_YOUR_WRITES_WINDOW
+                    and hmac.compare_digest(signature.encode(), _read_pin_signature(user_id, value).encode())):
+                return True
+        except ValueError:
+            pass
+    if not user_id:
+        return False
+    with _recent_writers_lock:
+        until = _recent_writers.get(str(user_id))
+    return until is not None and now < until
+# <<< shared: read_your_writes
+
+
+# >>> shared: replica (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+DATABASE_REPLICA_URLS = [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '5'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '10'))
+
+_replica_health: Dict[str, Tuple[float, Optional[float]]] = {}
+_replica_turn = itertools.count()
+REPLICA_STATS: Dict[str, int] = {'replica': 0, 'pinned': 0, 'fallbacks': 0}
+
+
+def replica_lag(conn: Any) -> Optional[float]:
+    '''Seconds of replay lag, 0 once the replica has applied all WAL it received; None if the check fails'''
+    try:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            ''')
+            lag = float(cur.fetchone()[0])
+        conn.rollback()
+        return lag
+    except psycopg2.Error:
+        return None
+
+
+def get_read_connection(user_id: Optional[str], headers: Dict[str, Any]) -> Tuple[Any, str]:
+    '''
+    Connection for a read-only request and the dsn to release it under. Replicas from
+    DATABASE_REPLICA_URLS are tried round-robin; one that fails to connect or lags more
+    than REPLICA_MAX_LAG seconds is skipped until it is checked again REPLICA_CHECK_INTERVAL
+    seconds later. The primary serves the read when no replica is usable or the caller
+    wrote within READ_YOUR_WRITES_WINDOW.
+    '''
+    primary = os.environ.get('DATABASE_URL')
+    if not DATABASE_REPLICA_URLS:
+        return get_connection(primary), primary
+    if reads_pinned_to_primary(user_id, headers):
+        REPLICA_STATS['pinned'] += 1
+        return get_connection(primary), primary
+    
+    first = next(_replica_turn)
+    for offset in range(len(DATABASE_REPLICA_URLS)):
+        index = (first + offset) % len(DATABASE_REPLICA_URLS)
+        dsn = DATABASE_REPLICA_URLS[index]
+        now = time.monotonic()
+        checked_at, lag = _replica_health.get(dsn, (None, None))
+        check_due = checked_at is None or now - checked_at >= REPLICA_CHECK_INTERVAL
+        if not check_due and (lag is None or lag > REPLICA_MAX_LAG):
+            continue
+        try:
+            conn = get_connection(dsn)
+        except psycopg2.Error:
+            _replica_health[dsn] = (now, None)
+            print(json.dumps({'replica_unavailable': index}))
+            continue
+        if check_due:
+            lag = replica_lag(conn)
+            _replica_health[dsn] = (now, lag)
+            if lag is None or lag > REPLICA_MAX_LAG:
+                print(json.dumps({'replica_lagging': index, 'lag_seconds': lag}))
+                release_connection(conn, dsn)
+                continue
+        REPLICA_STATS['replica'] += 1
+        return conn, dsn
+    
+    REPLICA_STATS['fallbacks'] += 1
+    return get_connection(primary), primary
+# <<< shared: replica
+
+
+# >>> shared: auth (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+AUTH_ALLOW_USER_ID_HEADER = os.environ.get('AUTH_ALLOW_USER_ID_HEADER', '0') == '1'
+
+
+class InvalidAuthToken(Exception):
+    '''An X-Auth-Token was sent but is malformed, forged or expired; answered with 401'''
+
+
+def _b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def verify_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    '''Return the payload of an auth-issued token if its HMAC and expiry check out, without a database call'''
+    if not AUTH_TOKEN_SECRET or token.count('.') != 1:
+        return None
+    payload_part, signature = token.split('.')
+    expected = base64.urlsafe_b64encode(
+        hmac.new(AUTH_TOKEN_SECRET.encode(), payload_part.encode(), hashlib.sha256).digest()
+    ).decode().rstrip('=')
+    # Bytes, not str: compare_digest raises TypeError on non-ASCII text
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    try:
+        payload = json.loads(_b64url_decode(payload_part))
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or 'uid' not in payload or payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+
+def resolve_identity(headers: Dict[str, Any], anonymous_on_invalid: bool = False) -> Tuple[Optional[str], Optional[int]]:
+    '''
+    (user_id, channel_id) from a signed X-Auth-Token; raises InvalidAuthToken if the token
+    does not verify, unless anonymous_on_invalid is set: public reads use it so a stale or
+    expired token still gets the anonymous response. Without a token the raw X-User-Id
+    header is only trusted when AUTH_ALLOW_USER_ID_HEADER=1 (local development and the
+    bench), and then the channel is unknown.
+    '''
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    if token:
+        payload = verify_auth_token(token)
+        if payload:
+            return str(payload['uid']), payload.get('cid')
+        if not anonymous_on_invalid:
+            raise InvalidAuthToken()
+        return None, None
+    if AUTH_ALLOW_USER_ID_HEADER:
+        return headers.get('x-user-id') or headers.get('X-User-Id'), None
+    return None, None
+# <<< shared: auth
+
+
+# >>> shared: user_channel_cache (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+USER_CHANNEL_CACHE_SIZE = int(os.environ.get('USER_CHANNEL_CACHE_SIZE', '1024'))
+
+_user_channel_cache: 'OrderedDict[str, int]' = OrderedDict()
+_user_channel_cache_lock = threading.Lock()
+
+
+def cached_user_channel(user_id: str) -> Optional[int]:
+    with _user_channel_cache_lock:
+        channel_id = _user_channel_cache.get(user_id)
+        if channel_id is not None:
+            _user_channel_cache.move_to_end(user_id)
+        return channel_id
+
+
+def cache_user_channel(user_id: str, channel_id: int) -> None:
+    '''Remember user -> channel; the mapping is fixed at registration, so entries never go stale'''
+    with _user_channel_cache_lock:
+        _user_channel_cache[user_id] = channel_id
+        _user_channel_cache.move_to_end(user_id)
+        while len(_user_channel_cache) > USER_CHANNEL_CACHE_SIZE:
+            _user_channel_cache.popitem(last=False)
+# <<< shared: user_channel_cache
+
+
+def owned_channel_id(cur: Any, user_id: str, token_channel_id: Optional[int]) -> Optional[int]:
+    '''The caller's channel id from the token or cache, falling back to one lookup that is then cached'''
+    channel_id = token_channel_id or cached_user_channel(user_id)
+    if channel_id:
+        return channel_id
+    cur.execute('SELECT id FROM channels WHERE user_id = CAST(%s AS INTEGER)', (user_id,))
+    owned = cur.fetchone()
+    if not owned:
+        return None
+    cache_user_channel(user_id, owned['id'])
+    return owned['id']
+
+
+CHANNEL_VIDEOS_DEFAULT_LIMIT = 24
+CHANNEL_VIDEOS_MAX_LIMIT = 100
+VIDEO_TYPES = ('regular', 'series', 'movie')
+
+
+def encode_cursor(created_at: datetime, video_id: int) -> str:
+    raw = f'{created_at.isoformat()}|{video_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    '''Reverse encode_cursor, raising ValueError on anything malformed'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, video_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(video_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_limit(value: Optional[str]) -> int:
+    if not value:
+        return CHANNEL_VIDEOS_DEFAULT_LIMIT
+    return max(1, min(int(value), CHANNEL_VIDEOS_MAX_LIMIT))
+
+
+def list_channel_videos(cur: Any, channel_id: Any, video_type: Optional[str], limit: int,
+                        cursor: Optional[Tuple[datetime, int]]) -> Dict[str, Any]:
+    '''
+    One page of a channel's videos, newest first, with just the columns a video grid needs.
+    Keyset on (created_at, id) keeps every page a range scan of idx_videos_channel_created,
+    or of idx_videos_channel_type_created when filtering by type.
+    '''
+    conditions = ['v.channel_id = %s']
+    params: List[Any] = [channel_id]
+    if video_type:
+        conditions.append('v.video_type = %s')
+        params.append(video_type)
+    if cursor:
+        conditions.append('(v.created_at, v.id) < (%s, %s)')
+        params.extend(cursor)
+    params.append(limit + 1)
+    
+    cur.execute(f'''
+        SELECT v.id, v.title, v.thumbnail_url, v.duration, v.views_count, v.likes_count,
+               v.video_type, v.created_at
+        FROM videos v
+        WHERE {' AND '.join(conditions)}
+        ORDER BY v.created_at DESC, v.id DESC
+        LIMIT %s
+    ''', params)
+    rows = cur.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    
+    videos = []
+    with timed_phase('serialize'):
+        for row in rows:
+            video = dict(row)
+            video['created_at'] = video['created_at'].isoformat() if video['created_at'] else None
+            videos.append(video)
+    return {'videos': videos, 'next_cursor': next_cursor}
+
+
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_MAX_DAYS = 365
+ANALYTICS_TOP_VIDEOS = 10
+
+
+def channel_analytics(cur: Any, channel_id: int, days: int) -> Dict[str, Any]:
+    '''
+    Daily totals and top videos over the last days days, read only from video_views_daily
+    (kept by the rollup_views maintenance job), never from raw video_views. unique_viewers
+    are per-video daily uniques summed, not distinct across videos or days.
+    '''
+    cur.execute('''
+        SELECT d.day, SUM(d.views) AS views, SUM(d.unique_viewers) AS unique_viewers
+        FROM videos v
+        JOIN video_views_daily d ON d.video_id = v.id
+        WHERE v.channel_id = %s AND d.day > CURRENT_DATE - %s
+        GROUP BY d.day
+        ORDER BY d.day
+    ''', (channel_id, days))
+    daily = [
+        {'day': row['day'].isoformat(), 'views': int(row['views']), 'unique_viewers': int(row['unique_viewers'])}
+        for row in cur.fetchall()
+    ]
+    
+    cur.execute('''
+        SELECT v.id, v.title, SUM(d.views) AS views, SUM(d.unique_viewers) AS unique_viewers
+        FROM videos v
+        JOIN video_views_daily d ON d.video_id = v.id
+        WHERE v.channel_id = %s AND d.day > CURRENT_DATE - %s
+        GROUP BY v.id, v.title
+        ORDER BY views DESC, v.id DESC
+        LIMIT %s
+    ''', (channel_id, days, ANALYTICS_TOP_VIDEOS))
+    top_videos = [
+        {'id': row['id'], 'title': row['title'], 'views': int(row['views']), 'unique_viewers': int(row['unique_viewers'])}
+        for row in cur.fetchall()
+    ]
+    
+    return {
+        'days': days,
+        'total_views': sum(entry['views'] for entry in daily),
+        'daily': daily,
+        'top_videos': top_videos
+    }
+
+
+# channels.id is a SERIAL, so larger values cannot name a channel
+CHANNEL_ID_MAX = 2 ** 31 - 1
+
+# channels.version is bumped by every statement that changes a column the GET returns,
+# so (id, version) is a strong validator for the body
+CHANNEL_VERSION_SQL = "c.id || '-' || c.version"
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(headers: Dict[str, Any], etag: str) -> bool:
+    '''If-None-Match check using the weak comparison HTTP prescribes for conditional GETs'''
+    value = headers.get('if-none-match') or headers.get('If-None-Match')
+    if not value:
+        return False
+    if value.strip() == '*':
+        return True
+    return _opaque_tag(etag) in {_opaque_tag(tag) for tag in value.split(',')}
+
+
+@instrumented('channel')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Manage channel information - get details, update profile
+    Business: Manage channel information - get details, list channel videos, view analytics, update profile
     Args: event with httpMethod, body containing channel updates
           context with request_id
     Returns: HTTP response with channel data
@@ -20,42 +629,122 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, If-None-Match, X-Read-Primary-Until',
+                'Access-Control-Expose-Headers': 'ETag',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
     headers = event.get('headers', {})
-    user_id = headers.get('x-user-id') or headers.get('X-User-Id')
-    
+    conn = None
+    cur = None
     db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
+        user_id, token_channel_id = resolve_identity(headers, anonymous_on_invalid=method == 'GET')
         if method == 'GET':
-            query_params = event.get('queryStringParameters', {})
+            conn, db_url = get_read_connection(user_id, headers)
+        else:
+            conn = get_connection(db_url)
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        if method == 'GET':
+            query_params = event.get('queryStringParameters') or {}
             channel_id = query_params.get('channel_id')
+            if channel_id:
+                try:
+                    channel_id = int(channel_id)
+                    if not 0 < channel_id <= CHANNEL_ID_MAX:
+                        raise ValueError('channel_id out of range')
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid channel_id'})
+                    }
+            
+            if not channel_id and user_id:
+                channel_id = token_channel_id or cached_user_channel(user_id)
+            
+            if query_params.get('action') == 'analytics':
+                if not user_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Authentication required'})
+                    }
+                try:
+                    days = max(1, min(int(query_params.get('days') or ANALYTICS_DEFAULT_DAYS), ANALYTICS_MAX_DAYS))
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid days'})
+                    }
+                
+                # Analytics are only ever for the caller's own channel
+                owner_channel_id = owned_channel_id(cur, user_id, token_channel_id)
+                if not owner_channel_id:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Channel not found'})
+                    }
+                
+                analytics = channel_analytics(cur, owner_channel_id, days)
+                with timed_phase('serialize'):
+                    response_body = json.dumps({'channel_id': owner_channel_id, **analytics})
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Cache-Control': 'private, max-age=300'
+                    },
+                    'body': response_body
+                }
+            
+            if query_params.get('action') == 'videos':
+                video_type = query_params.get('video_type') or None
+                try:
+                    if video_type and video_type not in VIDEO_TYPES:
+                        raise ValueError('Unknown video_type')
+                    limit = parse_limit(query_params.get('limit'))
+                    cursor = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid video_type, limit or cursor'})
+                    }
+                
+                if not channel_id and user_id:
+                    channel_id = owned_channel_id(cur, user_id, token_channel_id)
+                if not channel_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'channel_id or user authentication required'})
+                    }
+                
+                page = list_channel_videos(cur, channel_id, video_type, limit, cursor)
+                with timed_phase('serialize'):
+                    response_body = json.dumps(page)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': response_body
+                }
             
             if channel_id:
-                cur.execute('''
-                    SELECT c.id, c.user_id, c.name as channel_name, c.description, 
-                           c.avatar_url, c.banner_url, c.is_verified, 
-                           c.subscribers_count, c.created_at,
-                           (SELECT COUNT(*) FROM videos WHERE channel_id = c.id) as videos_count
-                    FROM channels c
-                    WHERE c.id = %s
-                ''', (channel_id,))
+                where_clause = 'c.id = %s'
+                where_params = (channel_id,)
             elif user_id:
-                cur.execute('''
-                    SELECT c.id, c.user_id, c.name as channel_name, c.description, 
-                           c.avatar_url, c.banner_url, c.is_verified, 
-                           c.subscribers_count, c.created_at,
-                           (SELECT COUNT(*) FROM videos WHERE channel_id = c.id) as videos_count
-                    FROM channels c
-                    WHERE c.user_id = CAST(%s AS INTEGER)
-                ''', (user_id,))
+                where_clause = 'c.user_id = CAST(%s AS INTEGER)'
+                where_params = (user_id,)
             else:
                 return {
                     'statusCode': 400,
@@ -63,8 +752,36 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'channel_id or user authentication required'})
                 }
             
+            if headers.get('if-none-match') or headers.get('If-None-Match'):
+                # Revalidation reads one channels row; the body is skipped on a match
+                cur.execute(f'SELECT {CHANNEL_VERSION_SQL} AS version FROM channels c WHERE {where_clause}', where_params)
+                marker = cur.fetchone()
+                etag = '"%s"' % marker['version'] if marker else None
+                if etag and etag_matches(headers, etag):
+                    return {
+                        'statusCode': 304,
+                        'headers': {
+                            'Access-Control-Allow-Origin': '*',
+                            'ETag': etag,
+                            'Cache-Control': 'public, no-cache'
+                        },
+                        'body': ''
+                    }
+            
+            cur.execute(f'''
+                SELECT c.id, c.user_id, c.name as channel_name, c.description, 
+                       c.avatar_url, c.banner_url, c.is_verified, 
+                       c.subscribers_count, c.videos_count, c.created_at,
+                       {CHANNEL_VERSION_SQL} AS version
+                FROM channels c
+                WHERE {where_clause}
+            ''', where_params)
+            
             channel = cur.fetchone()
             
+            if channel and user_id and str(channel['user_id']) == user_id:
+                cache_user_channel(user_id, channel['id'])
+            
             if not channel:
                 return {
                     'statusCode': 404,
@@ -72,14 +789,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'Channel not found'})
                 }
             
-            channel_dict = dict(channel)
-            if 'created_at' in channel_dict and isinstance(channel_dict['created_at'], datetime):
-                channel_dict['created_at'] = channel_dict['created_at'].isoformat()
+            with timed_phase('serialize'):
+                channel_dict = dict(channel)
+                etag = '"%s"' % channel_dict.pop('version')
+                if 'created_at' in channel_dict and isinstance(channel_dict['created_at'], datetime):
+                    channel_dict['created_at'] = channel_dict['created_at'].isoformat()
+                response_body = json.dumps({'channel': channel_dict})
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'channel': channel_dict})
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'ETag': etag,
+                    'Cache-Control': 'public, no-cache'
+                },
+                'body': response_body
             }
         
         if method == 'PUT':
@@ -120,12 +845,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'No fields to update'})
                 }
             
-            values.append(user_id)
+            # Updating by primary key when the token or cache already names the channel
+            owner_channel_id = token_channel_id or cached_user_channel(user_id)
+            if owner_channel_id:
+                owner_clause = 'id = %s'
+                values.append(owner_channel_id)
+            else:
+                owner_clause = 'user_id = CAST(%s AS INTEGER)'
+                values.append(user_id)
             
             query = f'''
                 UPDATE channels 
-                SET {', '.join(update_fields)}
-                WHERE user_id = CAST(%s AS INTEGER)
+                SET {', '.join(update_fields)}, version = version + 1
+                WHERE {owner_clause}
                 RETURNING id, name as channel_name, description, avatar_url, banner_url, 
                           is_verified, subscribers_count
             '''
@@ -144,7 +876,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **mark_write(user_id)},
                 'body': json.dumps({
                     'message': 'Channel updated successfully',
                     'channel': dict(updated_channel)
@@ -157,13 +889,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'})
         }
         
+    except InvalidAuthToken:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid auth token'})
+        }
     except Exception as e:
-        conn.rollback()
+        if conn is not None:
+            conn.rollback()
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
         }
     finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        if cur is not None:
+            cur.close()
+        if conn is not None:
+            release_connection(conn, db_url)
\ No newline at end of file
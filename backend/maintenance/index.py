@@ -0,0 +1,819 @@
+import json
+import functools
+import os
+import hmac
+import math
+import re
+import shutil
+import threading
+import time
+from datetime import date, timedelta
+from contextlib import contextmanager
+from typing import Dict, Any, List, Tuple, Callable, Iterator
+import psycopg2
+
+# >>> shared: instrumentation (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+
+_request_timing = threading.local()
+
+
+def param_shape(value: Any) -> Any:
+    '''Types and sizes of query parameters, so slow-query logs never carry user data'''
+    if isinstance(value, dict):
+        return {key: param_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'{type(value).__name__}[{len(value)}]'
+        return [param_shape(item) for item in value]
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def add_timing(phase: str, seconds: float) -> None:
+    phases = getattr(_request_timing, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def tag_action(action: Any) -> None:
+    '''Name the action once the handler has parsed it from the body'''
+    if getattr(_request_timing, 'phases', None) is not None:
+        _request_timing.action = f'{_request_timing.method} {action}'
+
+
+def record_query(query: Any, params: Any, seconds: float) -> None:
+    add_timing('execute', seconds)
+    queries = getattr(_request_timing, 'queries', None)
+    if queries is not None:
+        queries.append(round(seconds * 1000, 3))
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        text = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+        print(json.dumps({'slow_query': {
+            'function': getattr(_request_timing, 'function', None),
+            'action': getattr(_request_timing, 'action', None),
+            'ms': round(seconds * 1000, 3),
+            'query': ' '.join(text.split())[:500],
+            'params': param_shape(params)
+        }}))
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    if getattr(_request_timing, 'phases', None) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - started)
+
+
+class _TimedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - started)
+    
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchall(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+
+
+_timed_cursor_classes: Dict[type, type] = {}
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''Connection whose cursors, whatever their cursor_factory, report execute and fetch time'''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursor_classes.get(base)
+        if timed is None:
+            timed = _timed_cursor_classes[base] = type(f'Timed{base.__name__}', (_TimedCursorMixin, base), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+INSTRUMENTED = REQUEST_TIMING or SLOW_QUERY_MS > 0
+CONNECTION_FACTORY = TimedConnection if INSTRUMENTED else None
+
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''
+    Wrap a handler so each request is timed by phase (connect, execute, fetch, serialize,
+    other). With REQUEST_TIMING=1 the phases go to a structured log line and a Server-Timing
+    header. When neither REQUEST_TIMING nor SLOW_QUERY_MS is set the handler is returned untouched.
+    '''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        if not INSTRUMENTED:
+            return handler
+        
+        @functools.wraps(handler)
+        def timed_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            query_params = event.get('queryStringParameters') or {}
+            _request_timing.function = function_name
+            _request_timing.method = event.get('httpMethod', 'GET')
+            _request_timing.action = f"{_request_timing.method} {query_params.get('action') or query_params.get('feed') or ''}".rstrip()
+            _request_timing.phases = phases = {}
+            _request_timing.queries = queries = []
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+            finally:
+                total = time.perf_counter() - started
+                _request_timing.phases = None
+                _request_timing.queries = None
+            
+            if REQUEST_TIMING:
+                phases['other'] = max(0.0, total - sum(phases.values()))
+                phases['total'] = total
+                print(json.dumps({'timing': {
+                    'function': function_name,
+                    'action': _request_timing.action,
+                    'status': response.get('statusCode'),
+                    'ms': {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+                    'queries_ms': queries
+                }}))
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items())
+                headers['Timing-Allow-Origin'] = '*'
+            return response
+        return timed_handler
+    return decorate
+# <<< shared: instrumentation
+
+
+# >>> shared: pool (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+# Caps the idle connections kept between invocations, not checkouts: every concurrent
+# invocation on an instance holds its own connection, so open connections track request
+# concurrency. Bound that with the platform's per-instance concurrency or a server-side pooler.
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_db_pool: Dict[str, List[Tuple[Any, float]]] = {}
+_db_pool_lock = threading.Lock()
+DB_POOL_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'discarded': 0}
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _ping(conn: Any) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(dsn: str) -> Any:
+    '''
+    Take an idle pooled connection for dsn or open a new one; a miss never waits for a
+    connection to be released, see DB_POOL_MAX_SIZE. Connections idle longer than
+    DB_POOL_CHECK_AFTER seconds are pinged before reuse.
+    '''
+    started = time.perf_counter()
+    while True:
+        with _db_pool_lock:
+            idle = _db_pool.get(dsn)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            break
+        conn, released_at = entry
+        if not conn.closed and (time.monotonic() - released_at < DB_POOL_CHECK_AFTER or _ping(conn)):
+            DB_POOL_STATS['hits'] += 1
+            add_timing('connect', time.perf_counter() - started)
+            return conn
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+    
+    DB_POOL_STATS['misses'] += 1
+    if INSTRUMENTED:
+        print(json.dumps({'db_pool': DB_POOL_STATS}))
+    conn = psycopg2.connect(dsn, connection_factory=CONNECTION_FACTORY)
+    add_timing('connect', time.perf_counter() - started)
+    return conn
+
+
+def release_connection(conn: Any, dsn: str) -> None:
+    '''
+    Roll back any unfinished transaction and keep conn for the next warm invocation.
+    Broken connections and connections over DB_POOL_MAX_SIZE are closed instead.
+    '''
+    if conn is None:
+        return
+    try:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    
+    if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+        return
+    
+    with _db_pool_lock:
+        idle = _db_pool.setdefault(dsn, [])
+        if len(idle) < DB_POOL_MAX_SIZE:
+            idle.append((conn, time.monotonic()))
+            return
+    _close_quietly(conn)
+# <<< shared: pool
+
+
+DEFAULT_BATCH_SIZE = 1000
+MAINTENANCE_TIME_BUDGET = float(os.environ.get('MAINTENANCE_TIME_BUDGET', '20'))
+BLOB_GC_GRACE_SECONDS = int(os.environ.get('BLOB_GC_GRACE_SECONDS', '86400'))
+STORAGE_ROOT = os.environ.get('STORAGE_ROOT', '/tmp/video-storage')
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get('UPLOAD_SESSION_TTL_SECONDS', '86400'))
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', '24'))
+TRENDING_LIKE_WEIGHT = float(os.environ.get('TRENDING_LIKE_WEIGHT', '3'))
+TRENDING_REBASE_HALF_LIVES = 30
+TRENDING_MIN_SCORE = 0.001
+TRENDING_SETTLE_SECONDS = int(os.environ.get('TRENDING_SETTLE_SECONDS', '60'))
+VIEW_ROLLUP_SETTLE_SECONDS = int(os.environ.get('VIEW_ROLLUP_SETTLE_SECONDS', '3600'))
+VIEW_PARTITION_MONTHS_AHEAD = int(os.environ.get('VIEW_PARTITION_MONTHS_AHEAD', '2'))
+VIEW_RAW_RETENTION_DAYS = int(os.environ.get('VIEW_RAW_RETENTION_DAYS', '90'))
+VIEW_PARTITION_ARCHIVE_SCHEMA = os.environ.get('VIEW_PARTITION_ARCHIVE_SCHEMA', '')
+VIEW_PARTITION_PATTERN = re.compile(r'^video_views_p(\d{4})(\d{2})$')
+BLOB_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+BLOB_PREFIXES = 256
+
+
+def reconcile_likes(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''
+    Recompute likes_count/dislikes_count for the next batch of videos with id > after_id
+    from video_likes, writing only rows that drifted. Each batch is its own transaction.
+    '''
+    with conn.cursor() as cur:
+        cur.execute('''
+            WITH chunk AS (
+                SELECT id FROM videos WHERE id > %s ORDER BY id LIMIT %s
+            ), actual AS (
+                SELECT ch.id,
+                       COUNT(l.id) FILTER (WHERE l.is_like) AS likes,
+                       COUNT(l.id) FILTER (WHERE NOT l.is_like) AS dislikes
+                FROM chunk ch
+                LEFT JOIN video_likes l ON l.video_id = ch.id
+                GROUP BY ch.id
+            ), fixed AS (
+                UPDATE videos v SET likes_count = a.likes, dislikes_count = a.dislikes
+                FROM actual a
+                WHERE v.id = a.id
+                  AND (v.likes_count IS DISTINCT FROM a.likes OR v.dislikes_count IS DISTINCT FROM a.dislikes)
+                RETURNING v.id
+            )
+            SELECT (SELECT MAX(id) FROM chunk), (SELECT COUNT(*) FROM chunk), (SELECT COUNT(*) FROM fixed)
+        ''', (after_id, batch_size))
+        last_id, scanned, fixed = cur.fetchone()
+    conn.commit()
+    return {'last_id': last_id, 'scanned': scanned, 'fixed': fixed}
+
+
+def reconcile_subscribers(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''Rebuild channels.subscribers_count from subscriptions for the next batch of channels'''
+    with conn.cursor() as cur:
+        cur.execute('''
+            WITH chunk AS (
+                SELECT id FROM channels WHERE id > %s ORDER BY id LIMIT %s
+            ), actual AS (
+                SELECT ch.id, COUNT(s.id) AS subscribers
+                FROM chunk ch
+                LEFT JOIN subscriptions s ON s.channel_id = ch.id
+                GROUP BY ch.id
+            ), fixed AS (
+                UPDATE channels c SET subscribers_count = a.subscribers, version = c.version + 1
+                FROM actual a
+                WHERE c.id = a.id AND c.subscribers_count IS DISTINCT FROM a.subscribers
+                RETURNING c.id
+            )
+            SELECT (SELECT MAX(id) FROM chunk), (SELECT COUNT(*) FROM chunk), (SELECT COUNT(*) FROM fixed)
+        ''', (after_id, batch_size))
+        last_id, scanned, fixed = cur.fetchone()
+    conn.commit()
+    return {'last_id': last_id, 'scanned': scanned, 'fixed': fixed}
+
+
+def reconcile_videos_count(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''Rebuild channels.videos_count from videos for the next batch of channels'''
+    with conn.cursor() as cur:
+        cur.execute('''
+            WITH chunk AS (
+                SELECT id FROM channels WHERE id > %s ORDER BY id LIMIT %s
+            ), actual AS (
+                SELECT ch.id, COUNT(v.id) AS videos
+                FROM chunk ch
+                LEFT JOIN videos v ON v.channel_id = ch.id
+                GROUP BY ch.id
+            ), fixed AS (
+                UPDATE channels c SET videos_count = a.videos, version = c.version + 1
+                FROM actual a
+                WHERE c.id = a.id AND c.videos_count IS DISTINCT FROM a.videos
+                RETURNING c.id
+            )
+            SELECT (SELECT MAX(id) FROM chunk), (SELECT COUNT(*) FROM chunk), (SELECT COUNT(*) FROM fixed)
+        ''', (after_id, batch_size))
+        last_id, scanned, fixed = cur.fetchone()
+    conn.commit()
+    return {'last_id': last_id, 'scanned': scanned, 'fixed': fixed}
+
+
+def unlink_unreferenced_blobs(conn: Any, hashes: List[str]) -> int:
+    '''
+    Remove the stored files of the given hashes that have no blobs row, one hash per
+    transaction under an exclusive advisory lock on it. upload's find_blob holds the shared
+    lock until its transaction commits, so a concurrent upload of the same content either
+    registers its row first, and the file stays, or starts after the unlink and writes the
+    file again. Returns the number of files removed.
+    '''
+    removed = 0
+    for sha256 in hashes:
+        with conn.cursor() as cur:
+            # Separate statements: the check needs a snapshot taken after the lock is granted
+            cur.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', (sha256,))
+            cur.execute('SELECT 1 FROM blobs WHERE sha256 = %s', (sha256,))
+            if cur.fetchone() is None:
+                try:
+                    os.remove(os.path.join(STORAGE_ROOT, 'blobs', sha256[:2], sha256))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        conn.commit()
+    return removed
+
+
+def gc_blobs(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''
+    Delete blobs in the next id batch that no video or open upload session references and
+    that have not been seen for BLOB_GC_GRACE_SECONDS, then remove their stored objects.
+    Objects are removed only after the rows are committed, so a failure leaves orphan
+    files rather than dangling references; sweep_blob_files collects those.
+    '''
+    with conn.cursor() as cur:
+        cur.execute('''
+            WITH chunk AS (
+                SELECT id FROM blobs WHERE id > %s ORDER BY id LIMIT %s
+            ), removed AS (
+                DELETE FROM blobs b
+                USING chunk ch
+                WHERE b.id = ch.id
+                  AND b.last_seen_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                  AND NOT EXISTS (SELECT 1 FROM videos v WHERE v.video_blob = b.sha256 OR v.thumbnail_blob = b.sha256)
+                  AND NOT EXISTS (SELECT 1 FROM upload_sessions s WHERE s.sha256 = b.sha256 AND s.status = 'open')
+                RETURNING b.sha256
+            )
+            SELECT (SELECT MAX(id) FROM chunk), (SELECT COUNT(*) FROM chunk),
+                   COALESCE((SELECT array_agg(sha256::text) FROM removed), ARRAY[]::text[])
+        ''', (after_id, batch_size, BLOB_GC_GRACE_SECONDS))
+        last_id, scanned, removed_hashes = cur.fetchone()
+    conn.commit()
+    
+    unlink_unreferenced_blobs(conn, removed_hashes)
+    return {'last_id': last_id, 'scanned': scanned, 'fixed': len(removed_hashes)}
+
+
+def sweep_blob_files(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''
+    Remove stored blob files with no blobs row, such as those written by an upload whose
+    transaction then rolled back, and temp files left by interrupted writes. Each batch
+    is one blobs/<prefix>/ directory; after_id is the number of prefixes already swept.
+    Only files untouched for BLOB_GC_GRACE_SECONDS are considered, so uploads in flight
+    keep theirs.
+    '''
+    if after_id >= BLOB_PREFIXES:
+        return {'last_id': None, 'scanned': 0, 'fixed': 0}
+    
+    directory = os.path.join(STORAGE_ROOT, 'blobs', f'{after_id:02x}')
+    cutoff = time.time() - BLOB_GC_GRACE_SECONDS
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        names = []
+    
+    stale: List[str] = []
+    for name in names:
+        try:
+            if os.stat(os.path.join(directory, name)).st_mtime < cutoff:
+                stale.append(name)
+        except FileNotFoundError:
+            pass
+    
+    removed = 0
+    for name in stale:
+        if name.startswith('.') and name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    
+    candidates = [name for name in stale if BLOB_NAME_PATTERN.match(name)]
+    if candidates:
+        with conn.cursor() as cur:
+            cur.execute('SELECT sha256 FROM blobs WHERE sha256 = ANY(%s::char(64)[])', (candidates,))
+            registered = {row[0] for row in cur.fetchall()}
+        conn.commit()
+        removed += unlink_unreferenced_blobs(conn, [name for name in candidates if name not in registered])
+    
+    return {'last_id': after_id + 1, 'scanned': len(names), 'fixed': removed, 'more': after_id + 1 < BLOB_PREFIXES}
+
+
+def expire_uploads(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''
+    Expire open upload sessions with no activity (creation or last chunk) for
+    UPLOAD_SESSION_TTL_SECONDS: mark them expired, drop their chunk rows and remove their
+    staging directories. Expired sessions leave the open set, so each batch takes the
+    oldest remaining ones and after_id only signals progress. Sessions locked by a chunk
+    write or a complete are skipped and retried on the next run.
+    '''
+    with conn.cursor() as cur:
+        cur.execute('''
+            WITH chunk AS (
+                SELECT s.id FROM upload_sessions s
+                WHERE s.status = 'open'
+                  AND GREATEST(s.created_at, (SELECT MAX(ch.received_at) FROM upload_chunks ch WHERE ch.session_id = s.id))
+                      < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                ORDER BY s.created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ), dropped AS (
+                DELETE FROM upload_chunks ch USING chunk c WHERE ch.session_id = c.id
+            ), expired AS (
+                UPDATE upload_sessions s SET status = 'expired'
+                FROM chunk c
+                WHERE s.id = c.id
+                RETURNING s.id
+            )
+            SELECT COALESCE((SELECT array_agg(id) FROM expired), ARRAY[]::text[])
+        ''', (UPLOAD_SESSION_TTL_SECONDS, batch_size))
+        expired_ids = cur.fetchone()[0]
+    conn.commit()
+    
+    for upload_id in expired_ids:
+        shutil.rmtree(os.path.join(STORAGE_ROOT, 'staging', upload_id), ignore_errors=True)
+    return {'last_id': after_id + len(expired_ids) if expired_ids else None, 'scanned': len(expired_ids), 'fixed': len(expired_ids)}
+
+
+def update_trending(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''
+    Fold the next batch of new views and likes into video_trending. Scores use forward
+    decay: each event adds weight * exp(lambda * (event_time - epoch)), so older scores
+    never need rewriting and ordering by score equals ordering by decayed score now.
+    When the epoch gets TRENDING_REBASE_HALF_LIVES half-lives old, all scores are scaled
+    down once and the epoch moves forward to keep values in float range.
+    
+    Rows are read in (recorded_at, id) / (reacted_at, id) order, and only once they are
+    TRENDING_SETTLE_SECONDS old: ids can commit out of order, but a write transaction
+    shorter than the settle window has committed by then. A like scores only the first
+    time its (user, video) pair likes, recorded in trending_like_credits, so toggling a
+    reaction cannot inflate the score; like a view, it is then never taken back. Progress
+    is kept in trending_state, so after_id is ignored.
+    
+    A rebase bumps trending_state.updated_at, the feed's ETag marker, and adds its factor
+    to score_log_scale so open trending cursors can rescale their starting score.
+    '''
+    decay_rate = math.log(2) / (TRENDING_HALF_LIFE_HOURS * 3600)
+    
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT epoch, views_through, views_through_id, likes_through, likes_through_id,
+                   EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - epoch))
+            FROM trending_state WHERE id = 1 FOR UPDATE
+        ''')
+        epoch, views_through, views_through_id, likes_through, likes_through_id, epoch_age = cur.fetchone()
+        
+        if epoch_age > TRENDING_REBASE_HALF_LIVES * TRENDING_HALF_LIFE_HOURS * 3600:
+            cur.execute('''
+                UPDATE video_trending SET score = score * exp(-%s * %s)
+            ''', (decay_rate, epoch_age))
+            cur.execute('DELETE FROM video_trending WHERE score < %s', (TRENDING_MIN_SCORE,))
+            cur.execute('''
+                UPDATE trending_state SET
+                    epoch = epoch + make_interval(secs => %s), score_log_scale = score_log_scale + %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = 1
+                RETURNING epoch
+            ''', (epoch_age, decay_rate * epoch_age))
+            epoch = cur.fetchone()[0]
+        
+        cur.execute('''
+            WITH views AS (
+                SELECT id, video_id, viewed_at AS happened_at, recorded_at AS written_at
+                FROM video_views
+                WHERE (recorded_at, id) > (%(views_through)s, %(views_through_id)s)
+                  AND recorded_at <= CURRENT_TIMESTAMP - make_interval(secs => %(settle)s)
+                ORDER BY recorded_at, id LIMIT %(batch_size)s
+            ), likes AS (
+                -- Dislikes are read too, so the watermark moves past them
+                SELECT id, user_id, video_id, is_like, reacted_at AS written_at
+                FROM video_likes
+                WHERE (reacted_at, id) > (%(likes_through)s, %(likes_through_id)s)
+                  AND reacted_at <= CURRENT_TIMESTAMP - make_interval(secs => %(settle)s)
+                ORDER BY reacted_at, id LIMIT %(batch_size)s
+            ), credited AS (
+                INSERT INTO trending_like_credits (user_id, video_id)
+                SELECT user_id, video_id FROM likes WHERE is_like
+                ON CONFLICT DO NOTHING
+                RETURNING user_id, video_id
+            ), events AS (
+                SELECT video_id, 1.0 AS weight, happened_at FROM views
+                UNION ALL
+                SELECT l.video_id, %(like_weight)s, l.written_at
+                FROM likes l
+                JOIN credited c ON c.user_id = l.user_id AND c.video_id = l.video_id
+            ), deltas AS (
+                SELECT video_id, SUM(weight * exp(%(decay_rate)s * EXTRACT(EPOCH FROM (COALESCE(happened_at, CURRENT_TIMESTAMP) - %(epoch)s)))) AS delta
+                FROM events
+                GROUP BY video_id
+            ), upserted AS (
+                INSERT INTO video_trending (video_id, score, updated_at)
+                SELECT video_id, delta, CURRENT_TIMESTAMP FROM deltas
+                ON CONFLICT (video_id)
+                DO UPDATE SET score = video_trending.score + EXCLUDED.score, updated_at = EXCLUDED.updated_at
+                RETURNING video_id
+            ), last_view AS (
+                SELECT written_at, id FROM views ORDER BY written_at DESC, id DESC LIMIT 1
+            ), last_like AS (
+                SELECT written_at, id FROM likes ORDER BY written_at DESC, id DESC LIMIT 1
+            )
+            SELECT (SELECT written_at FROM last_view), (SELECT id FROM last_view), (SELECT COUNT(*) FROM views),
+                   (SELECT written_at FROM last_like), (SELECT id FROM last_like), (SELECT COUNT(*) FROM likes),
+                   (SELECT COUNT(*) FROM upserted)
+        ''', {
+            'views_through': views_through, 'views_through_id': views_through_id,
+            'likes_through': likes_through, 'likes_through_id': likes_through_id,
+            'settle': TRENDING_SETTLE_SECONDS, 'batch_size': batch_size, 'like_weight': TRENDING_LIKE_WEIGHT,
+            'decay_rate': decay_rate, 'epoch': epoch
+        })
+        last_view_at, last_view_id, views, last_like_at, last_like_id, likes, touched = cur.fetchone()
+        
+        if views or likes:
+            cur.execute('''
+                UPDATE trending_state SET
+                    views_through = %s, views_through_id = %s, likes_through = %s, likes_through_id = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = 1
+            ''', (last_view_at or views_through, last_view_id or views_through_id,
+                  last_like_at or likes_through, last_like_id or likes_through_id))
+    conn.commit()
+    return {'last_id': max(last_view_id or 0, last_like_id or 0) or None, 'scanned': views + likes, 'fixed': touched}
+
+
+def rollup_views(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''
+    Rebuild video_views_daily for the next day after view_rollup_state.rolled_through
+    (or after the day ordinal in after_id). A day is recomputed whole from its raw
+    partition, so reruns are idempotent. Days stay open, and are recomputed by later
+    runs, until VIEW_ROLLUP_SETTLE_SECONDS after they end, so late buffered views still count.
+    '''
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT rolled_through, CURRENT_DATE, (CURRENT_TIMESTAMP - make_interval(secs => %s))::date
+            FROM view_rollup_state WHERE id = 1 FOR UPDATE
+        ''', (VIEW_ROLLUP_SETTLE_SECONDS,))
+        rolled_through, today, settled_before = cur.fetchone()
+        
+        if rolled_through is None:
+            cur.execute('SELECT MIN(viewed_at)::date FROM video_views')
+            day = cur.fetchone()[0] or today
+        else:
+            day = rolled_through + timedelta(days=1)
+        if after_id:
+            day = max(day, date.fromordinal(after_id) + timedelta(days=1))
+        
+        if day > today:
+            conn.commit()
+            return {'last_id': None, 'scanned': 0, 'fixed': 0}
+        
+        cur.execute('''
+            WITH counted AS (
+                SELECT video_id, COUNT(*) AS views, COUNT(DISTINCT user_id) AS unique_viewers
+                FROM video_views
+                WHERE viewed_at >= %s AND viewed_at < %s + 1
+                GROUP BY video_id
+            ), upserted AS (
+                INSERT INTO video_views_daily (video_id, day, views, unique_viewers)
+                SELECT video_id, %s, views, unique_viewers FROM counted
+                ON CONFLICT (video_id, day) DO UPDATE
+                SET views = EXCLUDED.views, unique_viewers = EXCLUDED.unique_viewers
+                WHERE (video_views_daily.views, video_views_daily.unique_viewers)
+                      IS DISTINCT FROM (EXCLUDED.views, EXCLUDED.unique_viewers)
+                RETURNING 1
+            )
+            SELECT (SELECT COALESCE(SUM(views), 0) FROM counted), (SELECT COUNT(*) FROM upserted)
+        ''', (day, day, day))
+        scanned, fixed = cur.fetchone()
+        
+        if day < settled_before:
+            cur.execute('''
+                UPDATE view_rollup_state SET rolled_through = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = 1 AND rolled_through IS NOT DISTINCT FROM %s
+            ''', (day, rolled_through))
+    conn.commit()
+    
+    more = day < today
+    return {'last_id': day.toordinal() if more else None, 'scanned': int(scanned), 'fixed': fixed, 'more': more}
+
+
+def manage_view_partitions(conn: Any, after_id: int, batch_size: int) -> Dict[str, int]:
+    '''
+    Create video_views month partitions VIEW_PARTITION_MONTHS_AHEAD months ahead, then
+    detach months that ended more than VIEW_RAW_RETENTION_DAYS ago and are fully rolled
+    up. Detached months move to VIEW_PARTITION_ARCHIVE_SCHEMA when set, else are dropped.
+    '''
+    if VIEW_PARTITION_ARCHIVE_SCHEMA and not re.match(r'^[a-z_][a-z0-9_]*$', VIEW_PARTITION_ARCHIVE_SCHEMA):
+        raise ValueError('Invalid VIEW_PARTITION_ARCHIVE_SCHEMA')
+    
+    created = removed = 0
+    with conn.cursor() as cur:
+        cur.execute('SELECT CURRENT_DATE, rolled_through FROM view_rollup_state WHERE id = 1')
+        today, rolled_through = cur.fetchone()
+        
+        month_start = today.replace(day=1)
+        for _ in range(VIEW_PARTITION_MONTHS_AHEAD + 1):
+            next_month = (month_start + timedelta(days=32)).replace(day=1)
+            name = f'video_views_p{month_start:%Y%m}'
+            cur.execute('SELECT to_regclass(%s)', (name,))
+            if cur.fetchone()[0] is None:
+                cur.execute(f'''
+                    CREATE TABLE {name} PARTITION OF video_views
+                    FOR VALUES FROM (%s) TO (%s)
+                ''', (month_start, next_month))
+                created += 1
+            month_start = next_month
+        
+        cur.execute('''
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'video_views'::regclass
+        ''')
+        partitions = [row[0] for row in cur.fetchall()]
+        
+        # A month may go once its last day is past retention and already in the rollups
+        cutoff = today - timedelta(days=VIEW_RAW_RETENTION_DAYS)
+        if rolled_through is None:
+            cutoff = date.min
+        else:
+            cutoff = min(cutoff, rolled_through + timedelta(days=1))
+        
+        for name in sorted(partitions):
+            match = VIEW_PARTITION_PATTERN.match(name)
+            if not match:
+                continue
+            month_start = date(int(match.group(1)), int(match.group(2)), 1)
+            if (month_start + timedelta(days=32)).replace(day=1) > cutoff:
+                continue
+            cur.execute(f'ALTER TABLE video_views DETACH PARTITION {name}')
+            if VIEW_PARTITION_ARCHIVE_SCHEMA:
+                cur.execute(f'CREATE SCHEMA IF NOT EXISTS {VIEW_PARTITION_ARCHIVE_SCHEMA}')
+                cur.execute(f'ALTER TABLE {name} SET SCHEMA {VIEW_PARTITION_ARCHIVE_SCHEMA}')
+            else:
+                cur.execute(f'DROP TABLE {name}')
+            removed += 1
+    conn.commit()
+    return {'last_id': None, 'scanned': len(partitions), 'fixed': created + removed}
+
+
+JOBS: Dict[str, Callable[[Any, int, int], Dict[str, int]]] = {
+    'reconcile_likes': reconcile_likes,
+    'reconcile_subscribers': reconcile_subscribers,
+    'reconcile_videos_count': reconcile_videos_count,
+    'gc_blobs': gc_blobs,
+    'sweep_blob_files': sweep_blob_files,
+    'expire_uploads': expire_uploads,
+    'update_trending': update_trending,
+    'rollup_views': rollup_views,
+    'manage_view_partitions': manage_view_partitions,
+}
+
+
+@instrumented('maintenance')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Run batch maintenance jobs - counter reconciliation and other offline repairs
+    Args: event with httpMethod, X-Maintenance-Token header, body (job, batch_size, after_id)
+          context with request_id
+    Returns: HTTP response with processed/fixed row counts and next_after_id to resume from
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Maintenance-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    headers = event.get('headers', {})
+    token = headers.get('x-maintenance-token') or headers.get('X-Maintenance-Token') or ''
+    expected_token = os.environ.get('MAINTENANCE_TOKEN', '')
+    
+    if not expected_token or not hmac.compare_digest(token, expected_token):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Forbidden'})
+        }
+    
+    try:
+        body_data = json.loads(event.get('body') or '{}')
+        job_name = body_data.get('job')
+        after_id = int(body_data.get('after_id', 0))
+        batch_size = max(1, int(body_data.get('batch_size', DEFAULT_BATCH_SIZE)))
+    except (TypeError, ValueError, AttributeError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid JSON body, after_id or batch_size'})
+        }
+    job = JOBS.get(job_name) if isinstance(job_name, str) else None
+    tag_action(job_name)
+    
+    if not job:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unknown job', 'jobs': sorted(JOBS)})
+        }
+    
+    db_url = os.environ.get('DATABASE_URL')
+    conn = None
+    started = time.monotonic()
+    totals = {'batches': 0, 'scanned': 0, 'fixed': 0}
+    done = False
+    
+    try:
+        conn = get_connection(db_url)
+        # Work in batches until the table is exhausted or the time budget runs out;
+        # callers resume from next_after_id
+        while time.monotonic() - started < MAINTENANCE_TIME_BUDGET:
+            result = job(conn, after_id, batch_size)
+            totals['batches'] += 1
+            totals['scanned'] += result['scanned']
+            totals['fixed'] += result['fixed']
+            if result['last_id'] is None or (result['scanned'] < batch_size and not result.get('more')):
+                done = True
+                break
+            after_id = result['last_id']
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                **totals,
+                'done': done,
+                'next_after_id': None if done else after_id
+            })
+        }
+        
+    except Exception as e:
+        if conn is not None:
+            conn.rollback()
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e), 'next_after_id': after_id})
+        }
+    finally:
+        release_connection(conn, db_url)
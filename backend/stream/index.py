@@ -0,0 +1,254 @@
+import json
+import base64
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Any, Optional, Tuple
+
+STREAM_MAX_RANGE = int(os.environ.get('STREAM_MAX_RANGE', str(1024 * 1024)))
+STREAM_MMAP_CACHE_SIZE = int(os.environ.get('STREAM_MMAP_CACHE_SIZE', '64'))
+BLOB_KEY_PATTERN = re.compile(r'^blobs/([0-9a-f]{2})/(\1[0-9a-f]{62})$')
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Leading bytes of the formats upload accepts; blobs carry no extension
+CONTENT_SIGNATURES = [
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'\x1a\x45\xdf\xa3', 'video/webm'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG', 'image/png'),
+]
+
+
+class LocalStorage:
+    '''
+    Read side of upload's LocalStorage: blobs live at <root>/<key>. Files are mapped
+    rather than read, so serving a range touches only the pages it covers and the
+    page cache is shared by every request for the same blob.
+    '''
+    
+    def __init__(self, root: str):
+        self.root = root
+        self._maps: 'OrderedDict[str, Tuple[int, float, mmap.mmap]]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def open(self, key: str) -> Optional[Tuple[mmap.mmap, int, float]]:
+        '''
+        (mapping, size, mtime) for key, or None if it does not exist. Mappings are kept in
+        an LRU of STREAM_MMAP_CACHE_SIZE; a stat per call notices files replaced or
+        removed by the blob garbage collector.
+        '''
+        path = os.path.join(self.root, key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+        
+        with self._lock:
+            cached = self._maps.get(key)
+            if cached and cached[0] == stat.st_ino and cached[1] == stat.st_mtime:
+                self._maps.move_to_end(key)
+                return cached[2], stat.st_size, stat.st_mtime
+        
+        if stat.st_size == 0:
+            return None
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        # Replaced or evicted mappings are not closed here: a concurrent request may still be
+        # slicing one, and each is unmapped once its last reference goes away
+        with self._lock:
+            self._maps[key] = (stat.st_ino, stat.st_mtime, mapping)
+            self._maps.move_to_end(key)
+            while len(self._maps) > STREAM_MMAP_CACHE_SIZE:
+                self._maps.popitem(last=False)
+        return mapping, stat.st_size, stat.st_mtime
+    
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            self._maps.pop(key, None)
+
+
+STORAGE_BACKENDS = {'local': LocalStorage}
+
+_storage: Optional[LocalStorage] = None
+
+
+def get_storage() -> LocalStorage:
+    global _storage
+    if _storage is None:
+        backend = STORAGE_BACKENDS[os.environ.get('STORAGE_BACKEND', 'local')]
+        # A relative root is taken from the function directory, where tests.json keeps its fixtures
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.environ.get('STORAGE_ROOT', '/tmp/video-storage'))
+        _storage = backend(root)
+    return _storage
+
+
+def header(headers: Dict[str, Any], name: str) -> Optional[str]:
+    '''Case-insensitive header lookup; gateways differ in how they pass names'''
+    lowered = name.lower()
+    for key, value in headers.items():
+        if key.lower() == lowered:
+            return value
+    return None
+
+
+def sniff_content_type(mapping: mmap.mmap) -> str:
+    for offset, signature, content_type in CONTENT_SIGNATURES:
+        if mapping[offset:offset + len(signature)] == signature:
+            return content_type
+    return 'application/octet-stream'
+
+
+def parse_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    '''
+    Inclusive (start, end) for a single "bytes=" range, or None if it cannot be satisfied.
+    Raises ValueError for ranges this handler does not serve (malformed or multipart),
+    which the caller answers with the whole representation as RFC 9110 allows.
+    '''
+    match = RANGE_PATTERN.match(value.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        raise ValueError('Unsupported range')
+    first, last = match.groups()
+    if first == '':
+        suffix = int(last)
+        if suffix == 0:
+            return None
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+
+def not_modified(headers: Dict[str, Any], etag: str, mtime: float) -> bool:
+    if_none_match = header(headers, 'If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+    if_modified_since = header(headers, 'If-Modified-Since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def range_applies(headers: Dict[str, Any], etag: str, last_modified: str) -> bool:
+    '''If-Range: honour Range only while the client's copy is still current'''
+    if_range = header(headers, 'If-Range')
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Stream stored video and thumbnail blobs with HTTP Range, ETag and Last-Modified
+    Args: event with httpMethod (GET/HEAD), queryStringParameters.key (blobs/<aa>/<sha256>)
+          and optional Range, If-Range, If-None-Match, If-Modified-Since headers
+    Returns: 206 with the requested window (at most STREAM_MAX_RANGE bytes), 200 with the whole
+             blob if it fits in one window, 400 for a larger blob without a usable Range, 304 or 416;
+             HEAD answers 200 with the whole blob's Content-Length
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    cors = {'Access-Control-Allow-Origin': '*'}
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, HEAD, OPTIONS',
+                'Access-Control-Allow-Headers': 'Range, If-Range, If-None-Match, If-Modified-Since',
+                'Access-Control-Expose-Headers': 'Accept-Ranges, Content-Range, Content-Length, ETag, Last-Modified',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    if method not in ('GET', 'HEAD'):
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', **cors},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    query_params = event.get('queryStringParameters') or {}
+    match = BLOB_KEY_PATTERN.match(query_params.get('key') or '')
+    opened = get_storage().open(match.group(0)) if match else None
+    if not opened:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', **cors},
+            'body': json.dumps({'error': 'Not found'}),
+            'isBase64Encoded': False
+        }
+    
+    mapping, size, mtime = opened
+    headers = event.get('headers') or {}
+    # Keys are content hashes, so the hash is a strong validator and the bytes never change
+    etag = f'"{match.group(2)}"'
+    last_modified = formatdate(mtime, usegmt=True)
+    response_headers = {
+        **cors,
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Access-Control-Expose-Headers': 'Accept-Ranges, Content-Range, Content-Length, ETag, Last-Modified'
+    }
+    
+    if not_modified(headers, etag, mtime):
+        return {'statusCode': 304, 'headers': response_headers, 'body': '', 'isBase64Encoded': False}
+    
+    requested = None
+    range_header = header(headers, 'Range')
+    if range_header and range_applies(headers, etag, last_modified):
+        try:
+            requested = parse_range(range_header, size)
+        except ValueError:
+            pass
+        else:
+            if requested is None:
+                return {
+                    'statusCode': 416,
+                    'headers': {**response_headers, 'Content-Range': f'bytes */{size}'},
+                    'body': '',
+                    'isBase64Encoded': False
+                }
+    
+    # The platform buffers whole response bodies, so a response never carries more than
+    # STREAM_MAX_RANGE bytes. A honoured range is shortened to that window and players
+    # continue with the next one; the whole representation is only sent if it fits.
+    # HEAD carries no body, so it always describes the whole blob
+    if requested is not None and method != 'HEAD':
+        status = 206
+        start, end = requested
+        end = min(end, start + STREAM_MAX_RANGE - 1)
+        response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    elif size <= STREAM_MAX_RANGE or method == 'HEAD':
+        status = 200
+        start, end = 0, size - 1
+    else:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', **cors, 'Accept-Ranges': 'bytes'},
+            'body': json.dumps({'error': f'Blobs over {STREAM_MAX_RANGE} bytes must be requested with a single Range'}),
+            'isBase64Encoded': False
+        }
+    
+    response_headers['Content-Type'] = sniff_content_type(mapping)
+    response_headers['Content-Length'] = str(end - start + 1)
+    
+    return {
+        'statusCode': status,
+        'headers': response_headers,
+        'body': '' if method == 'HEAD' else base64.b64encode(mapping[start:end + 1]).decode(),
+        'isBase64Encoded': method != 'HEAD'
+    }
\ No newline at end of file
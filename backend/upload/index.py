@@ -1,19 +1,563 @@
 import json
+import functools
 import os
+import re
+import shutil
+import secrets
+import tempfile
+import threading
 import base64
 import hashlib
+import hmac
 import time
-from typing import Dict, Any
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple, Callable, Iterator
 from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+# >>> shared: instrumentation (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+
+_request_timing = threading.local()
+
+
+def param_shape(value: Any) -> Any:
+    '''Types and sizes of query parameters, so slow-query logs never carry user data'''
+    if isinstance(value, dict):
+        return {key: param_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'{type(value).__name__}[{len(value)}]'
+        return [param_shape(item) for item in value]
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def add_timing(phase: str, seconds: float) -> None:
+    phases = getattr(_request_timing, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def tag_action(action: Any) -> None:
+    '''Name the action once the handler has parsed it from the body'''
+    if getattr(_request_timing, 'phases', None) is not None:
+        _request_timing.action = f'{_request_timing.method} {action}'
+
+
+def record_query(query: Any, params: Any, seconds: float) -> None:
+    add_timing('execute', seconds)
+    queries = getattr(_request_timing, 'queries', None)
+    if queries is not None:
+        queries.append(round(seconds * 1000, 3))
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        text = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+        print(json.dumps({'slow_query': {
+            'function': getattr(_request_timing, 'function', None),
+            'action': getattr(_request_timing, 'action', None),
+            'ms': round(seconds * 1000, 3),
+            'query': ' '.join(text.split())[:500],
+            'params': param_shape(params)
+        }}))
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    if getattr(_request_timing, 'phases', None) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - started)
+
+
+class _TimedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - started)
+    
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchall(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+
+
+_timed_cursor_classes: Dict[type, type] = {}
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''Connection whose cursors, whatever their cursor_factory, report execute and fetch time'''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursor_classes.get(base)
+        if timed is None:
+            timed = _timed_cursor_classes[base] = type(f'Timed{base.__name__}', (_TimedCursorMixin, base), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+INSTRUMENTED = REQUEST_TIMING or SLOW_QUERY_MS > 0
+CONNECTION_FACTORY = TimedConnection if INSTRUMENTED else None
+
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''
+    Wrap a handler so each request is timed by phase (connect, execute, fetch, serialize,
+    other). With REQUEST_TIMING=1 the phases go to a structured log line and a Server-Timing
+    header. When neither REQUEST_TIMING nor SLOW_QUERY_MS is set the handler is returned untouched.
+    '''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        if not INSTRUMENTED:
+            return handler
+        
+        @functools.wraps(handler)
+        def timed_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            query_params = event.get('queryStringParameters') or {}
+            _request_timing.function = function_name
+            _request_timing.method = event.get('httpMethod', 'GET')
+            _request_timing.action = f"{_request_timing.method} {query_params.get('action') or query_params.get('feed') or ''}".rstrip()
+            _request_timing.phases = phases = {}
+            _request_timing.queries = queries = []
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+            finally:
+                total = time.perf_counter() - started
+                _request_timing.phases = None
+                _request_timing.queries = None
+            
+            if REQUEST_TIMING:
+                phases['other'] = max(0.0, total - sum(phases.values()))
+                phases['total'] = total
+                print(json.dumps({'timing': {
+                    'function': function_name,
+                    'action': _request_timing.action,
+                    'status': response.get('statusCode'),
+                    'ms': {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+                    'queries_ms': queries
+                }}))
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items())
+                headers['Timing-Allow-Origin'] = '*'
+            return response
+        return timed_handler
+    return decorate
+# <<< shared: instrumentation
+
+
+# >>> shared: pool (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+# Caps the idle connections kept between invocations, not checkouts: every concurrent
+# invocation on an instance holds its own connection, so open connections track request
+# concurrency. Bound that with the platform's per-instance concurrency or a server-side pooler.
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_db_pool: Dict[str, List[Tuple[Any, float]]] = {}
+_db_pool_lock = threading.Lock()
+DB_POOL_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'discarded': 0}
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _ping(conn: Any) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(dsn: str) -> Any:
+    '''
+    Take an idle pooled connection for dsn or open a new one; a miss never waits for a
+    connection to be released, see DB_POOL_MAX_SIZE. Connections idle longer than
+    DB_POOL_CHECK_AFTER seconds are pinged before reuse.
+    '''
+    started = time.perf_counter()
+    while True:
+        with _db_pool_lock:
+            idle = _db_pool.get(dsn)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            break
+        conn, released_at = entry
+        if not conn.closed and (time.monotonic() - released_at < DB_POOL_CHECK_AFTER or _ping(conn)):
+            DB_POOL_STATS['hits'] += 1
+            add_timing('connect', time.perf_counter() - started)
+            return conn
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+    
+    DB_POOL_STATS['misses'] += 1
+    if INSTRUMENTED:
+        print(json.dumps({'db_pool': DB_POOL_STATS}))
+    conn = psycopg2.connect(dsn, connection_factory=CONNECTION_FACTORY)
+    add_timing('connect', time.perf_counter() - started)
+    return conn
+
+
+def release_connection(conn: Any, dsn: str) -> None:
+    '''
+    Roll back any unfinished transaction and keep conn for the next warm invocation.
+    Broken connections and connections over DB_POOL_MAX_SIZE are closed instead.
+    '''
+    if conn is None:
+        return
+    try:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    
+    if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+        return
+    
+    with _db_pool_lock:
+        idle = _db_pool.setdefault(dsn, [])
+        if len(idle) < DB_POOL_MAX_SIZE:
+            idle.append((conn, time.monotonic()))
+            return
+    _close_quietly(conn)
+# <<< shared: pool
+
+
+# >>> shared: read_your_writes (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', '10'))
+READ_YOUR_WRITES_MAX_USERS = 10000
+# Pins travel through the client, so they are signed; every function shares the auth secret
+READ_YOUR_WRITES_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+
+_recent_writers: 'OrderedDict[str, float]' = OrderedDict()
+_recent_writers_lock = threading.Lock()
+
+
+def _read_pin_signature(user_id: Optional[str], until: str) -> str:
+    digest = hmac.new(READ_YOUR_WRITES_SECRET.encode(), f'read-primary|{user_id or ""}|{until}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+
+def mark_write(user_id: Optional[str]) -> Dict[str, str]:
+    '''
+    Pin user_id's reads on this instance to the primary for READ_YOUR_WRITES_WINDOW seconds.
+    Returns the X-Read-Primary-Until response header, "<until>:<signature>" bound to the
+    user, so the client can carry the pin to other functions and instances by echoing it
+    but cannot mint or extend one. Without a secret only the instance-local pin applies.
+    '''
+    until = time.time() + READ_YOUR_WRITES_WINDOW
+    if user_id:
+        with _recent_writers_lock:
+            _recent_writers[str(user_id)] = until
+            _recent_writers.move_to_end(str(user_id))
+            while _recent_writers and (
+                len(_recent_writers) > READ_YOUR_WRITES_MAX_USERS or next(iter(_recent_writers.values())) <= time.time()
+            ):
+                _recent_writers.popitem(last=False)
+    if not READ_YOUR_WRITES_SECRET:
+        return {}
+    value = '%.3f' % until
+    return {
+        'X-Read-Primary-Until': f'{value}:{_read_pin_signature(user_id, value)}',
+        'Access-Control-Expose-Headers': 'X-Read-Primary-Until'
+    }
+
+
+def reads_pinned_to_primary(user_id: Optional[str], headers: Dict[str, Any]) -> bool:
+    now = time.time()
+    client_pin = headers.get('x-read-primary-until') or headers.get('X-Read-Primary-Until')
+    if client_pin and READ_YOUR_WRITES_SECRET and client_pin.count(':') == 1:
+        value, signature = client_pin.split(':')
+        try:
+            # Values beyond one window are not something we issued; ignore them
+            if (now < float(value) <= now + READ_YOUR_WRITES_WINDOW
+                    and hmac.compare_digest(signature.encode(), _read_pin_signature(user_id, value).encode())):
+                return True
+        except ValueError:
+            pass
+    if not user_id:
+        return False
+    with _recent_writers_lock:
+        until = _recent_writers.get(str(user_id))
+    return until is not None and now < until
+# <<< shared: read_your_writes
+
+
+class LocalStorage:
+    '''
+    Storage backend on the local filesystem, meant for development and tests.
+    Chunks are staged under <root>/staging/<upload_id>/ and assembled into <root>/<key>.
+    Other backends need the same methods: write_chunk, digest_chunks, assemble, discard, put, url.
+    '''
+    
+    def __init__(self, root: str, public_url: str):
+        self.root = root
+        self.public_url = public_url.rstrip('/')
+    
+    def _staging_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, 'staging', upload_id)
+    
+    def _temp_file(self, path: str) -> Tuple[Any, str]:
+        '''Open a uniquely named temp file next to path, so concurrent writers of one key never share it'''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+        return os.fdopen(fd, 'wb'), tmp_path
+    
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        f, tmp_path = self._temp_file(path)
+        try:
+            with f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def write_chunk(self, upload_id: str, index: int, data: bytes) -> None:
+        self._write_atomic(os.path.join(self._staging_dir(upload_id), f'{index:06d}.part'), data)
+    
+    def assemble(self, upload_id: str, total_chunks: int, key: str) -> Tuple[int, str]:
+        '''Concatenate staged chunks into key, streaming; returns (size, sha256 hex)'''
+        path = os.path.join(self.root, key)
+        digest = hashlib.sha256()
+        size = 0
+        out, tmp_path = self._temp_file(path)
+        try:
+            with out:
+                for index in range(total_chunks):
+                    with open(os.path.join(self._staging_dir(upload_id), f'{index:06d}.part'), 'rb') as part:
+                        while True:
+                            block = part.read(UPLOAD_COPY_BLOCK)
+                            if not block:
+                                break
+                            digest.update(block)
+                            size += len(block)
+                            out.write(block)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return size, digest.hexdigest()
+    
+    def digest_chunks(self, upload_id: str, total_chunks: int) -> Tuple[int, str]:
+        '''Stream over staged chunks without writing anything; returns (size, sha256 hex)'''
+        digest = hashlib.sha256()
+        size = 0
+        for index in range(total_chunks):
+            with open(os.path.join(self._staging_dir(upload_id), f'{index:06d}.part'), 'rb') as part:
+                while True:
+                    block = part.read(UPLOAD_COPY_BLOCK)
+                    if not block:
+                        break
+                    digest.update(block)
+                    size += len(block)
+        return size, digest.hexdigest()
+    
+    def discard(self, upload_id: str) -> None:
+        shutil.rmtree(self._staging_dir(upload_id), ignore_errors=True)
+    
+    def put(self, key: str, data: bytes) -> None:
+        self._write_atomic(os.path.join(self.root, key), data)
+    
+    def url(self, key: str) -> str:
+        '''STORAGE_PUBLIC_URL is a base URL, or a template such as <stream function>?key={key}'''
+        if '{key}' in self.public_url:
+            return self.public_url.replace('{key}', key)
+        return f'{self.public_url}/{key}'
+
+
+STORAGE_BACKENDS = {'local': LocalStorage}
+UPLOAD_COPY_BLOCK = 1024 * 1024
+UPLOAD_DEFAULT_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(2 * 1024 * 1024)))
+UPLOAD_MAX_CHUNK_SIZE = int(os.environ.get('UPLOAD_MAX_CHUNK_SIZE', str(4 * 1024 * 1024)))
+UPLOAD_MIN_CHUNK_SIZE = int(os.environ.get('UPLOAD_MIN_CHUNK_SIZE', str(64 * 1024)))
+UPLOAD_MAX_CHUNKS = int(os.environ.get('UPLOAD_MAX_CHUNKS', '10000'))
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', str(4 * 1024 * 1024 * 1024)))
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+_storage: Optional[LocalStorage] = None
+
+
+def get_storage() -> LocalStorage:
+    global _storage
+    if _storage is None:
+        backend = STORAGE_BACKENDS[os.environ.get('STORAGE_BACKEND', 'local')]
+        _storage = backend(
+            os.environ.get('STORAGE_ROOT', '/tmp/video-storage'),
+            os.environ.get('STORAGE_PUBLIC_URL', 'https://storage.example.com')
+        )
+    return _storage
+
+
+def decode_chunk_body(event: Dict[str, Any]) -> bytes:
+    '''Chunk bytes arrive base64-encoded, either by the gateway (isBase64Encoded) or by the client'''
+    return base64.b64decode(event.get('body') or '', validate=True)
+
+
+def blob_key(sha256: str) -> str:
+    return f'blobs/{sha256[:2]}/{sha256}'
+
+
+def find_blob(cur: Any, sha256: str) -> bool:
+    '''
+    Check whether content with this hash is already stored, refreshing its GC grace period.
+    Also takes a shared advisory lock on the hash until the transaction ends; maintenance
+    takes it exclusively before unlinking a file, so it never removes one this upload is
+    writing or about to reference.
+    '''
+    cur.execute('''
+        WITH locked AS (
+            SELECT pg_advisory_xact_lock_shared(hashtext(%s))
+        ), touched AS (
+            UPDATE blobs SET last_seen_at = CURRENT_TIMESTAMP WHERE sha256 = %s RETURNING sha256
+        )
+        SELECT (SELECT COUNT(*) FROM locked), (SELECT COUNT(*) FROM touched) AS found
+    ''', (sha256, sha256))
+    return cur.fetchone()['found'] > 0
+
+
+def register_blob(cur: Any, sha256: str, size: int, content_type: str) -> None:
+    cur.execute('''
+        INSERT INTO blobs (sha256, storage_key, size, content_type)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (sha256) DO UPDATE SET last_seen_at = CURRENT_TIMESTAMP
+    ''', (sha256, blob_key(sha256), size, content_type))
+
+
+def store_blob(cur: Any, storage: LocalStorage, data: bytes, content_type: str) -> str:
+    '''Store data under its SHA-256 unless identical content already exists; returns the hash'''
+    sha256 = hashlib.sha256(data).hexdigest()
+    if not find_blob(cur, sha256):
+        storage.put(blob_key(sha256), data)
+        register_blob(cur, sha256, len(data), content_type)
+    return sha256
+
+
+def decode_base64_field(value: str) -> bytes:
+    return base64.b64decode(value + '=' * (-len(value) % 4))
+
+
+# >>> shared: auth (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+AUTH_ALLOW_USER_ID_HEADER = os.environ.get('AUTH_ALLOW_USER_ID_HEADER', '0') == '1'
+
+
+class InvalidAuthToken(Exception):
+    '''An X-Auth-Token was sent but is malformed, forged or expired; answered with 401'''
+
+
+def _b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def verify_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    '''Return the payload of an auth-issued token if its HMAC and expiry check out, without a database call'''
+    if not AUTH_TOKEN_SECRET or token.count('.') != 1:
+        return None
+    payload_part, signature = token.split('.')
+    expected = base64.urlsafe_b64encode(
+        hmac.new(AUTH_TOKEN_SECRET.encode(), payload_part.encode(), hashlib.sha256).digest()
+    ).decode().rstrip('=')
+    # Bytes, not str: compare_digest raises TypeError on non-ASCII text
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    try:
+        payload = json.loads(_b64url_decode(payload_part))
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or 'uid' not in payload or payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+
+def resolve_identity(headers: Dict[str, Any], anonymous_on_invalid: bool = False) -> Tuple[Optional[str], Optional[int]]:
+    '''
+    (user_id, channel_id) from a signed X-Auth-Token; raises InvalidAuthToken if the token
+    does not verify, unless anonymous_on_invalid is set: public reads use it so a stale or
+    expired token still gets the anonymous response. Without a token the raw X-User-Id
+    header is only trusted when AUTH_ALLOW_USER_ID_HEADER=1 (local development and the
+    bench), and then the channel is unknown.
+    '''
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    if token:
+        payload = verify_auth_token(token)
+        if payload:
+            return str(payload['uid']), payload.get('cid')
+        if not anonymous_on_invalid:
+            raise InvalidAuthToken()
+        return None, None
+    if AUTH_ALLOW_USER_ID_HEADER:
+        return headers.get('x-user-id') or headers.get('X-User-Id'), None
+    return None, None
+# <<< shared: auth
+
+
+# >>> shared: user_channel_cache (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+USER_CHANNEL_CACHE_SIZE = int(os.environ.get('USER_CHANNEL_CACHE_SIZE', '1024'))
+
+_user_channel_cache: 'OrderedDict[str, int]' = OrderedDict()
+_user_channel_cache_lock = threading.Lock()
+
+
+def cached_user_channel(user_id: str) -> Optional[int]:
+    with _user_channel_cache_lock:
+        channel_id = _user_channel_cache.get(user_id)
+        if channel_id is not None:
+            _user_channel_cache.move_to_end(user_id)
+        return channel_id
+
+
+def cache_user_channel(user_id: str, channel_id: int) -> None:
+    '''Remember user -> channel; the mapping is fixed at registration, so entries never go stale'''
+    with _user_channel_cache_lock:
+        _user_channel_cache[user_id] = channel_id
+        _user_channel_cache.move_to_end(user_id)
+        while len(_user_channel_cache) > USER_CHANNEL_CACHE_SIZE:
+            _user_channel_cache.popitem(last=False)
+# <<< shared: user_channel_cache
+
+
+@instrumented('upload')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Upload video and thumbnail files to storage and create video record
-    Args: event with httpMethod, body containing multipart form data
+    Args: event with httpMethod, body containing multipart form data or a chunked upload step:
+          POST action=init, PUT ?upload_id&chunk with X-Chunk-Sha256, GET ?upload_id, POST action=complete
           context with request_id
-    Returns: HTTP response with video URL and metadata
+    Returns: HTTP response with video URL and metadata, or upload session state
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -22,14 +566,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Chunk-Sha256',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
-    if method != 'POST':
+    if method not in ('GET', 'POST', 'PUT'):
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -37,7 +581,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     headers = event.get('headers', {})
-    user_id = headers.get('x-user-id') or headers.get('X-User-Id')
+    try:
+        user_id, token_channel_id = resolve_identity(headers)
+    except InvalidAuthToken:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid auth token'})
+        }
     
     if not user_id:
         return {
@@ -46,77 +597,405 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Authentication required'})
         }
     
+    query_params = event.get('queryStringParameters') or {}
+    
+    if method in ('GET', 'PUT'):
+        upload_id = query_params.get('upload_id', '')
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'upload_id required'})
+            }
+        
+        db_url = os.environ.get('DATABASE_URL')
+        conn = None
+        try:
+            conn = get_connection(db_url)
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            
+            # A chunk write holds the session row so the maintenance expire_uploads job skips it
+            cur.execute(f'''
+                SELECT id, total_size, chunk_size, total_chunks, status, video_id
+                FROM upload_sessions
+                WHERE id = %s AND user_id = CAST(%s AS INTEGER)
+                {'FOR SHARE' if method == 'PUT' else ''}
+            ''', (upload_id, user_id))
+            session = cur.fetchone()
+            
+            if not session:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Upload session not found'})
+                }
+            
+            if method == 'PUT':
+                if session['status'] != 'open':
+                    return {
+                        'statusCode': 409,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f"Upload session is {session['status']}"})
+                    }
+                
+                try:
+                    chunk_index = int(query_params.get('chunk', ''))
+                    data = decode_chunk_body(event)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid chunk index or body'})
+                    }
+                
+                last_index = session['total_chunks'] - 1
+                expected_size = session['chunk_size'] if chunk_index < last_index else session['total_size'] - last_index * session['chunk_size']
+                if not 0 <= chunk_index <= last_index or len(data) != expected_size:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Chunk index or size out of range', 'expected_size': expected_size})
+                    }
+                
+                checksum = hashlib.sha256(data).hexdigest()
+                expected_checksum = (headers.get('x-chunk-sha256') or headers.get('X-Chunk-Sha256') or '').lower()
+                if checksum != expected_checksum:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Checksum mismatch', 'sha256': checksum})
+                    }
+                
+                get_storage().write_chunk(upload_id, chunk_index, data)
+                
+                cur.execute('''
+                    INSERT INTO upload_chunks (session_id, chunk_index, size, sha256)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (session_id, chunk_index)
+                    DO UPDATE SET size = EXCLUDED.size, sha256 = EXCLUDED.sha256, received_at = CURRENT_TIMESTAMP
+                ''', (upload_id, chunk_index, len(data), checksum))
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'upload_id': upload_id, 'chunk': chunk_index, 'sha256': checksum})
+                }
+            
+            cur.execute('''
+                SELECT chunk_index FROM upload_chunks WHERE session_id = %s ORDER BY chunk_index
+            ''', (upload_id,))
+            received = [row['chunk_index'] for row in cur.fetchall()]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'upload_id': upload_id,
+                    'status': session['status'],
+                    'video_id': session['video_id'],
+                    'chunk_size': session['chunk_size'],
+                    'total_chunks': session['total_chunks'],
+                    'received_chunks': received,
+                    'missing_chunks': sorted(set(range(session['total_chunks'])) - set(received))
+                })
+            }
+            
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)})
+            }
+        finally:
+            release_connection(conn, db_url)
+    
     body_data = json.loads(event.get('body', '{}'))
+    upload_action = body_data.get('action')
+    tag_action(upload_action or 'legacy')
+    
+    if upload_action in ('init', 'complete'):
+        db_url = os.environ.get('DATABASE_URL')
+        conn = None
+        try:
+            conn = get_connection(db_url)
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            
+            if upload_action == 'init':
+                title = body_data.get('title')
+                try:
+                    total_size = int(body_data.get('total_size', 0))
+                    chunk_size = int(body_data.get('chunk_size') or UPLOAD_DEFAULT_CHUNK_SIZE)
+                    duration = int(body_data.get('duration', 0))
+                except (TypeError, ValueError):
+                    total_size = chunk_size = duration = 0
+                
+                # Small chunks are only allowed for files that fit in one; the chunk count cap keeps
+                # total_chunks within INTEGER and the status response's missing_chunks list small
+                if (not title or not 0 < total_size <= UPLOAD_MAX_SIZE
+                        or not min(UPLOAD_MIN_CHUNK_SIZE, total_size) <= chunk_size <= UPLOAD_MAX_CHUNK_SIZE
+                        or -(-total_size // chunk_size) > UPLOAD_MAX_CHUNKS):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({
+                            'error': 'title, total_size and a valid chunk_size are required',
+                            'min_chunk_size': UPLOAD_MIN_CHUNK_SIZE,
+                            'max_chunk_size': UPLOAD_MAX_CHUNK_SIZE,
+                            'max_chunks': UPLOAD_MAX_CHUNKS
+                        })
+                    }
+                
+                channel_id = token_channel_id or cached_user_channel(user_id)
+                if not channel_id:
+                    cur.execute('SELECT id FROM channels WHERE user_id = CAST(%s AS INTEGER) LIMIT 1', (user_id,))
+                    channel = cur.fetchone()
+                    
+                    if not channel:
+                        return {
+                            'statusCode': 404,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Channel not found'})
+                        }
+                    
+                    channel_id = channel['id']
+                    cache_user_channel(user_id, channel_id)
+                
+                # An optional hash the assembled file is checked against on complete. It never
+                # skips the upload: blob keys are public, so knowing a hash proves nothing
+                content_sha256 = str(body_data.get('sha256') or '').lower() or None
+                if content_sha256 and not SHA256_PATTERN.match(content_sha256):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'sha256 must be 64 hex characters'})
+                    }
+                
+                upload_id = secrets.token_hex(16)
+                total_chunks = -(-total_size // chunk_size)
+                
+                cur.execute('''
+                    INSERT INTO upload_sessions
+                    (id, user_id, channel_id, title, description, duration, video_type, total_size, chunk_size, total_chunks, sha256)
+                    VALUES (%s, CAST(%s AS INTEGER), %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ''', (upload_id, user_id, channel_id, title, body_data.get('description', ''), duration,
+                      body_data.get('video_type', 'regular'), total_size, chunk_size, total_chunks, content_sha256))
+                conn.commit()
+                
+                return {
+                    'statusCode': 201,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'upload_id': upload_id,
+                        'chunk_size': chunk_size,
+                        'total_chunks': total_chunks
+                    })
+                }
+            
+            upload_id = body_data.get('upload_id') or ''
+            cur.execute('''
+                SELECT s.*, (SELECT COUNT(*) FROM upload_chunks ch WHERE ch.session_id = s.id) AS received_chunks
+                FROM upload_sessions s
+                WHERE s.id = %s AND s.user_id = CAST(%s AS INTEGER)
+                FOR UPDATE
+            ''', (upload_id, user_id))
+            session = cur.fetchone()
+            
+            if not session:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Upload session not found'})
+                }
+            
+            if session['status'] == 'expired':
+                return {
+                    'statusCode': 410,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Upload session expired'})
+                }
+            
+            if session['status'] == 'open':
+                storage = get_storage()
+                
+                if session['received_chunks'] != session['total_chunks']:
+                    return {
+                        'statusCode': 409,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({
+                            'error': 'Upload is incomplete',
+                            'received_chunks': session['received_chunks'],
+                            'total_chunks': session['total_chunks']
+                        })
+                    }
+                
+                # Dedup only on the hash of bytes we received, and hash first so duplicate
+                # content never gets written a second time
+                size, content_sha256 = storage.digest_chunks(upload_id, session['total_chunks'])
+                
+                if size != session['total_size'] or (session['sha256'] and session['sha256'] != content_sha256):
+                    return {
+                        'statusCode': 409,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Assembled file does not match total_size or sha256'})
+                    }
+                
+                if not find_blob(cur, content_sha256):
+                    storage.assemble(upload_id, session['total_chunks'], blob_key(content_sha256))
+                    register_blob(cur, content_sha256, size, 'video/mp4')
+                
+                thumbnail_url = body_data.get('thumbnail_url')
+                thumbnail_sha256 = None
+                if body_data.get('thumbnail_file'):
+                    thumbnail_sha256 = store_blob(cur, storage, decode_base64_field(body_data['thumbnail_file']), 'image/jpeg')
+                    thumbnail_url = storage.url(blob_key(thumbnail_sha256))
+                
+                # Insert, counters, session completion and the response row in one round trip
+                cur.execute('''
+                    WITH inserted AS (
+                        INSERT INTO videos
+                        (channel_id, title, description, video_url, thumbnail_url, duration, video_type, video_blob, thumbnail_blob)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id, title, video_url, thumbnail_url, duration, video_type, views_count, likes_count,
+                                  created_at, channel_id
+                    ), touched AS (
+                        UPDATE channels c SET last_video_at = GREATEST(c.last_video_at, i.created_at), videos_count = c.videos_count + 1, version = c.version + 1
+                        FROM inserted i
+                        WHERE c.id = i.channel_id
+                        RETURNING c.id, c.name, c.is_verified
+                    ), completed AS (
+                        UPDATE upload_sessions s SET status = 'completed', video_id = i.id
+                        FROM inserted i
+                        WHERE s.id = %s
+                    )
+                    SELECT i.id, i.title, i.video_url, i.thumbnail_url, i.duration, i.video_type,
+                           i.views_count, i.likes_count, i.created_at, t.name AS channel_name, t.is_verified
+                    FROM inserted i
+                    JOIN touched t ON t.id = i.channel_id
+                ''', (session['channel_id'], session['title'], session['description'], storage.url(blob_key(content_sha256)),
+                      thumbnail_url, session['duration'], session['video_type'], content_sha256, thumbnail_sha256, upload_id))
+                video = dict(cur.fetchone())
+                conn.commit()
+                storage.discard(upload_id)
+            else:
+                cur.execute('''
+                    SELECT v.id, v.title, v.video_url, v.thumbnail_url, v.duration, v.video_type,
+                           v.views_count, v.likes_count, v.created_at, c.name AS channel_name, c.is_verified
+                    FROM videos v
+                    JOIN channels c ON c.id = v.channel_id
+                    WHERE v.id = %s
+                ''', (session['video_id'],))
+                video = dict(cur.fetchone())
+            
+            if isinstance(video.get('created_at'), datetime):
+                video['created_at'] = video['created_at'].isoformat()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **mark_write(user_id)},
+                'body': json.dumps({
+                    'message': 'Video uploaded successfully',
+                    'video': video
+                })
+            }
+            
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)})
+            }
+        finally:
+            release_connection(conn, db_url)
     
     title = body_data.get('title')
     description = body_data.get('description', '')
     video_base64 = body_data.get('video_file')
     thumbnail_base64 = body_data.get('thumbnail_file')
-    duration = body_data.get('duration', 0)
     video_type = body_data.get('video_type', 'regular')
+    try:
+        duration = int(body_data.get('duration', 0))
+    except (TypeError, ValueError):
+        duration = None
     
-    if not all([title, video_base64, thumbnail_base64]):
+    if not all([title, video_base64, thumbnail_base64]) or duration is None:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': 'Missing required fields'})
         }
     
+    db_url = os.environ.get('DATABASE_URL')
+    conn = None
     try:
-        db_url = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(db_url)
+        conn = get_connection(db_url)
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        cur.execute('SELECT id FROM channels WHERE user_id = CAST(%s AS INTEGER) LIMIT 1', (user_id,))
-        channel = cur.fetchone()
+        storage = get_storage()
+        video_sha256 = store_blob(cur, storage, decode_base64_field(video_base64), 'video/mp4')
+        thumbnail_sha256 = store_blob(cur, storage, decode_base64_field(thumbnail_base64), 'image/jpeg')
         
-        if not channel:
+        video_url = storage.url(blob_key(video_sha256))
+        thumbnail_url = storage.url(blob_key(thumbnail_sha256))
+        
+        # One round trip: resolve the channel (unless the token or cache names it), insert the
+        # video, bump the channel counters and return the channel fields the response needs
+        cur.execute('''
+            WITH owner AS (
+                SELECT id FROM channels
+                WHERE id = %(channel_id)s OR (%(channel_id)s IS NULL AND user_id = CAST(%(user_id)s AS INTEGER))
+                LIMIT 1
+            ), inserted AS (
+                INSERT INTO videos
+                (channel_id, title, description, video_url, thumbnail_url, duration, video_type, video_blob, thumbnail_blob)
+                SELECT o.id, %(title)s, %(description)s, %(video_url)s, %(thumbnail_url)s, %(duration)s, %(video_type)s,
+                       %(video_blob)s, %(thumbnail_blob)s
+                FROM owner o
+                RETURNING id, title, video_url, thumbnail_url, duration, video_type, views_count, likes_count, created_at, channel_id
+            ), touched AS (
+                UPDATE channels c SET last_video_at = GREATEST(c.last_video_at, i.created_at), videos_count = c.videos_count + 1, version = c.version + 1
+                FROM inserted i
+                WHERE c.id = i.channel_id
+                RETURNING c.id, c.name, c.is_verified
+            )
+            SELECT i.id, i.title, i.video_url, i.thumbnail_url, i.duration, i.video_type, i.views_count, i.likes_count,
+                   i.created_at, i.channel_id, t.name AS channel_name, t.is_verified
+            FROM inserted i
+            JOIN touched t ON t.id = i.channel_id
+        ''', {
+            'channel_id': token_channel_id or cached_user_channel(user_id),
+            'user_id': user_id,
+            'title': title,
+            'description': description,
+            'video_url': video_url,
+            'thumbnail_url': thumbnail_url,
+            'duration': duration,
+            'video_type': video_type,
+            'video_blob': video_sha256,
+            'thumbnail_blob': thumbnail_sha256
+        })
+        created = cur.fetchone()
+        
+        if not created:
+            conn.rollback()
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': 'Channel not found'})
             }
         
-        channel_id = channel['id']
-        
-        timestamp = int(time.time())
-        video_hash = hashlib.md5(f'{user_id}{timestamp}'.encode()).hexdigest()
-        
-        video_filename = f'videos/{video_hash}.mp4'
-        thumbnail_filename = f'thumbnails/{video_hash}.jpg'
-        
-        video_url = f'https://storage.example.com/{video_filename}'
-        thumbnail_url = f'https://storage.example.com/{thumbnail_filename}'
-        
-        cur.execute('''
-            INSERT INTO videos 
-            (channel_id, title, description, video_url, thumbnail_url, duration, video_type)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, title, thumbnail_url, duration, video_type, views_count, likes_count, created_at
-        ''', (channel_id, title, description, video_url, thumbnail_url, int(duration), video_type))
-        
-        video = dict(cur.fetchone())
-        
-        if 'created_at' in video and isinstance(video['created_at'], datetime):
-            video['created_at'] = video['created_at'].isoformat()
-        
-        cur.execute('''
-            SELECT c.channel_name, c.is_verified 
-            FROM channels c 
-            WHERE c.id = %s
-        ''', (channel_id,))
-        
-        channel_info = cur.fetchone()
-        video['channel_name'] = channel_info['channel_name']
-        video['is_verified'] = channel_info['is_verified']
-        
         conn.commit()
         cur.close()
-        conn.close()
+        cache_user_channel(user_id, created['channel_id'])
+        
+        video = dict(created)
+        del video['channel_id']
+        if isinstance(video.get('created_at'), datetime):
+            video['created_at'] = video['created_at'].isoformat()
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **mark_write(user_id)},
             'isBase64Encoded': False,
             'body': json.dumps({
                 'message': 'Video uploaded successfully',
@@ -129,4 +1008,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+    finally:
+        release_connection(conn, db_url)
\ No newline at end of file
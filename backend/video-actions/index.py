@@ -1,12 +1,1014 @@
 import json
+import functools
 import os
-from typing import Dict, Any
+import atexit
+import base64
+import hashlib
+import hmac
+import itertools
+import re
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Set, Tuple, Callable, Iterator
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+from psycopg2.extras import RealDictCursor, execute_values
 
+# >>> shared: instrumentation (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+
+_request_timing = threading.local()
+
+
+def param_shape(value: Any) -> Any:
+    '''Types and sizes of query parameters, so slow-query logs never carry user data'''
+    if isinstance(value, dict):
+        return {key: param_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'{type(value).__name__}[{len(value)}]'
+        return [param_shape(item) for item in value]
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def add_timing(phase: str, seconds: float) -> None:
+    phases = getattr(_request_timing, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def tag_action(action: Any) -> None:
+    '''Name the action once the handler has parsed it from the body'''
+    if getattr(_request_timing, 'phases', None) is not None:
+        _request_timing.action = f'{_request_timing.method} {action}'
+
+
+def record_query(query: Any, params: Any, seconds: float) -> None:
+    add_timing('execute', seconds)
+    queries = getattr(_request_timing, 'queries', None)
+    if queries is not None:
+        queries.append(round(seconds * 1000, 3))
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        text = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+        print(json.dumps({'slow_query': {
+            'function': getattr(_request_timing, 'function', None),
+            'action': getattr(_request_timing, 'action', None),
+            'ms': round(seconds * 1000, 3),
+            'query': ' '.join(text.split())[:500],
+            'params': param_shape(params)
+        }}))
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    if getattr(_request_timing, 'phases', None) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - started)
+
+
+class _TimedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - started)
+    
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchall(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+
+
+_timed_cursor_classes: Dict[type, type] = {}
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''Connection whose cursors, whatever their cursor_factory, report execute and fetch time'''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursor_classes.get(base)
+        if timed is None:
+            timed = _timed_cursor_classes[base] = type(f'Timed{base.__name__}', (_TimedCursorMixin, base), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+INSTRUMENTED = REQUEST_TIMING or SLOW_QUERY_MS > 0
+CONNECTION_FACTORY = TimedConnection if INSTRUMENTED else None
+
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''
+    Wrap a handler so each request is timed by phase (connect, execute, fetch, serialize,
+    other). With REQUEST_TIMING=1 the phases go to a structured log line and a Server-Timing
+    header. When neither REQUEST_TIMING nor SLOW_QUERY_MS is set the handler is returned untouched.
+    '''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        if not INSTRUMENTED:
+            return handler
+        
+        @functools.wraps(handler)
+        def timed_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            query_params = event.get('queryStringParameters') or {}
+            _request_timing.function = function_name
+            _request_timing.method = event.get('httpMethod', 'GET')
+            _request_timing.action = f"{_request_timing.method} {query_params.get('action') or query_params.get('feed') or ''}".rstrip()
+            _request_timing.phases = phases = {}
+            _request_timing.queries = queries = []
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+            finally:
+                total = time.perf_counter() - started
+                _request_timing.phases = None
+                _request_timing.queries = None
+            
+            if REQUEST_TIMING:
+                phases['other'] = max(0.0, total - sum(phases.values()))
+                phases['total'] = total
+                print(json.dumps({'timing': {
+                    'function': function_name,
+                    'action': _request_timing.action,
+                    'status': response.get('statusCode'),
+                    'ms': {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+                    'queries_ms': queries
+                }}))
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items())
+                headers['Timing-Allow-Origin'] = '*'
+            return response
+        return timed_handler
+    return decorate
+# <<< shared: instrumentation
+
+
+# >>> shared: pool (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+# Caps the idle connections kept between invocations, not checkouts: every concurrent
+# invocation on an instance holds its own connection, so open connections track request
+# concurrency. Bound that with the platform's per-instance concurrency or a server-side pooler.
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_db_pool: Dict[str, List[Tuple[Any, float]]] = {}
+_db_pool_lock = threading.Lock()
+DB_POOL_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'discarded': 0}
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _ping(conn: Any) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(dsn: str) -> Any:
+    '''
+    Take an idle pooled connection for dsn or open a new one; a miss never waits for a
+    connection to be released, see DB_POOL_MAX_SIZE. Connections idle longer than
+    DB_POOL_CHECK_AFTER seconds are pinged before reuse.
+    '''
+    started = time.perf_counter()
+    while True:
+        with _db_pool_lock:
+            idle = _db_pool.get(dsn)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            break
+        conn, released_at = entry
+        if not conn.closed and (time.monotonic() - released_at < DB_POOL_CHECK_AFTER or _ping(conn)):
+            DB_POOL_STATS['hits'] += 1
+            add_timing('connect', time.perf_counter() - started)
+            return conn
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+    
+    DB_POOL_STATS['misses'] += 1
+    if INSTRUMENTED:
+        print(json.dumps({'db_pool': DB_POOL_STATS}))
+    conn = psycopg2.connect(dsn, connection_factory=CONNECTION_FACTORY)
+    add_timing('connect', time.perf_counter() - started)
+    return conn
+
+
+def release_connection(conn: Any, dsn: str) -> None:
+    '''
+    Roll back any unfinished transaction and keep conn for the next warm invocation.
+    Broken connections and connections over DB_POOL_MAX_SIZE are closed instead.
+    '''
+    if conn is None:
+        return
+    try:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    
+    if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+        return
+    
+    with _db_pool_lock:
+        idle = _db_pool.setdefault(dsn, [])
+        if len(idle) < DB_POOL_MAX_SIZE:
+            idle.append((conn, time.monotonic()))
+            return
+    _close_quietly(conn)
+# <<< shared: pool
+
+
+# >>> shared: read_your_writes (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', '10'))
+READ_YOUR_WRITES_MAX_USERS = 10000
+# Pins travel through the client, so they are signed; every function shares the auth secret
+READ_YOUR_WRITES_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+
+_recent_writers: 'OrderedDict[str, float]' = OrderedDict()
+_recent_writers_lock = threading.Lock()
+
+
+def _read_pin_signature(user_id: Optional[str], until: str) -> str:
+    digest = hmac.new(READ_YOUR_WRITES_SECRET.encode(), f'read-primary|{user_id or ""}|{until}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+
+def mark_write(user_id: Optional[str]) -> Dict[str, str]:
+    '''
+    Pin user_id's reads on this instance to the primary for READ_YOUR_WRITES_WINDOW seconds.
+    Returns the X-Read-Primary-Until response header, "<until>:<signature>" bound to the
+    user, so the client can carry the pin to other functions and instances by echoing it
+    but cannot mint or extend one. Without a secret only the instance-local pin applies.
+    '''
+    until = time.time() + READ_YOUR_WRITES_WINDOW
+    if user_id:
+        with _recent_writers_lock:
+            _recent_writers[str(user_id)] = until
+            _recent_writers.move_to_end(str(user_id))
+            while _recent_writers and (
+                len(_recent_writers) > READ_YOUR_WRITES_MAX_USERS or next(iter(_recent_writers.values())) <= time.time()
+            ):
+                _recent_writers.popitem(last=False)
+    if not READ_YOUR_WRITES_SECRET:
+        return {}
+    value = '%.3f' % until
+    return {
+        'X-Read-Primary-Until': f'{value}:{_read_pin_signature(user_id, value)}',
+        'Access-Control-Expose-Headers': 'X-Read-Primary-Until'
+    }
+
+
+def reads_pinned_to_primary(user_id: Optional[str], headers: Dict[str, Any]) -> bool:
+    now = time.time()
+    client_pin = headers.get('x-read-primary-until') or headers.get('X-Read-Primary-Until')
+    if client_pin and READ_YOUR_WRITES_SECRET and client_pin.count(':') == 1:
+        value, signature = client_pin.split(':')
+        try:
+            # Values beyond one window are not something we issued; ignore them
+            if (now < float(value) <= now + READ_YOUR_WRITES_WINDOW
+                    and hmac.compare_digest(signature.encode(), _read_pin_signature(user_id, value).encode())):
+                return True
+        except ValueError:
+            pass
+    if not user_id:
+        return False
+    with _recent_writers_lock:
+        until = _recent_writers.get(str(user_id))
+    return until is not None and now < until
+# <<< shared: read_your_writes
+
+
+# >>> shared: replica (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+DATABASE_REPLICA_URLS = [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '5'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '10'))
+
+_replica_health: Dict[str, Tuple[float, Optional[float]]] = {}
+_replica_turn = itertools.count()
+REPLICA_STATS: Dict[str, int] = {'replica': 0, 'pinned': 0, 'fallbacks': 0}
+
+
+def replica_lag(conn: Any) -> Optional[float]:
+    '''Seconds of replay lag, 0 once the replica has applied all WAL it received; None if the check fails'''
+    try:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            ''')
+            lag = float(cur.fetchone()[0])
+        conn.rollback()
+        return lag
+    except psycopg2.Error:
+        return None
+
+
+def get_read_connection(user_id: Optional[str], headers: Dict[str, Any]) -> Tuple[Any, str]:
+    '''
+    Connection for a read-only request and the dsn to release it under. Replicas from
+    DATABASE_REPLICA_URLS are tried round-robin; one that fails to connect or lags more
+    than REPLICA_MAX_LAG seconds is skipped until it is checked again REPLICA_CHECK_INTERVAL
+    seconds later. The primary serves the read when no replica is usable or the caller
+    wrote within READ_YOUR_WRITES_WINDOW.
+    '''
+    primary = os.environ.get('DATABASE_URL')
+    if not DATABASE_REPLICA_URLS:
+        return get_connection(primary), primary
+    if reads_pinned_to_primary(user_id, headers):
+        REPLICA_STATS['pinned'] += 1
+        return get_connection(primary), primary
+    
+    first = next(_replica_turn)
+    for offset in range(len(DATABASE_REPLICA_URLS)):
+        index = (first + offset) % len(DATABASE_REPLICA_URLS)
+        dsn = DATABASE_REPLICA_URLS[index]
+        now = time.monotonic()
+        checked_at, lag = _replica_health.get(dsn, (None, None))
+        check_due = checked_at is None or now - checked_at >= REPLICA_CHECK_INTERVAL
+        if not check_due and (lag is None or lag > REPLICA_MAX_LAG):
+            continue
+        try:
+            conn = get_connection(dsn)
+        except psycopg2.Error:
+            _replica_health[dsn] = (now, None)
+            print(json.dumps({'replica_unavailable': index}))
+            continue
+        if check_due:
+            lag = replica_lag(conn)
+            _replica_health[dsn] = (now, lag)
+            if lag is None or lag > REPLICA_MAX_LAG:
+                print(json.dumps({'replica_lagging': index, 'lag_seconds': lag}))
+                release_connection(conn, dsn)
+                continue
+        REPLICA_STATS['replica'] += 1
+        return conn, dsn
+    
+    REPLICA_STATS['fallbacks'] += 1
+    return get_connection(primary), primary
+# <<< shared: replica
+
+
+# >>> shared: prepared (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+PREPARED_STATEMENTS = os.environ.get('PREPARED_STATEMENTS', '1') == '1'
+PREPARED_STATS_LOG_EVERY = int(os.environ.get('PREPARED_STATS_LOG_EVERY', '1000'))
+
+_statements: Dict[str, Tuple[str, str]] = {}
+_prepared_on: 'weakref.WeakKeyDictionary[Any, Set[str]]' = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+PREPARED_STATS: Dict[str, Dict[str, float]] = {}
+_prepared_calls = itertools.count(1)
+
+
+def prepared(name: str, sql: str) -> str:
+    '''
+    Register a hot statement under name. sql uses %s placeholders like any other query
+    here; they are numbered $1..$n for PREPARE. Returns name for execute_prepared.
+    '''
+    numbered = itertools.count(1)
+    _statements[name] = (sql, re.sub(r'%s', lambda _: f'${next(numbered)}', sql))
+    PREPARED_STATS[name] = {'calls': 0, 'prepares': 0, 'ms': 0.0}
+    return name
+
+
+def _prepare(cur: Any, name: str) -> None:
+    cur.execute(f'PREPARE {name} AS {_statements[name][1]}')
+    PREPARED_STATS[name]['prepares'] += 1
+
+
+def execute_prepared(cur: Any, name: str, params: Tuple[Any, ...] = ()) -> None:
+    '''
+    EXECUTE a registered statement on cur, preparing it first on connections that have not
+    seen it yet. Each pooled connection keeps its own set, so a reconnect or a discarded
+    connection simply prepares again on first use. If the server has lost the statement
+    and nothing else ran in the transaction yet, it is re-prepared and retried once.
+    PREPARED_STATEMENTS=0 sends the plain query instead, e.g. behind a transaction pooler.
+    '''
+    stats = PREPARED_STATS[name]
+    started = time.perf_counter()
+    if not PREPARED_STATEMENTS:
+        cur.execute(_statements[name][0], params)
+    else:
+        conn = cur.connection
+        with _prepared_lock:
+            names = _prepared_on.setdefault(conn, set())
+        fresh_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        call = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f'EXECUTE {name}'
+        if name not in names:
+            _prepare(cur, name)
+            names.add(name)
+        try:
+            cur.execute(call, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            names.discard(name)
+            if not fresh_transaction:
+                raise
+            conn.rollback()
+            _prepare(cur, name)
+            names.add(name)
+            cur.execute(call, params)
+    stats['calls'] += 1
+    stats['ms'] += (time.perf_counter() - started) * 1000
+    if PREPARED_STATS_LOG_EVERY and next(_prepared_calls) % PREPARED_STATS_LOG_EVERY == 0:
+        print(json.dumps({'prepared_statements': {
+            key: {'calls': value['calls'], 'prepares': value['prepares'], 'ms': round(value['ms'], 3)}
+            for key, value in PREPARED_STATS.items()
+        }}))
+
+
+def prepare_all(conn: Any) -> None:
+    '''
+    PREPARE every registered statement conn has not seen yet, in one round trip per
+    statement, and commit. Lets a caller warm a connection up front instead of paying
+    the extra PREPARE on each statement's first use.
+    '''
+    if not PREPARED_STATEMENTS:
+        return
+    with _prepared_lock:
+        names = _prepared_on.setdefault(conn, set())
+    with conn.cursor() as cur:
+        for name in _statements:
+            if name not in names:
+                _prepare(cur, name)
+                names.add(name)
+    conn.commit()
+# <<< shared: prepared
+
+
+VIEW_INGEST_MODE = os.environ.get('VIEW_INGEST_MODE', 'direct')
+VIEW_BUFFER_MAX_EVENTS = int(os.environ.get('VIEW_BUFFER_MAX_EVENTS', '200'))
+VIEW_BUFFER_MAX_AGE = float(os.environ.get('VIEW_BUFFER_MAX_AGE', '10'))
+VIEW_BUFFER_MAX_RETAINED = int(os.environ.get('VIEW_BUFFER_MAX_RETAINED', '5000'))
+# Buffered views are flushed by size and age, checked on each request. Events still in
+# the buffer when an instance is killed or frozen are lost: up to VIEW_BUFFER_MAX_EVENTS
+# (VIEW_BUFFER_MAX_RETAINED after failed flushes), from the last VIEW_BUFFER_MAX_AGE seconds
+# before the instance's final request. VIEW_BUFFER_FLUSH_ON_SHUTDOWN=1 adds a best-effort
+# flush on normal interpreter exit; no signal handlers are installed.
+VIEW_BUFFER_FLUSH_ON_SHUTDOWN = os.environ.get('VIEW_BUFFER_FLUSH_ON_SHUTDOWN', '0') == '1'
+
+_view_buffer: List[Tuple[int, int, datetime]] = []
+_view_buffer_since = 0.0
+_view_buffer_lock = threading.Lock()
+VIEW_BUFFER_STATS: Dict[str, int] = {'buffered': 0, 'flushed': 0, 'flushes': 0, 'failed_flushes': 0, 'dropped': 0}
+
+
+def buffer_view(user_id: int, video_id: int) -> int:
+    '''Queue a view event in memory and return the number of pending events'''
+    global _view_buffer_since
+    with _view_buffer_lock:
+        if not _view_buffer:
+            _view_buffer_since = time.monotonic()
+        _view_buffer.append((user_id, video_id, datetime.now(timezone.utc)))
+        VIEW_BUFFER_STATS['buffered'] += 1
+        return len(_view_buffer)
+
+
+def view_flush_due() -> bool:
+    with _view_buffer_lock:
+        return bool(_view_buffer) and (
+            len(_view_buffer) >= VIEW_BUFFER_MAX_EVENTS
+            or time.monotonic() - _view_buffer_since >= VIEW_BUFFER_MAX_AGE
+        )
+
+
+def write_views(cur: Any, events: List[Tuple[int, int, Any]]) -> Counter:
+    '''
+    Multi-row insert of (user_id, video_id, viewed_at) events into video_views plus a
+    single aggregated views_count delta per video. Events for unknown users or videos
+    are skipped. Returns the number of views recorded per video id.
+    '''
+    inserted = execute_values(cur, '''
+        INSERT INTO video_views (user_id, video_id, viewed_at)
+        SELECT e.user_id, e.video_id, e.viewed_at
+        FROM (VALUES %s) AS e(user_id, video_id, viewed_at)
+        WHERE EXISTS (SELECT 1 FROM videos v WHERE v.id = e.video_id)
+          AND EXISTS (SELECT 1 FROM users u WHERE u.id = e.user_id)
+        RETURNING video_id
+    ''', events, template='(%s::integer, %s::integer, %s::timestamptz)', fetch=True)
+    
+    deltas = Counter(row[0] for row in inserted)
+    if deltas:
+        # Sorted by id so concurrent writers lock videos rows in the same order
+        execute_values(cur, '''
+            UPDATE videos AS v SET views_count = v.views_count + d.delta
+            FROM (VALUES %s) AS d(video_id, delta)
+            WHERE v.id = d.video_id
+        ''', sorted(deltas.items()), template='(%s::integer, %s::integer)')
+    return deltas
+
+
+def flush_views(conn: Any) -> int:
+    '''
+    Write all buffered views in one transaction via write_views. On failure the events
+    go back to the buffer, up to VIEW_BUFFER_MAX_RETAINED; anything beyond that is
+    counted as dropped.
+    '''
+    global _view_buffer_since
+    with _view_buffer_lock:
+        events = _view_buffer[:]
+        _view_buffer.clear()
+    if not events:
+        return 0
+    
+    try:
+        with conn.cursor() as cur:
+            write_views(cur, events)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        with _view_buffer_lock:
+            if not _view_buffer:
+                _view_buffer_since = time.monotonic()
+            _view_buffer[:0] = events
+            overflow = len(_view_buffer) - VIEW_BUFFER_MAX_RETAINED
+            if overflow > 0:
+                del _view_buffer[:overflow]
+                VIEW_BUFFER_STATS['dropped'] += overflow
+        VIEW_BUFFER_STATS['failed_flushes'] += 1
+        print(json.dumps({'view_buffer_flush_error': str(e), 'pending': len(_view_buffer)}))
+        return 0
+    
+    VIEW_BUFFER_STATS['flushes'] += 1
+    VIEW_BUFFER_STATS['flushed'] += len(events)
+    return len(events)
+
+
+def _flush_views_on_shutdown() -> None:
+    with _view_buffer_lock:
+        pending = bool(_view_buffer)
+    db_url = os.environ.get('DATABASE_URL')
+    if not pending or not db_url:
+        return
+    conn = get_connection(db_url)
+    try:
+        flush_views(conn)
+    finally:
+        _close_quietly(conn)
+
+
+if VIEW_INGEST_MODE == 'buffered' and VIEW_BUFFER_FLUSH_ON_SHUTDOWN:
+    atexit.register(_flush_views_on_shutdown)
+
+
+VIEW_DEDUP_WINDOW = float(os.environ.get('VIEW_DEDUP_WINDOW', '1800'))
+VIEW_DEDUP_MAX_KEYS = int(os.environ.get('VIEW_DEDUP_MAX_KEYS', '100000'))
+
+_view_seen: 'OrderedDict[Tuple[str, int], float]' = OrderedDict()
+_view_seen_lock = threading.Lock()
+VIEW_DEDUP_STATS: Dict[str, int] = {'accepted': 0, 'dropped': 0, 'expired': 0, 'evicted': 0}
+
+
+def accept_view(user_id: str, video_id: int) -> bool:
+    '''
+    True if this (user, video) pair has not had a view counted in the last
+    VIEW_DEDUP_WINDOW seconds on this instance. Entries are kept in acceptance order,
+    so expired ones are trimmed from the front and the oldest is evicted once
+    VIEW_DEDUP_MAX_KEYS is reached. A window of 0 turns deduplication off.
+    '''
+    if VIEW_DEDUP_WINDOW <= 0:
+        return True
+    key = (str(user_id), video_id)
+    now = time.monotonic()
+    with _view_seen_lock:
+        while _view_seen:
+            oldest_key, accepted_at = next(iter(_view_seen.items()))
+            if now - accepted_at < VIEW_DEDUP_WINDOW:
+                break
+            del _view_seen[oldest_key]
+            VIEW_DEDUP_STATS['expired'] += 1
+        if key in _view_seen:
+            VIEW_DEDUP_STATS['dropped'] += 1
+            return False
+        _view_seen[key] = now
+        if len(_view_seen) > VIEW_DEDUP_MAX_KEYS:
+            _view_seen.popitem(last=False)
+            VIEW_DEDUP_STATS['evicted'] += 1
+        VIEW_DEDUP_STATS['accepted'] += 1
+        return True
+
+
+def forget_view(user_id: str, video_id: int) -> None:
+    '''Undo accept_view when the view could not be written, so a retry is counted'''
+    with _view_seen_lock:
+        if _view_seen.pop((str(user_id), video_id), None) is not None:
+            VIEW_DEDUP_STATS['accepted'] -= 1
+
+
+REACTION_SET = prepared('reaction_set', '''
+    WITH changed AS (
+        INSERT INTO video_likes (user_id, video_id, is_like)
+        SELECT CAST(%s AS INTEGER), v.id, CAST(%s AS BOOLEAN) FROM videos v
+        WHERE v.id = %s
+        ON CONFLICT (user_id, video_id)
+        DO UPDATE SET is_like = EXCLUDED.is_like, reacted_at = CURRENT_TIMESTAMP
+        WHERE video_likes.is_like IS DISTINCT FROM EXCLUDED.is_like
+        RETURNING is_like, (xmax = 0) AS inserted
+    ), bumped AS (
+        UPDATE videos v SET
+            likes_count = GREATEST(v.likes_count + CASE WHEN c.is_like THEN 1 WHEN c.inserted THEN 0 ELSE -1 END, 0),
+            dislikes_count = GREATEST(v.dislikes_count + CASE WHEN NOT c.is_like THEN 1 WHEN c.inserted THEN 0 ELSE -1 END, 0)
+        FROM changed c
+        WHERE v.id = %s
+        RETURNING v.likes_count, v.dislikes_count
+    )
+    SELECT likes_count, dislikes_count FROM bumped
+    UNION ALL
+    SELECT likes_count, dislikes_count FROM videos
+    WHERE id = %s AND NOT EXISTS (SELECT 1 FROM changed)
+''')
+REACTION_CLEAR = prepared('reaction_clear', '''
+    WITH removed AS (
+        DELETE FROM video_likes
+        WHERE user_id = %s AND video_id = %s
+        RETURNING is_like
+    ), bumped AS (
+        UPDATE videos v SET
+            likes_count = GREATEST(v.likes_count - CASE WHEN r.is_like THEN 1 ELSE 0 END, 0),
+            dislikes_count = GREATEST(v.dislikes_count - CASE WHEN r.is_like THEN 0 ELSE 1 END, 0)
+        FROM removed r
+        WHERE v.id = %s
+        RETURNING v.likes_count, v.dislikes_count
+    )
+    SELECT likes_count, dislikes_count FROM bumped
+    UNION ALL
+    SELECT likes_count, dislikes_count FROM videos
+    WHERE id = %s AND NOT EXISTS (SELECT 1 FROM removed)
+''')
+REACTION_CHECK = prepared('reaction_check', '''
+    SELECT is_like FROM video_likes
+    WHERE user_id = %s AND video_id = %s
+''')
+VIEW_RECORD = prepared('view_record', '''
+    WITH bumped AS (
+        UPDATE videos SET views_count = views_count + 1
+        WHERE id = %s
+        RETURNING id, views_count
+    ), recorded AS (
+        INSERT INTO video_views (user_id, video_id)
+        SELECT CAST(%s AS INTEGER), id FROM bumped
+    )
+    SELECT views_count FROM bumped
+''')
+
+
+def set_reaction(cur: Any, user_id: str, video_id: Any, is_like: bool) -> Optional[Dict[str, Any]]:
+    '''
+    Upsert the user's like/dislike and move the video counters by the resulting delta
+    in one statement. An unchanged reaction touches nothing; a new one adds 1, a flip
+    also takes 1 from the opposite counter (xmax = 0 tells an insert from an update).
+    The like is only inserted for an existing video, so a missing one returns None
+    instead of a foreign key violation.
+    '''
+    execute_prepared(cur, REACTION_SET, (user_id, is_like, video_id, video_id, video_id))
+    return cur.fetchone()
+
+
+def clear_reaction(cur: Any, user_id: str, video_id: Any) -> Optional[Dict[str, Any]]:
+    '''Remove the user's like/dislike, if any, and decrement the matching counter'''
+    execute_prepared(cur, REACTION_CLEAR, (user_id, video_id, video_id, video_id))
+    return cur.fetchone()
+
+
+def set_subscription(cur: Any, user_id: str, channel_id: Any, subscribed: bool) -> Optional[Dict[str, Any]]:
+    '''
+    Subscribe or unsubscribe and move channels.subscribers_count by 1 only when a
+    subscriptions row was actually inserted or deleted, all in one statement
+    '''
+    if subscribed:
+        change_sql = '''
+            INSERT INTO subscriptions (user_id, channel_id)
+            VALUES (%s, %s)
+            ON CONFLICT (user_id, channel_id) DO NOTHING
+            RETURNING channel_id
+        '''
+        delta = '+ 1'
+    else:
+        change_sql = '''
+            DELETE FROM subscriptions
+            WHERE user_id = %s AND channel_id = %s
+            RETURNING channel_id
+        '''
+        delta = '- 1'
+    
+    cur.execute(f'''
+        WITH changed AS ({change_sql}), bumped AS (
+            UPDATE channels c SET subscribers_count = GREATEST(c.subscribers_count {delta}, 0), version = c.version + 1
+            FROM changed ch
+            WHERE c.id = ch.channel_id
+            RETURNING c.subscribers_count
+        )
+        SELECT subscribers_count FROM bumped
+        UNION ALL
+        SELECT subscribers_count FROM channels
+        WHERE id = %s AND NOT EXISTS (SELECT 1 FROM changed)
+    ''', (user_id, channel_id, channel_id))
+    return cur.fetchone()
+
+
+BATCH_MAX_IDS = int(os.environ.get('BATCH_MAX_IDS', '200'))
+
+
+def parse_id_list(value: Any) -> List[int]:
+    '''Parse "1,2,3" or a JSON list into unique ints, raising ValueError past BATCH_MAX_IDS'''
+    if not value:
+        return []
+    items = value.split(',') if isinstance(value, str) else value
+    ids = list(dict.fromkeys(int(item) for item in items if str(item).strip()))
+    if len(ids) > BATCH_MAX_IDS:
+        raise ValueError(f'At most {BATCH_MAX_IDS} ids per request')
+    return ids
+
+
+def lookup_reactions(cur: Any, user_id: str, video_ids: List[int]) -> Dict[str, Optional[bool]]:
+    '''Map every requested video id to true (like), false (dislike) or null in one query'''
+    reactions: Dict[str, Optional[bool]] = {str(video_id): None for video_id in video_ids}
+    if video_ids:
+        cur.execute('''
+            SELECT video_id, is_like FROM video_likes
+            WHERE user_id = %s AND video_id = ANY(%s)
+        ''', (user_id, video_ids))
+        for row in cur.fetchall():
+            reactions[str(row['video_id'])] = row['is_like']
+    return reactions
+
+
+def lookup_subscriptions(cur: Any, user_id: str, channel_ids: List[int]) -> Dict[str, bool]:
+    '''Map every requested channel id to whether the user follows it in one query'''
+    subscribed: Dict[str, bool] = {str(channel_id): False for channel_id in channel_ids}
+    if channel_ids:
+        cur.execute('''
+            SELECT channel_id FROM subscriptions
+            WHERE user_id = %s AND channel_id = ANY(%s)
+        ''', (user_id, channel_ids))
+        for row in cur.fetchall():
+            subscribed[str(row['channel_id'])] = True
+    return subscribed
+
+
+BATCH_MAX_ACTIONS = int(os.environ.get('BATCH_MAX_ACTIONS', '100'))
+REACTION_ACTIONS = {'like': True, 'dislike': False, 'unlike': None}
+SUBSCRIPTION_ACTIONS = {'subscribe': True, 'unsubscribe': False}
+
+
+def run_batch(conn: Any, user_id: str, items: List[Any]) -> List[Dict[str, Any]]:
+    '''
+    Apply a list of heterogeneous actions in a single transaction. Items are grouped by
+    type and each group is written with execute_values; repeated reactions or
+    subscriptions on the same target collapse to the last one, and repeat views are
+    dropped by accept_view. Results come back in input order, with per-item errors for
+    invalid items or unknown targets. user_id must already be validated as numeric;
+    views that end up not being recorded are released from the dedup window so a
+    later retry still counts.
+    '''
+    viewer_id = int(user_id)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    reactions: Dict[int, Optional[bool]] = {}
+    subscriptions: Dict[int, bool] = {}
+    views: List[Tuple[int, int, Any]] = []
+    targets: List[Tuple[int, str, int]] = []
+    
+    for index, item in enumerate(items):
+        action = item.get('action') if isinstance(item, dict) else None
+        try:
+            if action in REACTION_ACTIONS or action == 'view':
+                target_id = int(item.get('video_id'))
+            elif action in SUBSCRIPTION_ACTIONS:
+                target_id = int(item.get('channel_id'))
+            else:
+                results[index] = {'action': action, 'ok': False, 'error': 'Invalid action'}
+                continue
+        except (TypeError, ValueError):
+            results[index] = {'action': action, 'ok': False, 'error': 'Invalid target id'}
+            continue
+        
+        if action in REACTION_ACTIONS:
+            reactions[target_id] = REACTION_ACTIONS[action]
+        elif action in SUBSCRIPTION_ACTIONS:
+            subscriptions[target_id] = SUBSCRIPTION_ACTIONS[action]
+        elif accept_view(user_id, target_id):
+            views.append((viewer_id, target_id, datetime.now(timezone.utc)))
+        else:
+            results[index] = {'action': action, 'ok': True, 'video_id': target_id, 'counted': False}
+            continue
+        targets.append((index, action, target_id))
+    
+    try:
+        with conn.cursor() as cur:
+            reaction_rows = [(user_id, video_id, is_like) for video_id, is_like in sorted(reactions.items()) if is_like is not None]
+            if reaction_rows:
+                execute_values(cur, '''
+                    WITH input(user_id, video_id, is_like) AS (VALUES %s), changed AS (
+                        INSERT INTO video_likes (user_id, video_id, is_like)
+                        SELECT i.user_id, i.video_id, i.is_like FROM input i
+                        WHERE EXISTS (SELECT 1 FROM videos v WHERE v.id = i.video_id)
+                        ON CONFLICT (user_id, video_id)
+                        DO UPDATE SET is_like = EXCLUDED.is_like, reacted_at = CURRENT_TIMESTAMP
+                        WHERE video_likes.is_like IS DISTINCT FROM EXCLUDED.is_like
+                        RETURNING video_id, is_like, (xmax = 0) AS inserted
+                    )
+                    UPDATE videos v SET
+                        likes_count = GREATEST(v.likes_count + CASE WHEN c.is_like THEN 1 WHEN c.inserted THEN 0 ELSE -1 END, 0),
+                        dislikes_count = GREATEST(v.dislikes_count + CASE WHEN NOT c.is_like THEN 1 WHEN c.inserted THEN 0 ELSE -1 END, 0)
+                    FROM changed c
+                    WHERE v.id = c.video_id
+                ''', reaction_rows, template='(%s::integer, %s::integer, %s::boolean)')
+            
+            unlike_rows = [(user_id, video_id) for video_id, is_like in sorted(reactions.items()) if is_like is None]
+            if unlike_rows:
+                execute_values(cur, '''
+                    WITH input(user_id, video_id) AS (VALUES %s), removed AS (
+                        DELETE FROM video_likes l USING input i
+                        WHERE l.user_id = i.user_id AND l.video_id = i.video_id
+                        RETURNING l.video_id, l.is_like
+                    )
+                    UPDATE videos v SET
+                        likes_count = GREATEST(v.likes_count - CASE WHEN r.is_like THEN 1 ELSE 0 END, 0),
+                        dislikes_count = GREATEST(v.dislikes_count - CASE WHEN r.is_like THEN 0 ELSE 1 END, 0)
+                    FROM removed r
+                    WHERE v.id = r.video_id
+                ''', unlike_rows, template='(%s::integer, %s::integer)')
+            
+            recorded: Counter = Counter()
+            if views and VIEW_INGEST_MODE != 'buffered':
+                recorded = write_views(cur, views)
+            
+            for subscribed in (True, False):
+                rows = [(user_id, channel_id) for channel_id, state in sorted(subscriptions.items()) if state is subscribed]
+                if not rows:
+                    continue
+                if subscribed:
+                    change_sql = '''
+                        INSERT INTO subscriptions (user_id, channel_id)
+                        SELECT i.user_id, i.channel_id FROM input i
+                        WHERE EXISTS (SELECT 1 FROM channels c WHERE c.id = i.channel_id)
+                        ON CONFLICT (user_id, channel_id) DO NOTHING
+                        RETURNING channel_id
+                    '''
+                else:
+                    change_sql = '''
+                        DELETE FROM subscriptions s USING input i
+                        WHERE s.user_id = i.user_id AND s.channel_id = i.channel_id
+                        RETURNING s.channel_id
+                    '''
+                execute_values(cur, f'''
+                    WITH input(user_id, channel_id) AS (VALUES %s), changed AS ({change_sql})
+                    UPDATE channels c SET subscribers_count = GREATEST(c.subscribers_count {'+' if subscribed else '-'} 1, 0), version = c.version + 1
+                    FROM changed ch
+                    WHERE c.id = ch.channel_id
+                ''', rows, template='(%s::integer, %s::integer)')
+            
+            video_ids = sorted({target_id for _, action, target_id in targets if action not in SUBSCRIPTION_ACTIONS})
+            channel_ids = sorted(subscriptions)
+            video_counts: Dict[int, Tuple[int, int, int]] = {}
+            channel_counts: Dict[int, int] = {}
+            if video_ids:
+                cur.execute('''
+                    SELECT id, likes_count, dislikes_count, views_count FROM videos WHERE id = ANY(%s)
+                ''', (video_ids,))
+                video_counts = {row[0]: row[1:] for row in cur.fetchall()}
+            if channel_ids:
+                cur.execute('''
+                    SELECT id, subscribers_count FROM channels WHERE id = ANY(%s)
+                ''', (channel_ids,))
+                channel_counts = {row[0]: row[1] for row in cur.fetchall()}
+    except Exception:
+        for _, video_id, _ in views:
+            forget_view(user_id, video_id)
+        raise
+    
+    for _, video_id, _ in views:
+        if VIEW_INGEST_MODE == 'buffered' and video_id in video_counts:
+            buffer_view(viewer_id, video_id)
+        elif VIEW_INGEST_MODE == 'buffered' or video_id not in recorded:
+            forget_view(user_id, video_id)
+    
+    for index, action, target_id in targets:
+        if action in SUBSCRIPTION_ACTIONS:
+            if target_id not in channel_counts:
+                results[index] = {'action': action, 'ok': False, 'error': 'Channel not found'}
+                continue
+            results[index] = {
+                'action': action,
+                'ok': True,
+                'channel_id': target_id,
+                'is_subscribed': subscriptions[target_id],
+                'subscribers_count': channel_counts[target_id]
+            }
+            continue
+        
+        if target_id not in video_counts:
+            results[index] = {'action': action, 'ok': False, 'error': 'Video not found'}
+            continue
+        likes_count, dislikes_count, views_count = video_counts[target_id]
+        result = {'action': action, 'ok': True, 'video_id': target_id}
+        if action == 'view':
+            result['counted'] = VIEW_INGEST_MODE == 'buffered' or target_id in recorded
+            result.update({'buffered': True} if VIEW_INGEST_MODE == 'buffered' else {'views_count': views_count})
+        else:
+            result.update({'likes_count': likes_count, 'dislikes_count': dislikes_count})
+        results[index] = result
+    
+    return results
+
+
+# >>> shared: auth (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+AUTH_ALLOW_USER_ID_HEADER = os.environ.get('AUTH_ALLOW_USER_ID_HEADER', '0') == '1'
+
+
+class InvalidAuthToken(Exception):
+    '''An X-Auth-Token was sent but is malformed, forged or expired; answered with 401'''
+
+
+def _b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def verify_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    '''Return the payload of an auth-issued token if its HMAC and expiry check out, without a database call'''
+    if not AUTH_TOKEN_SECRET or token.count('.') != 1:
+        return None
+    payload_part, signature = token.split('.')
+    expected = base64.urlsafe_b64encode(
+        hmac.new(AUTH_TOKEN_SECRET.encode(), payload_part.encode(), hashlib.sha256).digest()
+    ).decode().rstrip('=')
+    # Bytes, not str: compare_digest raises TypeError on non-ASCII text
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    try:
+        payload = json.loads(_b64url_decode(payload_part))
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or 'uid' not in payload or payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+
+def resolve_identity(headers: Dict[str, Any], anonymous_on_invalid: bool = False) -> Tuple[Optional[str], Optional[int]]:
+    '''
+    (user_id, channel_id) from a signed X-Auth-Token; raises InvalidAuthToken if the token
+    does not verify, unless anonymous_on_invalid is set: public reads use it so a stale or
+    expired token still gets the anonymous response. Without a token the raw X-User-Id
+    header is only trusted when AUTH_ALLOW_USER_ID_HEADER=1 (local development and the
+    bench), and then the channel is unknown.
+    '''
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    if token:
+        payload = verify_auth_token(token)
+        if payload:
+            return str(payload['uid']), payload.get('cid')
+        if not anonymous_on_invalid:
+            raise InvalidAuthToken()
+        return None, None
+    if AUTH_ALLOW_USER_ID_HEADER:
+        return headers.get('x-user-id') or headers.get('X-User-Id'), None
+    return None, None
+# <<< shared: auth
+
+
+@instrumented('video-actions')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Handle video actions - like, dislike, view count, subscriptions
+    Business: Handle video actions - like, dislike, unlike, view count (repeat views deduplicated), subscriptions
     Args: event with httpMethod, body containing action type and video/channel ID
           context with request_id
     Returns: HTTP response with updated counts
@@ -19,22 +1021,31 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Read-Primary-Until',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
     headers = event.get('headers', {})
-    user_id = headers.get('x-user-id') or headers.get('X-User-Id')
-    
+    conn = None
+    cur = None
     db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
+        user_id, _ = resolve_identity(headers, anonymous_on_invalid=method == 'GET')
+        if method == 'GET':
+            conn, db_url = get_read_connection(user_id, headers)
+        else:
+            conn = get_connection(db_url)
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Buffered views can only be flushed through the primary, not a replica serving a GET
+        if VIEW_INGEST_MODE == 'buffered' and db_url == os.environ.get('DATABASE_URL') and view_flush_due():
+            flush_views(conn)
+        
         if method == 'GET':
-            query_params = event.get('queryStringParameters', {})
+            query_params = event.get('queryStringParameters') or {}
             action = query_params.get('action')
             video_id = query_params.get('video_id')
             channel_id = query_params.get('channel_id')
@@ -53,10 +1064,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             if action == 'check_like' and user_id and video_id:
-                cur.execute('''
-                    SELECT is_like FROM video_likes 
-                    WHERE user_id = %s AND video_id = %s
-                ''', (user_id, video_id))
+                execute_prepared(cur, REACTION_CHECK, (user_id, video_id))
                 like_record = cur.fetchone()
                 
                 return {
@@ -67,6 +1075,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     })
                 }
             
+            if action == 'view_stats':
+                with _view_seen_lock:
+                    tracked = len(_view_seen)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'dedup': dict(VIEW_DEDUP_STATS, tracked=tracked, window_seconds=VIEW_DEDUP_WINDOW),
+                        'buffer': VIEW_BUFFER_STATS
+                    })
+                }
+            
+            if action == 'check_batch' and user_id:
+                try:
+                    video_ids = parse_id_list(query_params.get('video_ids'))
+                    channel_ids = parse_id_list(query_params.get('channel_ids'))
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)})
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'likes': lookup_reactions(cur, user_id, video_ids),
+                        'subscriptions': lookup_subscriptions(cur, user_id, channel_ids)
+                    })
+                }
+            
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -83,59 +1124,54 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             body_data = json.loads(event.get('body', '{}'))
             action = body_data.get('action')
+            tag_action(action)
             video_id = body_data.get('video_id')
             channel_id = body_data.get('channel_id')
             
-            if action == 'like':
-                cur.execute('''
-                    INSERT INTO video_likes (user_id, video_id, is_like)
-                    VALUES (%s, %s, true)
-                    ON CONFLICT (user_id, video_id) 
-                    DO UPDATE SET is_like = true
-                ''', (user_id, video_id))
+            if action == 'batch':
+                if not str(user_id).isdigit():
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid user id'})
+                    }
                 
-                cur.execute('''
-                    UPDATE videos SET 
-                        likes_count = (SELECT COUNT(*) FROM video_likes WHERE video_id = %s AND is_like = true),
-                        dislikes_count = (SELECT COUNT(*) FROM video_likes WHERE video_id = %s AND is_like = false)
-                    WHERE id = %s
-                    RETURNING likes_count, dislikes_count
-                ''', (video_id, video_id, video_id))
-                
-                counts = cur.fetchone()
+                items = body_data.get('actions')
+                if not isinstance(items, list) or not items or len(items) > BATCH_MAX_ACTIONS:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'actions must be a list of 1-{BATCH_MAX_ACTIONS} items'})
+                    }
+                
+                results = run_batch(conn, user_id, items)
                 conn.commit()
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'likes_count': counts['likes_count'],
-                        'dislikes_count': counts['dislikes_count']
-                    })
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **mark_write(user_id)},
+                    'body': json.dumps({'results': results})
                 }
             
-            if action == 'dislike':
-                cur.execute('''
-                    INSERT INTO video_likes (user_id, video_id, is_like)
-                    VALUES (%s, %s, false)
-                    ON CONFLICT (user_id, video_id) 
-                    DO UPDATE SET is_like = false
-                ''', (user_id, video_id))
+            if action in ('like', 'dislike', 'unlike'):
+                if action == 'unlike':
+                    counts = clear_reaction(cur, user_id, video_id)
+                else:
+                    counts = set_reaction(cur, user_id, video_id, action == 'like')
+                
+                if not counts:
+                    conn.rollback()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Video not found'})
+                    }
                 
-                cur.execute('''
-                    UPDATE videos SET 
-                        likes_count = (SELECT COUNT(*) FROM video_likes WHERE video_id = %s AND is_like = true),
-                        dislikes_count = (SELECT COUNT(*) FROM video_likes WHERE video_id = %s AND is_like = false)
-                    WHERE id = %s
-                    RETURNING likes_count, dislikes_count
-                ''', (video_id, video_id, video_id))
-                
-                counts = cur.fetchone()
                 conn.commit()
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **mark_write(user_id)},
                     'body': json.dumps({
                         'likes_count': counts['likes_count'],
                         'dislikes_count': counts['dislikes_count']
@@ -143,75 +1179,77 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             if action == 'view':
-                cur.execute('''
-                    INSERT INTO video_views (user_id, video_id)
-                    VALUES (%s, %s)
-                ''', (user_id, video_id))
+                try:
+                    view_user_id, view_video_id = int(user_id), int(video_id)
+                except (TypeError, ValueError):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid video_id'})
+                    }
                 
-                cur.execute('''
-                    UPDATE videos SET views_count = views_count + 1
-                    WHERE id = %s
-                    RETURNING views_count
-                ''', (video_id,))
+                if not accept_view(user_id, view_video_id):
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'counted': False})
+                    }
                 
-                result = cur.fetchone()
-                conn.commit()
+                if VIEW_INGEST_MODE == 'buffered':
+                    pending = buffer_view(view_user_id, view_video_id)
+                    if view_flush_due():
+                        flush_views(conn)
+                        with _view_buffer_lock:
+                            pending = len(_view_buffer)
+                    
+                    return {
+                        'statusCode': 202,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'counted': True, 'buffered': True, 'pending_views': pending})
+                    }
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'views_count': result['views_count']})
-                }
-            
-            if action == 'subscribe':
-                cur.execute('''
-                    INSERT INTO subscriptions (user_id, channel_id)
-                    VALUES (%s, %s)
-                    ON CONFLICT (user_id, channel_id) DO NOTHING
-                ''', (user_id, channel_id))
+                try:
+                    execute_prepared(cur, VIEW_RECORD, (view_video_id, view_user_id))
+                    
+                    result = cur.fetchone()
+                    conn.commit()
+                except Exception:
+                    forget_view(user_id, view_video_id)
+                    raise
                 
-                cur.execute('''
-                    UPDATE channels SET subscribers_count = (
-                        SELECT COUNT(*) FROM subscriptions WHERE channel_id = %s
-                    )
-                    WHERE id = %s
-                    RETURNING subscribers_count
-                ''', (channel_id, channel_id))
-                
-                result = cur.fetchone()
-                conn.commit()
+                if not result:
+                    forget_view(user_id, view_video_id)
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Video not found'})
+                    }
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'is_subscribed': True,
-                        'subscribers_count': result['subscribers_count']
-                    })
+                    'body': json.dumps({'counted': True, 'views_count': result['views_count']})
                 }
             
-            if action == 'unsubscribe':
-                cur.execute('''
-                    DELETE FROM subscriptions 
-                    WHERE user_id = %s AND channel_id = %s
-                ''', (user_id, channel_id))
+            if action in ('subscribe', 'unsubscribe'):
+                is_subscribed = action == 'subscribe'
+                result = set_subscription(cur, user_id, channel_id, is_subscribed)
                 
-                cur.execute('''
-                    UPDATE channels SET subscribers_count = (
-                        SELECT COUNT(*) FROM subscriptions WHERE channel_id = %s
-                    )
-                    WHERE id = %s
-                    RETURNING subscribers_count
-                ''', (channel_id, channel_id))
+                if not result:
+                    conn.rollback()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Channel not found'})
+                    }
                 
-                result = cur.fetchone()
                 conn.commit()
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **mark_write(user_id)},
                     'body': json.dumps({
-                        'is_subscribed': False,
+                        'is_subscribed': is_subscribed,
                         'subscribers_count': result['subscribers_count']
                     })
                 }
@@ -228,13 +1266,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'})
         }
         
+    except InvalidAuthToken:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid auth token'})
+        }
     except Exception as e:
-        conn.rollback()
+        if conn is not None:
+            conn.rollback()
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
         }
     finally:
-        cur.close()
-        conn.close()
+        if cur is not None:
+            cur.close()
+        if conn is not None:
+            release_connection(conn, db_url)
@@ -1,10 +1,788 @@
 import json
+import functools
 import os
+import threading
+import time
+import weakref
 import base64
-from typing import Dict, Any
+import hashlib
+import hmac
+import itertools
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Set, Tuple, Callable, Iterator
+from datetime import datetime
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
 
+# >>> shared: instrumentation (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '0'))
+
+_request_timing = threading.local()
+
+
+def param_shape(value: Any) -> Any:
+    '''Types and sizes of query parameters, so slow-query logs never carry user data'''
+    if isinstance(value, dict):
+        return {key: param_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'{type(value).__name__}[{len(value)}]'
+        return [param_shape(item) for item in value]
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def add_timing(phase: str, seconds: float) -> None:
+    phases = getattr(_request_timing, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def tag_action(action: Any) -> None:
+    '''Name the action once the handler has parsed it from the body'''
+    if getattr(_request_timing, 'phases', None) is not None:
+        _request_timing.action = f'{_request_timing.method} {action}'
+
+
+def record_query(query: Any, params: Any, seconds: float) -> None:
+    add_timing('execute', seconds)
+    queries = getattr(_request_timing, 'queries', None)
+    if queries is not None:
+        queries.append(round(seconds * 1000, 3))
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        text = query.decode(errors='replace') if isinstance(query, bytes) else str(query)
+        print(json.dumps({'slow_query': {
+            'function': getattr(_request_timing, 'function', None),
+            'action': getattr(_request_timing, 'action', None),
+            'ms': round(seconds * 1000, 3),
+            'query': ' '.join(text.split())[:500],
+            'params': param_shape(params)
+        }}))
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    if getattr(_request_timing, 'phases', None) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - started)
+
+
+class _TimedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - started)
+    
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchmany(self, *args: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+    
+    def fetchall(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            add_timing('fetch', time.perf_counter() - started)
+
+
+_timed_cursor_classes: Dict[type, type] = {}
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    '''Connection whose cursors, whatever their cursor_factory, report execute and fetch time'''
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        timed = _timed_cursor_classes.get(base)
+        if timed is None:
+            timed = _timed_cursor_classes[base] = type(f'Timed{base.__name__}', (_TimedCursorMixin, base), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+INSTRUMENTED = REQUEST_TIMING or SLOW_QUERY_MS > 0
+CONNECTION_FACTORY = TimedConnection if INSTRUMENTED else None
+
+
+def instrumented(function_name: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''
+    Wrap a handler so each request is timed by phase (connect, execute, fetch, serialize,
+    other). With REQUEST_TIMING=1 the phases go to a structured log line and a Server-Timing
+    header. When neither REQUEST_TIMING nor SLOW_QUERY_MS is set the handler is returned untouched.
+    '''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        if not INSTRUMENTED:
+            return handler
+        
+        @functools.wraps(handler)
+        def timed_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            query_params = event.get('queryStringParameters') or {}
+            _request_timing.function = function_name
+            _request_timing.method = event.get('httpMethod', 'GET')
+            _request_timing.action = f"{_request_timing.method} {query_params.get('action') or query_params.get('feed') or ''}".rstrip()
+            _request_timing.phases = phases = {}
+            _request_timing.queries = queries = []
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+            finally:
+                total = time.perf_counter() - started
+                _request_timing.phases = None
+                _request_timing.queries = None
+            
+            if REQUEST_TIMING:
+                phases['other'] = max(0.0, total - sum(phases.values()))
+                phases['total'] = total
+                print(json.dumps({'timing': {
+                    'function': function_name,
+                    'action': _request_timing.action,
+                    'status': response.get('statusCode'),
+                    'ms': {phase: round(seconds * 1000, 3) for phase, seconds in phases.items()},
+                    'queries_ms': queries
+                }}))
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items())
+                headers['Timing-Allow-Origin'] = '*'
+            return response
+        return timed_handler
+    return decorate
+# <<< shared: instrumentation
+
+
+# >>> shared: pool (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+# Caps the idle connections kept between invocations, not checkouts: every concurrent
+# invocation on an instance holds its own connection, so open connections track request
+# concurrency. Bound that with the platform's per-instance concurrency or a server-side pooler.
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+_db_pool: Dict[str, List[Tuple[Any, float]]] = {}
+_db_pool_lock = threading.Lock()
+DB_POOL_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'discarded': 0}
+
+
+def _close_quietly(conn: Any) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _ping(conn: Any) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_connection(dsn: str) -> Any:
+    '''
+    Take an idle pooled connection for dsn or open a new one; a miss never waits for a
+    connection to be released, see DB_POOL_MAX_SIZE. Connections idle longer than
+    DB_POOL_CHECK_AFTER seconds are pinged before reuse.
+    '''
+    started = time.perf_counter()
+    while True:
+        with _db_pool_lock:
+            idle = _db_pool.get(dsn)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            break
+        conn, released_at = entry
+        if not conn.closed and (time.monotonic() - released_at < DB_POOL_CHECK_AFTER or _ping(conn)):
+            DB_POOL_STATS['hits'] += 1
+            add_timing('connect', time.perf_counter() - started)
+            return conn
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+    
+    DB_POOL_STATS['misses'] += 1
+    if INSTRUMENTED:
+        print(json.dumps({'db_pool': DB_POOL_STATS}))
+    conn = psycopg2.connect(dsn, connection_factory=CONNECTION_FACTORY)
+    add_timing('connect', time.perf_counter() - started)
+    return conn
+
+
+def release_connection(conn: Any, dsn: str) -> None:
+    '''
+    Roll back any unfinished transaction and keep conn for the next warm invocation.
+    Broken connections and connections over DB_POOL_MAX_SIZE are closed instead.
+    '''
+    if conn is None:
+        return
+    try:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        pass
+    
+    if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        DB_POOL_STATS['discarded'] += 1
+        _close_quietly(conn)
+        return
+    
+    with _db_pool_lock:
+        idle = _db_pool.setdefault(dsn, [])
+        if len(idle) < DB_POOL_MAX_SIZE:
+            idle.append((conn, time.monotonic()))
+            return
+    _close_quietly(conn)
+# <<< shared: pool
+
+
+# >>> shared: read_your_writes (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', '10'))
+READ_YOUR_WRITES_MAX_USERS = 10000
+# Pins travel through the client, so they are signed; every function shares the auth secret
+READ_YOUR_WRITES_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+
+_recent_writers: 'OrderedDict[str, float]' = OrderedDict()
+_recent_writers_lock = threading.Lock()
+
+
+def _read_pin_signature(user_id: Optional[str], until: str) -> str:
+    digest = hmac.new(READ_YOUR_WRITES_SECRET.encode(), f'read-primary|{user_id or ""}|{until}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+
+def mark_write(user_id: Optional[str]) -> Dict[str, str]:
+    '''
+    Pin user_id's reads on this instance to the primary for READ_YOUR_WRITES_WINDOW seconds.
+    Returns the X-Read-Primary-Until response header, "<until>:<signature>" bound to the
+    user, so the client can carry the pin to other functions and instances by echoing it
+    but cannot mint or extend one. Without a secret only the instance-local pin applies.
+    '''
+    until = time.time() + READ_YOUR_WRITES_WINDOW
+    if user_id:
+        with _recent_writers_lock:
+            _recent_writers[str(user_id)] = until
+            _recent_writers.move_to_end(str(user_id))
+            while _recent_writers and (
+                len(_recent_writers) > READ_YOUR_WRITES_MAX_USERS or next(iter(_recent_writers.values())) <= time.time()
+            ):
+                _recent_writers.popitem(last=False)
+    if not READ_YOUR_WRITES_SECRET:
+        return {}
+    value = '%.3f' % until
+    return {
+        'X-Read-Primary-Until': f'{value}:{_read_pin_signature(user_id, value)}',
+        'Access-Control-Expose-Headers': 'X-Read-Primary-Until'
+    }
+
+
+def reads_pinned_to_primary(user_id: Optional[str], headers: Dict[str, Any]) -> bool:
+    now = time.time()
+    client_pin = headers.get('x-read-primary-until') or headers.get('X-Read-Primary-Until')
+    if client_pin and READ_YOUR_WRITES_SECRET and client_pin.count(':') == 1:
+        value, signature = client_pin.split(':')
+        try:
+            # Values beyond one window are not something we issued; ignore them
+            if (now < float(value) <= now + READ_YOUR_WRITES_WINDOW
+                    and hmac.compare_digest(signature.encode(), _read_pin_signature(user_id, value).encode())):
+                return True
+        except ValueError:
+            pass
+    if not user_id:
+        return False
+    with _recent_writers_lock:
+        until = _recent_writers.get(str(user_id))
+    return until is not None and now < until
+# <<< shared: read_your_writes
+
+
+# >>> shared: replica (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+DATABASE_REPLICA_URLS = [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '5'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '10'))
+
+_replica_health: Dict[str, Tuple[float, Optional[float]]] = {}
+_replica_turn = itertools.count()
+REPLICA_STATS: Dict[str, int] = {'replica': 0, 'pinned': 0, 'fallbacks': 0}
+
+
+def replica_lag(conn: Any) -> Optional[float]:
+    '''Seconds of replay lag, 0 once the replica has applied all WAL it received; None if the check fails'''
+    try:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END
+            ''')
+            lag = float(cur.fetchone()[0])
+        conn.rollback()
+        return lag
+    except psycopg2.Error:
+        return None
+
+
+def get_read_connection(user_id: Optional[str], headers: Dict[str, Any]) -> Tuple[Any, str]:
+    '''
+    Connection for a read-only request and the dsn to release it under. Replicas from
+    DATABASE_REPLICA_URLS are tried round-robin; one that fails to connect or lags more
+    than REPLICA_MAX_LAG seconds is skipped until it is checked again REPLICA_CHECK_INTERVAL
+    seconds later. The primary serves the read when no replica is usable or the caller
+    wrote within READ_YOUR_WRITES_WINDOW.
+    '''
+    primary = os.environ.get('DATABASE_URL')
+    if not DATABASE_REPLICA_URLS:
+        return get_connection(primary), primary
+    if reads_pinned_to_primary(user_id, headers):
+        REPLICA_STATS['pinned'] += 1
+        return get_connection(primary), primary
+    
+    first = next(_replica_turn)
+    for offset in range(len(DATABASE_REPLICA_URLS)):
+        index = (first + offset) % len(DATABASE_REPLICA_URLS)
+        dsn = DATABASE_REPLICA_URLS[index]
+        now = time.monotonic()
+        checked_at, lag = _replica_health.get(dsn, (None, None))
+        check_due = checked_at is None or now - checked_at >= REPLICA_CHECK_INTERVAL
+        if not check_due and (lag is None or lag > REPLICA_MAX_LAG):
+            continue
+        try:
+            conn = get_connection(dsn)
+        except psycopg2.Error:
+            _replica_health[dsn] = (now, None)
+            print(json.dumps({'replica_unavailable': index}))
+            continue
+        if check_due:
+            lag = replica_lag(conn)
+            _replica_health[dsn] = (now, lag)
+            if lag is None or lag > REPLICA_MAX_LAG:
+                print(json.dumps({'replica_lagging': index, 'lag_seconds': lag}))
+                release_connection(conn, dsn)
+                continue
+        REPLICA_STATS['replica'] += 1
+        return conn, dsn
+    
+    REPLICA_STATS['fallbacks'] += 1
+    return get_connection(primary), primary
+# <<< shared: replica
+
+
+# >>> shared: prepared (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+PREPARED_STATEMENTS = os.environ.get('PREPARED_STATEMENTS', '1') == '1'
+PREPARED_STATS_LOG_EVERY = int(os.environ.get('PREPARED_STATS_LOG_EVERY', '1000'))
+
+_statements: Dict[str, Tuple[str, str]] = {}
+_prepared_on: 'weakref.WeakKeyDictionary[Any, Set[str]]' = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+PREPARED_STATS: Dict[str, Dict[str, float]] = {}
+_prepared_calls = itertools.count(1)
+
+
+def prepared(name: str, sql: str) -> str:
+    '''
+    Register a hot statement under name. sql uses %s placeholders like any other query
+    here; they are numbered $1..$n for PREPARE. Returns name for execute_prepared.
+    '''
+    numbered = itertools.count(1)
+    _statements[name] = (sql, re.sub(r'%s', lambda _: f'${next(numbered)}', sql))
+    PREPARED_STATS[name] = {'calls': 0, 'prepares': 0, 'ms': 0.0}
+    return name
+
+
+def _prepare(cur: Any, name: str) -> None:
+    cur.execute(f'PREPARE {name} AS {_statements[name][1]}')
+    PREPARED_STATS[name]['prepares'] += 1
+
+
+def execute_prepared(cur: Any, name: str, params: Tuple[Any, ...] = ()) -> None:
+    '''
+    EXECUTE a registered statement on cur, preparing it first on connections that have not
+    seen it yet. Each pooled connection keeps its own set, so a reconnect or a discarded
+    connection simply prepares again on first use. If the server has lost the statement
+    and nothing else ran in the transaction yet, it is re-prepared and retried once.
+    PREPARED_STATEMENTS=0 sends the plain query instead, e.g. behind a transaction pooler.
+    '''
+    stats = PREPARED_STATS[name]
+    started = time.perf_counter()
+    if not PREPARED_STATEMENTS:
+        cur.execute(_statements[name][0], params)
+    else:
+        conn = cur.connection
+        with _prepared_lock:
+            names = _prepared_on.setdefault(conn, set())
+        fresh_transaction = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        call = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f'EXECUTE {name}'
+        if name not in names:
+            _prepare(cur, name)
+            names.add(name)
+        try:
+            cur.execute(call, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            names.discard(name)
+            if not fresh_transaction:
+                raise
+            conn.rollback()
+            _prepare(cur, name)
+            names.add(name)
+            cur.execute(call, params)
+    stats['calls'] += 1
+    stats['ms'] += (time.perf_counter() - started) * 1000
+    if PREPARED_STATS_LOG_EVERY and next(_prepared_calls) % PREPARED_STATS_LOG_EVERY == 0:
+        print(json.dumps({'prepared_statements': {
+            key: {'calls': value['calls'], 'prepares': value['prepares'], 'ms': round(value['ms'], 3)}
+            for key, value in PREPARED_STATS.items()
+        }}))
+
+
+def prepare_all(conn: Any) -> None:
+    '''
+    PREPARE every registered statement conn has not seen yet, in one round trip per
+    statement, and commit. Lets a caller warm a connection up front instead of paying
+    the extra PREPARE on each statement's first use.
+    '''
+    if not PREPARED_STATEMENTS:
+        return
+    with _prepared_lock:
+        names = _prepared_on.setdefault(conn, set())
+    with conn.cursor() as cur:
+        for name in _statements:
+            if name not in names:
+                _prepare(cur, name)
+                names.add(name)
+    conn.commit()
+# <<< shared: prepared
+
+
+FEED_DEFAULT_LIMIT = 50
+FEED_MAX_LIMIT = 100
+
+
+def encode_cursor(created_at: datetime, video_id: int) -> str:
+    raw = f'{created_at.isoformat()}|{video_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    '''Reverse encode_cursor, raising ValueError on anything malformed'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, video_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(video_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_limit(value: Optional[str]) -> int:
+    if not value:
+        return FEED_DEFAULT_LIMIT
+    return max(1, min(int(value), FEED_MAX_LIMIT))
+
+
+FEED_CACHE_TTL = float(os.environ.get('FEED_CACHE_TTL', '5'))
+FEED_CACHE_MAX_ENTRIES = int(os.environ.get('FEED_CACHE_MAX_ENTRIES', '256'))
+SUBSCRIPTION_FEED_CACHE_TTL = float(os.environ.get('SUBSCRIPTION_FEED_CACHE_TTL', '300'))
+
+_feed_cache: 'OrderedDict[Tuple[str, str, str], Tuple[float, str, Optional[str]]]' = OrderedDict()
+_feed_cache_lock = threading.Lock()
+FEED_CACHE_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def feed_cache_key(query_params: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    '''Only the shared latest and trending feeds are cached; other feed modes return None'''
+    feed = query_params.get('feed', 'latest')
+    if feed not in ('latest', 'trending') or FEED_CACHE_TTL <= 0:
+        return None
+    return (feed, query_params.get('limit') or '', query_params.get('cursor') or '')
+
+
+def feed_cache_get(key: Optional[Tuple[str, str, str]], ttl: float = FEED_CACHE_TTL) -> Optional[Tuple[str, Optional[str]]]:
+    '''Return the cached (JSON body, ETag) for key if it is younger than ttl seconds'''
+    if ttl <= 0 or key is None:
+        return None
+    with _feed_cache_lock:
+        entry = _feed_cache.get(key)
+        if entry and time.monotonic() - entry[0] < ttl:
+            _feed_cache.move_to_end(key)
+            FEED_CACHE_STATS['hits'] += 1
+            return entry[1], entry[2]
+        if entry:
+            del _feed_cache[key]
+        FEED_CACHE_STATS['misses'] += 1
+        return None
+
+
+def feed_cache_put(key: Optional[Tuple[str, str, str]], body: str, etag: Optional[str] = None) -> None:
+    if key is None:
+        return
+    with _feed_cache_lock:
+        _feed_cache[key] = (time.monotonic(), body, etag)
+        _feed_cache.move_to_end(key)
+        while len(_feed_cache) > FEED_CACHE_MAX_ENTRIES:
+            _feed_cache.popitem(last=False)
+            FEED_CACHE_STATS['evictions'] += 1
+
+
+def feed_cache_invalidate() -> None:
+    '''
+    Drop every cached feed page after a local insert.
+    Inserts made by other functions (upload) become visible once FEED_CACHE_TTL expires.
+    '''
+    with _feed_cache_lock:
+        _feed_cache.clear()
+
+
+FEED_MAX_AGE = int(os.environ.get('FEED_MAX_AGE', '5'))
+FEED_COUNTERS_MAX_STALENESS = float(os.environ.get('FEED_COUNTERS_MAX_STALENESS', '60'))
+
+
+def feed_etag(cur: Any, feed: str, limit: int, cursor: str) -> str:
+    '''
+    Weak validator for a latest/trending page built from cheap markers rather than the body:
+    the newest video id (or the last trending run), the page parameters, and a time bucket
+    that bounds how long changed view and like counters can hide behind a 304.
+    '''
+    execute_prepared(cur, FEED_MARKER_TRENDING if feed == 'trending' else FEED_MARKER_LATEST)
+    marker = cur.fetchone()
+    bucket = int(time.time() // max(FEED_COUNTERS_MAX_STALENESS, 1))
+    raw = f'{feed}|{marker[0] if marker else None}|{limit}|{cursor}|{bucket}'
+    return 'W/"%s"' % hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(headers: Dict[str, Any], etag: Optional[str]) -> bool:
+    '''If-None-Match check using the weak comparison HTTP prescribes for conditional GETs'''
+    value = headers.get('if-none-match') or headers.get('If-None-Match')
+    if not value or not etag:
+        return False
+    if value.strip() == '*':
+        return True
+    return _opaque_tag(etag) in {_opaque_tag(tag) for tag in value.split(',')}
+
+
+
+def subscription_candidates(cur: Any, user_id: str, limit: int,
+                            cursor: Optional[Tuple[datetime, int]]) -> Tuple[Tuple[Any, ...], List[int]]:
+    '''
+    Pick the followed channels that can contribute to the next subscriptions page.
+    Each channel's head is its newest video below the cursor: channels.last_video_at when
+    that is already below it, otherwise one probe of idx_videos_channel_created. Only the
+    limit + 1 newest heads (plus ties) can reach the page, so every other channel is
+    skipped. Returns the cache version (subscription count, newest subscription, newest
+    upload) and the candidate channel ids.
+    '''
+    params: List[Any] = []
+    head_sql = 'c.last_video_at'
+    if cursor:
+        head_sql = """CASE
+                WHEN c.last_video_at IS NULL OR c.last_video_at < %s THEN c.last_video_at
+                ELSE (
+                    SELECT v.created_at FROM videos v
+                    WHERE v.channel_id = s.channel_id AND (v.created_at, v.id) < (%s, %s)
+                    ORDER BY v.created_at DESC, v.id DESC
+                    LIMIT 1
+                )
+            END"""
+        params.extend([cursor[0], *cursor])
+    params.extend([user_id, limit])
+    
+    cur.execute(f"""
+        WITH subs AS (
+            SELECT s.channel_id, s.created_at, c.last_video_at, {head_sql} AS head
+            FROM subscriptions s
+            JOIN channels c ON c.id = s.channel_id
+            WHERE s.user_id = CAST(%s AS INTEGER)
+        ), cutoff AS (
+            SELECT head FROM subs WHERE head IS NOT NULL
+            ORDER BY head DESC
+            OFFSET %s LIMIT 1
+        )
+        SELECT COUNT(*), MAX(created_at), MAX(last_video_at),
+               array_agg(channel_id) FILTER (WHERE head >= COALESCE((SELECT head FROM cutoff), '-infinity'))
+        FROM subs
+    """, params)
+    row = cur.fetchone()
+    return tuple(row[:3]), list(row[3] or [])
+
+
+SEARCH_MAX_TERMS = 8
+VIDEO_COLUMNS = '''
+    v.id, v.title, v.description, v.thumbnail_url, v.video_url,
+    v.duration, v.views_count, v.likes_count, v.video_type, v.created_at,
+    c.name as channel_name, c.is_verified
+'''
+
+# The latest and trending feeds and their ETag markers run on nearly every request,
+# so they are prepared once per connection; each keyset variant is its own statement
+FEED_LATEST = prepared('feed_latest', f'''
+    SELECT {VIDEO_COLUMNS}
+    FROM videos v
+    LEFT JOIN channels c ON v.channel_id = c.id
+    ORDER BY v.created_at DESC, v.id DESC
+    LIMIT %s
+''')
+FEED_LATEST_AFTER = prepared('feed_latest_after', f'''
+    SELECT {VIDEO_COLUMNS}
+    FROM videos v
+    LEFT JOIN channels c ON v.channel_id = c.id
+    WHERE (v.created_at, v.id) < (%s, %s)
+    ORDER BY v.created_at DESC, v.id DESC
+    LIMIT %s
+''')
+# Trending pages also return trending_state.score_log_scale for the next cursor: a rebase
+# scales every score down, and a cursor from before it is scaled the same way
+FEED_TRENDING = prepared('feed_trending', f'''
+    SELECT {VIDEO_COLUMNS}, t.score, s.score_log_scale
+    FROM trending_state s
+    CROSS JOIN video_trending t
+    JOIN videos v ON v.id = t.video_id
+    LEFT JOIN channels c ON v.channel_id = c.id
+    WHERE s.id = 1
+    ORDER BY t.score DESC, t.video_id DESC
+    LIMIT %s
+''')
+FEED_TRENDING_AFTER = prepared('feed_trending_after', f'''
+    SELECT {VIDEO_COLUMNS}, t.score, s.score_log_scale
+    FROM trending_state s
+    CROSS JOIN video_trending t
+    JOIN videos v ON v.id = t.video_id
+    LEFT JOIN channels c ON v.channel_id = c.id
+    WHERE s.id = 1
+      AND (t.score, t.video_id) < (%s::float8 * exp(COALESCE(%s::float8, s.score_log_scale) - s.score_log_scale), %s)
+    ORDER BY t.score DESC, t.video_id DESC
+    LIMIT %s
+''')
+FEED_MARKER_LATEST = prepared('feed_marker_latest', 'SELECT MAX(id) FROM videos')
+FEED_MARKER_TRENDING = prepared('feed_marker_trending', 'SELECT updated_at FROM trending_state WHERE id = 1')
+
+
+def encode_rank_cursor(rank: float, video_id: int, scale: Optional[float] = None) -> str:
+    raw = f'{rank!r}|{video_id}' if scale is None else f'{rank!r}|{video_id}|{scale!r}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, int, Optional[float]]:
+    '''(rank, video_id, score_log_scale); the scale is None for search cursors'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        rank, video_id, *scale = raw.split('|')
+        if len(scale) > 1:
+            raise ValueError('Invalid cursor')
+        return float(rank), int(video_id), float(scale[0]) if scale else None
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def build_search_query(text: str, prefix: bool) -> Tuple[str, str]:
+    '''
+    Turn user input into (tsquery function, query text). Plain searches use
+    websearch_to_tsquery so quotes and -exclusions work; type-ahead ANDs the words
+    and matches the last one as a prefix.
+    '''
+    if not prefix:
+        return 'websearch_to_tsquery', text
+    terms = re.findall(r'\w+', text.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise ValueError('Empty search query')
+    return 'to_tsquery', ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+
+
+def serialize_video(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'title': row[1],
+        'description': row[2],
+        'thumbnail_url': row[3],
+        'video_url': row[4],
+        'duration': row[5],
+        'views_count': row[6],
+        'likes_count': row[7],
+        'video_type': row[8],
+        'created_at': row[9].isoformat() if row[9] else None,
+        'channel_name': row[10],
+        'is_verified': row[11]
+    }
+
+
+# >>> shared: auth (canonical copy in backend/_shared/db.py, sync with backend/_shared/sync.py)
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+AUTH_ALLOW_USER_ID_HEADER = os.environ.get('AUTH_ALLOW_USER_ID_HEADER', '0') == '1'
+
+
+class InvalidAuthToken(Exception):
+    '''An X-Auth-Token was sent but is malformed, forged or expired; answered with 401'''
+
+
+def _b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def verify_auth_token(token: str) -> Optional[Dict[str, Any]]:
+    '''Return the payload of an auth-issued token if its HMAC and expiry check out, without a database call'''
+    if not AUTH_TOKEN_SECRET or token.count('.') != 1:
+        return None
+    payload_part, signature = token.split('.')
+    expected = base64.urlsafe_b64encode(
+        hmac.new(AUTH_TOKEN_SECRET.encode(), payload_part.encode(), hashlib.sha256).digest()
+    ).decode().rstrip('=')
+    # Bytes, not str: compare_digest raises TypeError on non-ASCII text
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+    try:
+        payload = json.loads(_b64url_decode(payload_part))
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or 'uid' not in payload or payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+
+def resolve_identity(headers: Dict[str, Any], anonymous_on_invalid: bool = False) -> Tuple[Optional[str], Optional[int]]:
+    '''
+    (user_id, channel_id) from a signed X-Auth-Token; raises InvalidAuthToken if the token
+    does not verify, unless anonymous_on_invalid is set: public reads use it so a stale or
+    expired token still gets the anonymous response. Without a token the raw X-User-Id
+    header is only trusted when AUTH_ALLOW_USER_ID_HEADER=1 (local development and the
+    bench), and then the channel is unknown.
+    '''
+    token = headers.get('x-auth-token') or headers.get('X-Auth-Token')
+    if token:
+        payload = verify_auth_token(token)
+        if payload:
+            return str(payload['uid']), payload.get('cid')
+        if not anonymous_on_invalid:
+            raise InvalidAuthToken()
+        return None, None
+    if AUTH_ALLOW_USER_ID_HEADER:
+        return headers.get('x-user-id') or headers.get('X-User-Id'), None
+    return None, None
+# <<< shared: auth
+
+
+@instrumented('videos')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Video upload and management
@@ -19,7 +797,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Channel-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Channel-Id, If-None-Match, X-Read-Primary-Until',
+                'Access-Control-Expose-Headers': 'X-Cache, ETag',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -35,45 +814,203 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    headers = event.get('headers') or {}
+    feed_cache_control = f'public, max-age={FEED_MAX_AGE}'
+    
+    if method == 'GET':
+        cache_key = feed_cache_key(event.get('queryStringParameters') or {})
+        cached = feed_cache_get(cache_key)
+        if cached is not None:
+            cached_body, cached_etag = cached
+            if etag_matches(headers, cached_etag):
+                return {
+                    'statusCode': 304,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'ETag': cached_etag, 'Cache-Control': feed_cache_control, 'X-Cache': 'HIT'},
+                    'body': '',
+                    'isBase64Encoded': False
+                }
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'ETag': cached_etag, 'Cache-Control': feed_cache_control, 'X-Cache': 'HIT'},
+                'body': cached_body,
+                'isBase64Encoded': False
+            }
+    
+    conn = None
+    db_url = database_url
     try:
-        conn = psycopg2.connect(database_url)
+        user_id, token_channel_id = resolve_identity(headers, anonymous_on_invalid=method == 'GET')
+        if method == 'GET':
+            conn, db_url = get_read_connection(user_id, headers)
+        else:
+            conn = get_connection(database_url)
         cur = conn.cursor()
         
         if method == 'GET':
-            cur.execute("""
-                SELECT v.id, v.title, v.description, v.thumbnail_url, v.video_url, 
-                       v.duration, v.views_count, v.likes_count, v.video_type, v.created_at,
-                       c.name as channel_name, c.is_verified
-                FROM videos v
-                LEFT JOIN channels c ON v.channel_id = c.id
-                ORDER BY v.created_at DESC
-                LIMIT 50
-            """)
-            
-            videos = []
-            for row in cur.fetchall():
-                videos.append({
-                    'id': row[0],
-                    'title': row[1],
-                    'description': row[2],
-                    'thumbnail_url': row[3],
-                    'video_url': row[4],
-                    'duration': row[5],
-                    'views_count': row[6],
-                    'likes_count': row[7],
-                    'video_type': row[8],
-                    'created_at': row[9].isoformat() if row[9] else None,
-                    'channel_name': row[10],
-                    'is_verified': row[11]
-                })
+            query_params = event.get('queryStringParameters') or {}
+            feed = query_params.get('feed', 'latest')
+            
+            try:
+                limit = parse_limit(query_params.get('limit'))
+                
+                if feed == 'search':
+                    search_text = (query_params.get('q') or '').strip()
+                    if not search_text:
+                        raise ValueError('q is required')
+                    tsquery_fn, tsquery_text = build_search_query(search_text, query_params.get('prefix') == '1')
+                    cursor = decode_rank_cursor(query_params['cursor']) if query_params.get('cursor') else None
+                elif feed == 'trending':
+                    cursor = decode_rank_cursor(query_params['cursor']) if query_params.get('cursor') else None
+                elif feed in ('latest', 'subscriptions'):
+                    cursor = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+                else:
+                    raise ValueError('Unknown feed')
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Invalid feed, limit, cursor or search query'}),
+                    'isBase64Encoded': False
+                }
+            
+            if feed == 'subscriptions' and not user_id:
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Authentication required'}),
+                    'isBase64Encoded': False
+                }
+            
+            etag = None
+            if feed in ('latest', 'trending'):
+                # Revalidation costs one index probe; a match skips the feed query and serialisation
+                etag = feed_etag(cur, feed, limit, query_params.get('cursor') or '')
+                if etag_matches(headers, etag):
+                    return {
+                        'statusCode': 304,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'ETag': etag, 'Cache-Control': feed_cache_control, 'X-Cache': 'MISS'},
+                        'body': '',
+                        'isBase64Encoded': False
+                    }
+            
+            next_cursor = None
+            params: List[Any] = []
+            
+            if feed == 'search':
+                # GIN index on search_vector narrows the candidates; pages continue on (rank, id)
+                where_clause = ''
+                params.extend([tsquery_text, tsquery_text])
+                if cursor:
+                    where_clause = 'WHERE (rank, id) < (%s::real, %s)'
+                    params.extend(cursor[:2])
+                params.append(limit + 1)
+                
+                cur.execute(f"""
+                    WITH q AS (
+                        SELECT {tsquery_fn}('russian', %s) || {tsquery_fn}('english', %s) AS query
+                    )
+                    SELECT * FROM (
+                        SELECT {VIDEO_COLUMNS}, ts_rank_cd(v.search_vector, q.query) AS rank
+                        FROM q
+                        CROSS JOIN videos v
+                        LEFT JOIN channels c ON v.channel_id = c.id
+                        WHERE v.search_vector @@ q.query
+                    ) ranked
+                    {where_clause}
+                    ORDER BY rank DESC, id DESC
+                    LIMIT %s
+                """, params)
+                
+                rows = cur.fetchall()
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    next_cursor = encode_rank_cursor(rows[-1][12], rows[-1][0])
+            elif feed == 'trending':
+                # Scores are precomputed by the update_trending maintenance job;
+                # reading is one scan of idx_video_trending_score
+                if cursor:
+                    score, video_id, scale = cursor
+                    execute_prepared(cur, FEED_TRENDING_AFTER, (score, scale, video_id, limit + 1))
+                else:
+                    execute_prepared(cur, FEED_TRENDING, (limit + 1,))
+                
+                rows = cur.fetchall()
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    next_cursor = encode_rank_cursor(rows[-1][12], rows[-1][0], rows[-1][13])
+            elif feed == 'subscriptions':
+                version, channel_ids = subscription_candidates(cur, user_id, limit, cursor)
+                if not cursor and SUBSCRIPTION_FEED_CACHE_TTL > 0:
+                    # The cached head stays valid until a followed channel uploads
+                    # (last_video_at) or the subscription set changes
+                    cache_key = ('subscriptions', f'{user_id}:{limit}', json.dumps(version, default=str))
+                    cached = feed_cache_get(cache_key, SUBSCRIPTION_FEED_CACHE_TTL)
+                    if cached is not None:
+                        return {
+                            'statusCode': 200,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': 'HIT'},
+                            'body': cached[0],
+                            'isBase64Encoded': False
+                        }
+                
+                # k-way merge over the candidate channels only: each contributes at most
+                # limit + 1 rows read newest-first from idx_videos_channel_created, and the
+                # outer ORDER BY ... LIMIT keeps a bounded top-N heap of them
+                rows = []
+                if channel_ids:
+                    keyset_clause = ''
+                    params.append(channel_ids)
+                    if cursor:
+                        keyset_clause = 'AND (v.created_at, v.id) < (%s, %s)'
+                        params.extend(cursor)
+                    params.extend([limit + 1, limit + 1])
+                    
+                    cur.execute(f"""
+                        SELECT {VIDEO_COLUMNS}
+                        FROM unnest(%s::integer[]) k(channel_id)
+                        JOIN channels c ON c.id = k.channel_id
+                        CROSS JOIN LATERAL (
+                            SELECT * FROM videos v
+                            WHERE v.channel_id = k.channel_id {keyset_clause}
+                            ORDER BY v.created_at DESC, v.id DESC
+                            LIMIT %s
+                        ) v
+                        ORDER BY v.created_at DESC, v.id DESC
+                        LIMIT %s
+                    """, params)
+                    rows = cur.fetchall()
+                
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    next_cursor = encode_cursor(rows[-1][9], rows[-1][0])
+            else:
+                # Keyset pagination over idx_videos_created (created_at DESC, id DESC):
+                # every page is an index range scan, no matter how deep the client scrolls
+                if cursor:
+                    execute_prepared(cur, FEED_LATEST_AFTER, (*cursor, limit + 1))
+                else:
+                    execute_prepared(cur, FEED_LATEST, (limit + 1,))
+                
+                rows = cur.fetchall()
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    next_cursor = encode_cursor(rows[-1][9], rows[-1][0])
             
             cur.close()
-            conn.close()
+            
+            with timed_phase('serialize'):
+                videos = [serialize_video(row) for row in rows]
+                response_body = json.dumps({'videos': videos, 'next_cursor': next_cursor})
+            feed_cache_put(cache_key, response_body, etag)
+            
+            response_headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': 'MISS'}
+            if etag:
+                response_headers.update({'ETag': etag, 'Cache-Control': feed_cache_control})
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'videos': videos}),
+                'headers': response_headers,
+                'body': response_body,
                 'isBase64Encoded': False
             }
         
@@ -88,7 +1025,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             duration = body_data.get('duration', 0)
             video_type = body_data.get('video_type', 'regular')
             
-            if not channel_id or not title or not video_url:
+            if not user_id:
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Authentication required'}),
+                    'isBase64Encoded': False
+                }
+            
+            if not channel_id or not title or not video_url or not str(channel_id).isdigit():
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -96,21 +1041,45 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            forbidden = {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Not the owner of this channel'}),
+                'isBase64Encoded': False
+            }
+            if token_channel_id is not None and str(token_channel_id) != str(channel_id):
+                return forbidden
+            
+            # The insert only selects the channel row if the caller owns it, so ownership
+            # costs no extra round trip when the identity came without a channel id
             cur.execute(
-                """INSERT INTO videos (channel_id, title, description, video_url, thumbnail_url, duration, video_type)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s)
-                   RETURNING id, title, description, video_url, thumbnail_url, duration, video_type, views_count, likes_count""",
-                (channel_id, title, description, video_url, thumbnail_url, duration, video_type)
+                """WITH inserted AS (
+                       INSERT INTO videos (channel_id, title, description, video_url, thumbnail_url, duration, video_type)
+                       SELECT c.id, %s, %s, %s, %s, %s, %s
+                       FROM channels c
+                       WHERE c.id = CAST(%s AS INTEGER) AND c.user_id = CAST(%s AS INTEGER)
+                       RETURNING id, title, description, video_url, thumbnail_url, duration, video_type, views_count, likes_count,
+                                 channel_id, created_at
+                   ), touched AS (
+                       UPDATE channels c SET last_video_at = GREATEST(c.last_video_at, i.created_at), videos_count = c.videos_count + 1, version = c.version + 1
+                       FROM inserted i
+                       WHERE c.id = i.channel_id
+                   )
+                   SELECT id, title, description, video_url, thumbnail_url, duration, video_type, views_count, likes_count
+                   FROM inserted""",
+                (title, description, video_url, thumbnail_url, duration, video_type, channel_id, user_id)
             )
             
             video = cur.fetchone()
             conn.commit()
+            if not video:
+                return forbidden
             cur.close()
-            conn.close()
+            feed_cache_invalidate()
             
             return {
                 'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **mark_write(user_id)},
                 'body': json.dumps({
                     'video': {
                         'id': video[0],
@@ -128,7 +1097,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         cur.close()
-        conn.close()
         
         return {
             'statusCode': 405,
@@ -137,10 +1105,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
         
+    except InvalidAuthToken:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid auth token'}),
+            'isBase64Encoded': False
+        }
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+    finally:
+        release_connection(conn, db_url)
\ No newline at end of file
@@ -0,0 +1,33 @@
+'''Import backend/<function>/index.py modules the way the cloud runtime would, one module per function'''
+import importlib.util
+import os
+import threading
+from types import ModuleType
+from typing import Dict
+
+# Bench events identify users with a plain X-User-Id header instead of signed tokens, but
+# auth still needs a secret to issue tokens for the login and register scenarios
+os.environ.setdefault('AUTH_ALLOW_USER_ID_HEADER', '1')
+os.environ.setdefault('AUTH_TOKEN_SECRET', 'bench-only-secret')
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+_loaded: Dict[str, ModuleType] = {}
+_load_lock = threading.Lock()
+
+
+def load_handler(function: str) -> ModuleType:
+    '''
+    Load a function module once per process. Module-level state (connection pool,
+    caches, buffers) then behaves like a warm instance shared by every call in
+    this process.
+    '''
+    with _load_lock:
+        if function in _loaded:
+            return _loaded[function]
+        path = os.path.join(BACKEND_DIR, function, 'index.py')
+        spec = importlib.util.spec_from_file_location(f'bench_{function.replace("-", "_")}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded[function] = module
+        return module
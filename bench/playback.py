@@ -0,0 +1,112 @@
+'''
+Seek-heavy playback against the stream function and local storage, no database needed.
+Writes one random blob of --size MiB under STORAGE_ROOT, then each worker plays it like
+a scrubbing viewer: jump to a random offset, read a few consecutive Range windows, jump
+again. Reports latency, throughput and the process's anonymous (heap) memory, which
+should stay flat as --size grows: blob pages are mapped from the page cache, not copied
+into the process, so the kernel can reclaim them at any time:
+
+    python bench/playback.py --size 512 --concurrency 8 --duration 30
+'''
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+WRITE_BLOCK = 1024 * 1024
+
+
+def anonymous_memory_mib() -> float:
+    '''RssAnon from /proc/self/status; file-backed mapped pages are deliberately left out'''
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def write_blob(root: str, size_mib: int, seed: int) -> Tuple[str, int]:
+    '''Write size_mib of pseudo-random bytes into the blob layout; returns (key, size)'''
+    rng = random.Random(seed)
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(root, 'playback.tmp')
+    os.makedirs(root, exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+        for _ in range(size_mib):
+            block = rng.randbytes(WRITE_BLOCK)
+            digest.update(block)
+            f.write(block)
+    sha = digest.hexdigest()
+    key = f'blobs/{sha[:2]}/{sha}'
+    os.makedirs(os.path.join(root, os.path.dirname(key)), exist_ok=True)
+    os.replace(tmp_path, os.path.join(root, key))
+    return key, size_mib * WRITE_BLOCK
+
+
+def play(key: str, size: int, window: int, reads_per_seek: int, deadline: float, seed: int) -> Tuple[List[float], int]:
+    # Imported here so STORAGE_ROOT and STREAM_MAX_RANGE are set before module load
+    from handlers import load_handler
+    stream = load_handler('stream')
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    errors = 0
+    while time.monotonic() < deadline:
+        offset = rng.randrange(0, max(size - window * reads_per_seek, 1))
+        for _ in range(reads_per_seek):
+            event = {'httpMethod': 'GET', 'queryStringParameters': {'key': key},
+                     'headers': {'Range': f'bytes={offset}-{offset + window - 1}'}}
+            started = time.perf_counter()
+            response = stream.handler(event, None)
+            latencies.append(time.perf_counter() - started)
+            errors += response['statusCode'] != 206
+            offset += window
+    return latencies, errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=256, help='blob size in MiB')
+    parser.add_argument('--window', type=int, default=256 * 1024, help='bytes per Range request')
+    parser.add_argument('--reads-per-seek', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--root', default=None, help='storage root; a temporary directory by default')
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix='playback-')
+    os.environ['STORAGE_ROOT'] = root
+    os.environ['STREAM_MAX_RANGE'] = str(max(args.window, int(os.environ.get('STREAM_MAX_RANGE', '0'))))
+    key, size = write_blob(root, args.size, args.seed)
+    memory_before = anonymous_memory_mib()
+
+    deadline = time.monotonic() + args.duration
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(
+            lambda worker: play(key, size, args.window, args.reads_per_seek, deadline, args.seed + worker),
+            range(args.concurrency)
+        ))
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    errors = sum(worker_errors for _, worker_errors in results)
+    memory_after = anonymous_memory_mib()
+
+    def percentile(fraction: float) -> float:
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+
+    print(f'blob {args.size} MiB, window {args.window} B, {args.concurrency} workers, storage {root}')
+    print(f"{'requests':>10}{'rps':>10}{'MiB/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    print(f'{len(latencies):>10}{len(latencies) / args.duration:>10.1f}'
+          f'{len(latencies) * args.window / WRITE_BLOCK / args.duration:>10.1f}'
+          f'{percentile(0.50):>10.3f}{percentile(0.95):>10.3f}{percentile(0.99):>10.3f}{errors:>8}')
+    print(f'anonymous memory {memory_before:.1f} MiB before playback, {memory_after:.1f} MiB after')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+Check how many database round trips each write path makes against a seeded bench
+database. Every call runs with REQUEST_TIMING=1, and the number of executed statements
+is read from the handler's timing log line. The script exits non-zero when a path
+makes more round trips than its budget:
+
+    python bench/round_trips.py --dsn postgresql://localhost/video_bench
+'''
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+os.environ['REQUEST_TIMING'] = '1'
+os.environ['VIEW_INGEST_MODE'] = 'direct'
+os.environ['VIEW_DEDUP_WINDOW'] = '0'
+os.environ.pop('DATABASE_REPLICA_URLS', None)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from handlers import load_handler  # noqa: E402
+from run import Dataset, channel_owner, load_dataset  # noqa: E402
+
+EventFactory = Callable[[random.Random, Dataset], Dict[str, Any]]
+
+
+def register(rng: random.Random, data: Dataset) -> Dict[str, Any]:
+    name = f'rt_user_{rng.getrandbits(48):x}'
+    return {'httpMethod': 'POST', 'body': json.dumps({
+        'action': 'register', 'username': name, 'email': f'{name}@bench.local', 'password': 'bench',
+    })}
+
+
+def login(rng: random.Random, data: Dataset) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'body': json.dumps({'action': 'login', 'username': 'bench_user_1', 'password': 'bench'})}
+
+
+def video_create(rng: random.Random, data: Dataset) -> Dict[str, Any]:
+    # The first seeded channel belongs to the first seeded user
+    return {'httpMethod': 'POST', 'headers': {'X-User-Id': str(data['users'][0])}, 'body': json.dumps({
+        'channel_id': data['channels'][0], 'title': 'Round trip check',
+        'video_url': 'https://storage.example.com/videos/bench.mp4', 'duration': 60,
+    })}
+
+
+def legacy_upload(rng: random.Random, data: Dataset) -> Dict[str, Any]:
+    # Fresh bytes each run, so both blobs take the find + register path
+    return {'httpMethod': 'POST', 'headers': {'X-User-Id': str(channel_owner(rng, data))}, 'body': json.dumps({
+        'title': 'Round trip check', 'duration': 60,
+        'video_file': base64.b64encode(rng.randbytes(256)).decode(),
+        'thumbnail_file': base64.b64encode(rng.randbytes(64)).decode(),
+    })}
+
+
+def video_action(action: str) -> EventFactory:
+    def factory(rng: random.Random, data: Dataset) -> Dict[str, Any]:
+        target = 'channel_id' if action.endswith('subscribe') else 'video_id'
+        bounds = data['channels'] if target == 'channel_id' else data['videos']
+        return {'httpMethod': 'POST', 'headers': {'X-User-Id': str(rng.randint(*data['users']))},
+                'body': json.dumps({'action': action, target: rng.randint(*bounds)})}
+    return factory
+
+
+# (function, path label, round-trip budget, event factory)
+CASES: List[Tuple[str, str, int, EventFactory]] = [
+    ('auth', 'register', 1, register),
+    ('auth', 'login', 1, login),
+    ('videos', 'create', 1, video_create),
+    # Two blobs at one lookup and one registration each, then the single video insert
+    ('upload', 'legacy', 5, legacy_upload),
+    ('video-actions', 'like', 1, video_action('like')),
+    ('video-actions', 'dislike', 1, video_action('dislike')),
+    ('video-actions', 'unlike', 1, video_action('unlike')),
+    ('video-actions', 'view', 1, video_action('view')),
+    ('video-actions', 'subscribe', 1, video_action('subscribe')),
+    ('video-actions', 'unsubscribe', 1, video_action('unsubscribe')),
+]
+
+
+def warm_prepared_statements(function: str, dsn: str) -> None:
+    '''
+    videos and video-actions PREPARE their hot statements on a connection's first use of
+    each, which adds one PREPARE to that first call only. Preparing them on the pooled
+    connection up front makes the budgets measure the steady state.
+    '''
+    module = load_handler(function)
+    if not hasattr(module, 'prepare_all'):
+        return
+    conn = module.get_connection(dsn)
+    try:
+        module.prepare_all(conn)
+    finally:
+        module.release_connection(conn, dsn)
+
+
+def count_round_trips(function: str, event: Dict[str, Any]) -> Tuple[Any, int]:
+    '''Call the handler and return its status and the number of statements it executed'''
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        response = load_handler(function).handler(event, None)
+    for line in output.getvalue().splitlines():
+        record = json.loads(line)
+        if 'timing' in record:
+            return response.get('statusCode'), len(record['timing']['queries_ms'])
+    raise RuntimeError(f'{function} logged no timing line; is REQUEST_TIMING honoured?')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL', 'postgresql://localhost/video_bench'))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.dsn
+    data = load_dataset(args.dsn)
+    rng = random.Random(args.seed)
+
+    for function in {case[0] for case in CASES}:
+        warm_prepared_statements(function, args.dsn)
+
+    failures = 0
+    print(f"{'path':<28} {'status':>6} {'trips':>6} {'budget':>7}")
+    for function, label, budget, factory in CASES:
+        status, trips = count_round_trips(function, factory(rng, data))
+        ok = status is not None and status < 500 and trips <= budget
+        failures += not ok
+        print(f"{function + ':' + label:<28} {str(status):>6} {trips:>6} {budget:>7}{'' if ok else '  FAIL'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
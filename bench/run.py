@@ -0,0 +1,359 @@
+'''
+Replay a weighted mix of handler(event, context) calls against a database seeded by
+bench/seed.py and report p50/p95/p99 latency and throughput per handler and action.
+
+Workers are threads (one warm instance per function, shared pool and caches) or
+processes (one warm instance per worker, closer to the platform scaling out).
+Results are written as JSON so runs before and after a change can be compared:
+
+    python bench/run.py --mix read_heavy --concurrency 16 --duration 30
+    python bench/run.py --mix read_heavy --compare bench/results/read_heavy-20240101-120000.json
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from handlers import load_handler  # noqa: E402
+from seed import TITLE_WORDS  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+Dataset = Dict[str, Tuple[int, int]]
+EventFactory = Callable[[random.Random, Dataset, float], Dict[str, Any]]
+
+
+def pick(rng: random.Random, bounds: Tuple[int, int], skew: float) -> int:
+    '''Skewed id in [lo, hi]: low ids are the popular ones, matching how seed.py generated data'''
+    lo, hi = bounds
+    return lo + int((hi - lo + 1) * rng.random() ** skew)
+
+
+def channel_owner(rng: random.Random, data: Dataset) -> int:
+    '''Channels were created for the first seeded users, so these users always own one'''
+    return data['users'][0] + rng.randint(0, data['channels'][1] - data['channels'][0])
+
+
+def user_headers(rng: random.Random, data: Dataset) -> Dict[str, str]:
+    return {'X-User-Id': str(rng.randint(*data['users']))}
+
+
+def feed_latest(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'queryStringParameters': {'limit': rng.choice(['20', '50'])}}
+
+
+def feed_trending(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'queryStringParameters': {'feed': 'trending', 'limit': '20'}}
+
+
+def feed_search(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'queryStringParameters': {'feed': 'search', 'q': rng.choice(TITLE_WORDS), 'limit': '20'}}
+
+
+def feed_subscriptions(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'headers': user_headers(rng, data),
+            'queryStringParameters': {'feed': 'subscriptions', 'limit': '20'}}
+
+
+def video_create(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    channel_id = pick(rng, data['channels'], skew)
+    owner = data['users'][0] + channel_id - data['channels'][0]
+    return {'httpMethod': 'POST', 'headers': {'X-User-Id': str(owner)}, 'body': json.dumps({
+        'channel_id': channel_id,
+        'title': f'Bench upload {rng.getrandbits(32)}',
+        'video_url': 'https://storage.example.com/videos/bench.mp4',
+        'duration': rng.randint(30, 600),
+    })}
+
+
+def channel_get(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': {'channel_id': str(pick(rng, data['channels'], skew))}}
+
+
+def channel_videos(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    params = {'action': 'videos', 'channel_id': str(pick(rng, data['channels'], skew)), 'limit': '24'}
+    if rng.random() < 0.3:
+        params['video_type'] = rng.choice(['regular', 'series', 'movie'])
+    return {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': params}
+
+
+def channel_analytics(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'headers': {'X-User-Id': str(channel_owner(rng, data))},
+            'queryStringParameters': {'action': 'analytics', 'days': rng.choice(['7', '30', '90'])}}
+
+
+def action_view(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'headers': user_headers(rng, data),
+            'body': json.dumps({'action': 'view', 'video_id': pick(rng, data['videos'], skew)})}
+
+
+def action_like(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'headers': user_headers(rng, data),
+            'body': json.dumps({'action': rng.choice(['like', 'like', 'dislike', 'unlike']),
+                                'video_id': pick(rng, data['videos'], skew)})}
+
+
+def action_subscribe(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'headers': user_headers(rng, data),
+            'body': json.dumps({'action': rng.choice(['subscribe', 'unsubscribe']),
+                                'channel_id': pick(rng, data['channels'], skew)})}
+
+
+def action_check_batch(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    video_ids = {pick(rng, data['videos'], skew) for _ in range(20)}
+    return {'httpMethod': 'GET', 'headers': user_headers(rng, data), 'queryStringParameters': {
+        'action': 'check_batch', 'video_ids': ','.join(map(str, video_ids)),
+        'channel_ids': str(pick(rng, data['channels'], skew)),
+    }}
+
+
+def auth_login(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'body': json.dumps({
+        'action': 'login', 'username': f"bench_user_{rng.randint(1, data['users'][1] - data['users'][0] + 1)}",
+        'password': 'bench',
+    })}
+
+
+def upload_init(rng: random.Random, data: Dataset, skew: float) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'headers': {'X-User-Id': str(channel_owner(rng, data))}, 'body': json.dumps({
+        'action': 'init', 'title': 'Bench chunked upload', 'total_size': 10 * 1024 * 1024,
+    })}
+
+
+# (weight, function, action label, event factory)
+MIXES: Dict[str, List[Tuple[int, str, str, EventFactory]]] = {
+    'read_heavy': [
+        (30, 'videos', 'feed_latest', feed_latest),
+        (10, 'videos', 'feed_trending', feed_trending),
+        (8, 'videos', 'search', feed_search),
+        (8, 'videos', 'feed_subscriptions', feed_subscriptions),
+        (12, 'channel', 'get', channel_get),
+        (8, 'channel', 'videos', channel_videos),
+        (1, 'channel', 'analytics', channel_analytics),
+        (15, 'video-actions', 'view', action_view),
+        (4, 'video-actions', 'like', action_like),
+        (4, 'video-actions', 'check_batch', action_check_batch),
+        (1, 'auth', 'login', auth_login),
+    ],
+    'write_heavy': [
+        (40, 'video-actions', 'view', action_view),
+        (20, 'video-actions', 'like', action_like),
+        (10, 'video-actions', 'subscribe', action_subscribe),
+        (5, 'videos', 'create', video_create),
+        (5, 'upload', 'init', upload_init),
+        (20, 'videos', 'feed_latest', feed_latest),
+    ],
+    'feeds': [
+        (40, 'videos', 'feed_latest', feed_latest),
+        (20, 'videos', 'feed_trending', feed_trending),
+        (20, 'videos', 'search', feed_search),
+        (20, 'videos', 'feed_subscriptions', feed_subscriptions),
+    ],
+}
+
+
+def load_dataset(dsn: str) -> Dataset:
+    '''Id ranges of the seeded tables, read once so workers can generate events without queries'''
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT MIN(id), MAX(id) FROM users WHERE username LIKE 'bench_user_%'")
+            users = cur.fetchone()
+            cur.execute('SELECT MIN(c.id), MAX(c.id) FROM channels c JOIN users u ON u.id = c.user_id '
+                        "WHERE u.username LIKE 'bench_user_%'")
+            channels = cur.fetchone()
+            cur.execute('SELECT MIN(id), MAX(id) FROM videos')
+            videos = cur.fetchone()
+    finally:
+        conn.close()
+    if None in users or None in channels or None in videos:
+        raise SystemExit('No bench data found; run bench/seed.py first')
+    return {'users': users, 'channels': channels, 'videos': videos}
+
+
+def run_worker(mix: str, data: Dataset, skew: float, warmup: float, duration: float,
+               max_calls: Optional[int], seed: int) -> Tuple[float, Dict[str, Dict[str, Any]]]:
+    '''
+    Call handlers for warmup seconds without recording (filling pools and caches), then
+    for duration seconds or max_calls calls. Returns the recorded wall time and raw
+    latencies per function/action.
+    '''
+    rng = random.Random(seed)
+    calls = MIXES[mix]
+    weights = [weight for weight, *_ in calls]
+    handlers = {function: load_handler(function).handler for _, function, _, _ in calls}
+    samples: Dict[str, Dict[str, Any]] = defaultdict(lambda: {'latencies': [], 'statuses': defaultdict(int), 'errors': 0})
+
+    def call() -> Tuple[str, Optional[int], float]:
+        _, function, action, factory = rng.choices(calls, weights)[0]
+        event = factory(rng, data, skew)
+        started = time.perf_counter()
+        try:
+            status = handlers[function](event, None).get('statusCode')
+        except Exception:
+            status = None
+        return f'{function}:{action}', status, time.perf_counter() - started
+
+    warm_until = time.perf_counter() + warmup
+    while time.perf_counter() < warm_until:
+        call()
+
+    started = time.perf_counter()
+    deadline = started + duration
+    made = 0
+    while time.perf_counter() < deadline and (max_calls is None or made < max_calls):
+        key, status, latency = call()
+        sample = samples[key]
+        if status is None:
+            sample['errors'] += 1
+        else:
+            sample['statuses'][str(status)] += 1
+        sample['latencies'].append(latency)
+        made += 1
+
+    return time.perf_counter() - started, {
+        key: {'latencies': value['latencies'], 'statuses': dict(value['statuses']), 'errors': value['errors']}
+        for key, value in samples.items()
+    }
+
+
+def _process_worker(args: Tuple[Any, ...]) -> Tuple[float, Dict[str, Dict[str, Any]]]:
+    return run_worker(*args)
+
+
+def merge(parts: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    merged: Dict[str, Dict[str, Any]] = {}
+    for part in parts:
+        for key, value in part.items():
+            target = merged.setdefault(key, {'latencies': [], 'statuses': defaultdict(int), 'errors': 0})
+            target['latencies'].extend(value['latencies'])
+            for status, count in value['statuses'].items():
+                target['statuses'][status] += count
+            target['errors'] += value['errors']
+    return merged
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    '''Nearest-rank percentile of an already sorted list'''
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(merged: Dict[str, Dict[str, Any]], elapsed: float) -> Dict[str, Dict[str, Any]]:
+    summary = {}
+    for key in sorted(merged):
+        latencies = sorted(merged[key]['latencies'])
+        summary[key] = {
+            'calls': len(latencies),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            'statuses': dict(merged[key]['statuses']),
+            'errors': merged[key]['errors'],
+        }
+    return summary
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(summary: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    header = f"{'handler:action':<34}{'calls':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    print(header)
+    print('-' * len(header))
+    for key, row in summary.items():
+        print(f"{key:<34}{row['calls']:>8}{row['throughput_rps']:>10}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['errors']:>8}")
+        before = (baseline or {}).get(key)
+        if before:
+            deltas = []
+            for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if before[metric]:
+                    deltas.append(f'{metric} {(row[metric] - before[metric]) / before[metric] * 100:+.1f}%')
+            print(f"{'':<34}vs baseline: {', '.join(deltas)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL', 'postgresql://localhost/video_bench'))
+    parser.add_argument('--mix', choices=sorted(MIXES), default='read_heavy')
+    parser.add_argument('--mode', choices=['threads', 'processes'], default='threads')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run each phase')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of unrecorded calls first')
+    parser.add_argument('--requests', type=int, default=None, help='stop each worker after this many calls')
+    parser.add_argument('--skew', type=float, default=3.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='result file; defaults to bench/results/<mix>-<time>.json')
+    parser.add_argument('--compare', default=None, help='earlier result file to diff against')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.dsn
+    data = load_dataset(args.dsn)
+
+    duration = args.duration if args.requests is None else float('inf')
+    jobs = [(args.mix, data, args.skew, args.warmup, duration, args.requests, args.seed + i)
+            for i in range(args.concurrency)]
+    if args.mode == 'processes':
+        with multiprocessing.get_context('spawn').Pool(args.concurrency) as pool:
+            parts = pool.map(_process_worker, jobs)
+    else:
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            parts = list(executor.map(lambda job: run_worker(*job), jobs))
+
+    elapsed = max(part_elapsed for part_elapsed, _ in parts)
+    merged = merge([samples for _, samples in parts])
+    summary = summarize(merged, elapsed)
+    total_calls = sum(row['calls'] for row in summary.values())
+
+    result = {
+        'mix': args.mix,
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'skew': args.skew,
+        'elapsed_s': round(elapsed, 3),
+        'total_calls': total_calls,
+        'throughput_rps': round(total_calls / elapsed, 2),
+        'git_revision': git_revision(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'dataset': {name: list(bounds) for name, bounds in data.items()},
+        'results': summary,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.mix}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    print_table(summary, baseline)
+    print(f"\n{total_calls} calls in {elapsed:.1f}s ({result['throughput_rps']} rps), saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
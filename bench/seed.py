@@ -0,0 +1,233 @@
+'''
+Load a synthetic dataset into a local Postgres for the benchmark harness.
+
+Applies db_migrations in version order, then generates users, channels, videos,
+views, likes and subscriptions server-side with generate_series. Popularity is
+skewed: a value drawn as floor(n * random() ^ skew) lands on low ids far more often,
+so a few channels own most videos and a few videos get most views and likes.
+
+    python bench/seed.py --dsn postgresql://localhost/video_bench --videos 1000000 --views 5000000
+'''
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS_DIR = os.path.join(ROOT, 'db_migrations')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from handlers import load_handler  # noqa: E402
+
+TITLE_WORDS = [
+    'обзор', 'гайд', 'стрим', 'прохождение', 'киберпанк', 'музыка', 'новости', 'рецепт',
+    'review', 'guide', 'stream', 'music', 'news', 'tutorial', 'python', 'travel',
+]
+
+
+def migration_files() -> List[str]:
+    '''db_migrations/V<n>__*.sql sorted by numeric version, the order Flyway applies them'''
+    files = [f for f in os.listdir(MIGRATIONS_DIR) if re.match(r'V\d+__.+\.sql$', f)]
+    return sorted(files, key=lambda f: int(re.match(r'V(\d+)__', f).group(1)))
+
+
+def apply_migrations(conn: Any) -> None:
+    with conn.cursor() as cur:
+        for name in migration_files():
+            with open(os.path.join(MIGRATIONS_DIR, name), encoding='utf-8') as f:
+                cur.execute(f.read())
+            print(f'applied {name}')
+    conn.commit()
+
+
+def timed(conn: Any, label: str, sql: str, params: Dict[str, Any]) -> None:
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+    conn.commit()
+    print(f'{label}: {time.perf_counter() - started:.1f}s')
+
+
+def seed(conn: Any, args: argparse.Namespace) -> None:
+    params = {
+        'users': args.users,
+        'channels': args.channels,
+        'videos': args.videos,
+        'views': args.views,
+        'likes': args.likes,
+        'subscriptions': args.subscriptions,
+        'skew': args.skew,
+        'days': args.days,
+        'words': TITLE_WORDS,
+        # Every bench user logs in with the password "bench"
+        'password_hash': load_handler('auth').hash_password('bench'),
+    }
+
+    timed(conn, 'users', '''
+        INSERT INTO users (username, email, password_hash)
+        SELECT 'bench_user_' || g, 'bench_user_' || g || '@bench.local', %(password_hash)s
+        FROM generate_series(1, %(users)s) g
+        ON CONFLICT (username) DO NOTHING
+    ''', params)
+
+    timed(conn, 'channels', '''
+        INSERT INTO channels (user_id, name, description, is_verified)
+        SELECT u.id, 'Bench channel ' || u.id, 'Synthetic channel', random() < 0.05
+        FROM users u
+        WHERE u.username LIKE 'bench_user_%%'
+          AND NOT EXISTS (SELECT 1 FROM channels c WHERE c.user_id = u.id)
+        ORDER BY u.id
+        LIMIT %(channels)s
+    ''', params)
+
+    # Channel and word picks are skewed; created_at is spread over the last N days
+    timed(conn, 'videos', '''
+        WITH bounds AS (SELECT array_agg(id ORDER BY id) AS ids FROM channels)
+        INSERT INTO videos (channel_id, title, description, thumbnail_url, video_url, duration, video_type, created_at)
+        SELECT b.ids[1 + floor(array_length(b.ids, 1) * power(random(), %(skew)s))::int],
+               initcap((%(words)s::text[])[1 + floor(16 * power(random(), 2))::int]) || ' '
+                   || (%(words)s::text[])[1 + floor(16 * random())::int] || ' #' || g,
+               'Synthetic video ' || g,
+               'https://storage.example.com/thumbs/' || g || '.jpg',
+               'https://storage.example.com/videos/' || g || '.mp4',
+               30 + floor(random() * 3600)::int,
+               (ARRAY['regular', 'regular', 'regular', 'series', 'movie'])[1 + floor(random() * 5)::int],
+               CURRENT_TIMESTAMP - make_interval(secs => random() * %(days)s * 86400)
+        FROM generate_series(1, %(videos)s) g, bounds b
+    ''', params)
+
+    # Backdated views need their month partitions, or they would all land in video_views_default
+    timed(conn, 'view partitions', '''
+        DO $$
+        DECLARE
+            month_start DATE;
+        BEGIN
+            FOR month_start IN
+                SELECT generate_series(date_trunc('month', CURRENT_DATE - %(days)s), date_trunc('month', CURRENT_DATE),
+                                       INTERVAL '1 month')::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %%I PARTITION OF video_views FOR VALUES FROM (%%L) TO (%%L)',
+                    'video_views_p' || to_char(month_start, 'YYYYMM'), month_start, (month_start + INTERVAL '1 month')::date
+                );
+            END LOOP;
+        END $$
+    ''', params)
+
+    timed(conn, 'views', '''
+        WITH bounds AS (
+            SELECT MIN(id) AS lo, MAX(id) - MIN(id) + 1 AS span FROM videos
+        ), users_bounds AS (
+            SELECT MIN(id) AS lo, MAX(id) - MIN(id) + 1 AS span FROM users
+        )
+        INSERT INTO video_views (user_id, video_id, viewed_at)
+        SELECT ub.lo + floor(ub.span * random())::int,
+               b.lo + floor(b.span * power(random(), %(skew)s))::int,
+               CURRENT_TIMESTAMP - make_interval(secs => random() * %(days)s * 86400)
+        FROM generate_series(1, %(views)s) g, bounds b, users_bounds ub
+    ''', params)
+
+    timed(conn, 'likes', '''
+        WITH bounds AS (
+            SELECT MIN(id) AS lo, MAX(id) - MIN(id) + 1 AS span FROM videos
+        ), users_bounds AS (
+            SELECT MIN(id) AS lo, MAX(id) - MIN(id) + 1 AS span FROM users
+        )
+        INSERT INTO video_likes (user_id, video_id, is_like, created_at)
+        SELECT ub.lo + floor(ub.span * random())::int,
+               b.lo + floor(b.span * power(random(), %(skew)s))::int,
+               random() < 0.9,
+               CURRENT_TIMESTAMP - make_interval(secs => random() * %(days)s * 86400)
+        FROM generate_series(1, %(likes)s) g, bounds b, users_bounds ub
+        ON CONFLICT (user_id, video_id) DO NOTHING
+    ''', params)
+
+    timed(conn, 'subscriptions', '''
+        WITH bounds AS (SELECT array_agg(id ORDER BY id) AS ids FROM channels),
+        users_bounds AS (
+            SELECT MIN(id) AS lo, MAX(id) - MIN(id) + 1 AS span FROM users
+        )
+        INSERT INTO subscriptions (user_id, channel_id)
+        SELECT ub.lo + floor(ub.span * random())::int,
+               b.ids[1 + floor(array_length(b.ids, 1) * power(random(), %(skew)s))::int]
+        FROM generate_series(1, %(subscriptions)s) g, bounds b, users_bounds ub
+        ON CONFLICT (user_id, channel_id) DO NOTHING
+    ''', params)
+
+    timed(conn, 'view counters', '''
+        UPDATE videos v SET views_count = vv.views
+        FROM (SELECT video_id, COUNT(*) AS views FROM video_views GROUP BY video_id) vv
+        WHERE v.id = vv.video_id
+    ''', params)
+
+    timed(conn, 'like counters', '''
+        UPDATE videos v SET likes_count = vl.likes, dislikes_count = vl.dislikes
+        FROM (
+            SELECT video_id, COUNT(*) FILTER (WHERE is_like) AS likes, COUNT(*) FILTER (WHERE NOT is_like) AS dislikes
+            FROM video_likes GROUP BY video_id
+        ) vl
+        WHERE v.id = vl.video_id
+    ''', params)
+
+    timed(conn, 'subscriber counters', '''
+        UPDATE channels c SET subscribers_count = s.subscribers
+        FROM (SELECT channel_id, COUNT(*) AS subscribers FROM subscriptions GROUP BY channel_id) s
+        WHERE c.id = s.channel_id
+    ''', params)
+
+    timed(conn, 'channel video counters', '''
+        UPDATE channels c SET videos_count = v.videos, last_video_at = v.last_video_at
+        FROM (SELECT channel_id, COUNT(*) AS videos, MAX(created_at) AS last_video_at FROM videos GROUP BY channel_id) v
+        WHERE c.id = v.channel_id
+    ''', params)
+
+    with conn.cursor() as cur:
+        cur.execute('ANALYZE')
+    conn.commit()
+
+
+def run_job(conn: Any, job: str, batch_size: int) -> None:
+    '''Run a maintenance job to completion, the way its handler loops but without a time budget'''
+    maintenance = load_handler('maintenance')
+    started = time.perf_counter()
+    after_id = 0
+    while True:
+        result = maintenance.JOBS[job](conn, after_id, batch_size)
+        if result['last_id'] is None or (result['scanned'] < batch_size and not result.get('more')):
+            break
+        after_id = result['last_id']
+    print(f'{job}: {time.perf_counter() - started:.1f}s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL', 'postgresql://localhost/video_bench'))
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--channels', type=int, default=10000)
+    parser.add_argument('--videos', type=int, default=1000000)
+    parser.add_argument('--views', type=int, default=5000000)
+    parser.add_argument('--likes', type=int, default=1000000)
+    parser.add_argument('--subscriptions', type=int, default=500000)
+    parser.add_argument('--skew', type=float, default=3.0, help='popularity exponent; 1 is uniform')
+    parser.add_argument('--days', type=int, default=365, help='spread of created_at and viewed_at')
+    parser.add_argument('--skip-migrations', action='store_true')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', args.dsn)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if not args.skip_migrations:
+            apply_migrations(conn)
+        seed(conn, args)
+        run_job(conn, 'update_trending', 50000)
+        run_job(conn, 'rollup_views', 1)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
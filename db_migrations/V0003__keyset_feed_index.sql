@@ -0,0 +1,4 @@
+-- Composite index for keyset pagination of the home feed on (created_at, id)
+
+DROP INDEX IF EXISTS idx_videos_created;
+CREATE INDEX IF NOT EXISTS idx_videos_created ON videos(created_at DESC, id DESC);
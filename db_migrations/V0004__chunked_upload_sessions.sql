@@ -0,0 +1,28 @@
+-- Server-side state for chunked, resumable uploads
+
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id VARCHAR(64) PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    channel_id INTEGER NOT NULL REFERENCES channels(id),
+    title VARCHAR(300) NOT NULL,
+    description TEXT,
+    duration INTEGER DEFAULT 0,
+    video_type VARCHAR(50) DEFAULT 'regular',
+    total_size BIGINT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    total_chunks INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'open',
+    video_id INTEGER REFERENCES videos(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    session_id VARCHAR(64) NOT NULL REFERENCES upload_sessions(id),
+    chunk_index INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (session_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_user ON upload_sessions(user_id);
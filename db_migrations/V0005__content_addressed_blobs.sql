@@ -0,0 +1,19 @@
+-- Content-addressed storage: one blob per distinct SHA-256, shared by every video that uses it
+
+CREATE TABLE IF NOT EXISTS blobs (
+    id SERIAL PRIMARY KEY,
+    sha256 CHAR(64) UNIQUE NOT NULL,
+    storage_key TEXT NOT NULL,
+    size BIGINT NOT NULL,
+    content_type VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS video_blob CHAR(64) REFERENCES blobs(sha256);
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS thumbnail_blob CHAR(64) REFERENCES blobs(sha256);
+ALTER TABLE upload_sessions ADD COLUMN IF NOT EXISTS sha256 CHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_videos_video_blob ON videos(video_blob);
+CREATE INDEX IF NOT EXISTS idx_videos_thumbnail_blob ON videos(thumbnail_blob);
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_sha256 ON upload_sessions(sha256) WHERE status = 'open';
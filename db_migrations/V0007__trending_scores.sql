@@ -0,0 +1,19 @@
+-- Precomputed trending scores, maintained incrementally by the update_trending job
+
+CREATE TABLE IF NOT EXISTS video_trending (
+    video_id INTEGER PRIMARY KEY REFERENCES videos(id),
+    score DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_video_trending_score ON video_trending(score DESC, video_id DESC);
+
+CREATE TABLE IF NOT EXISTS trending_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    epoch TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_view_id INTEGER NOT NULL DEFAULT 0,
+    last_like_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO trending_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,10 @@
+-- Per-channel newest-first index for the subscriptions feed merge, plus a cheap
+-- per-channel version marker used to validate cached feed heads
+
+CREATE INDEX IF NOT EXISTS idx_videos_channel_created ON videos(channel_id, created_at DESC, id DESC);
+
+ALTER TABLE channels ADD COLUMN IF NOT EXISTS last_video_at TIMESTAMP;
+
+UPDATE channels c SET last_video_at = latest.created_at
+FROM (SELECT channel_id, MAX(created_at) AS created_at FROM videos GROUP BY channel_id) latest
+WHERE c.id = latest.channel_id AND c.last_video_at IS NULL;
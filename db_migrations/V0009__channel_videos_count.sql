@@ -0,0 +1,8 @@
+-- Maintained per-channel video count, replacing the correlated COUNT(*) on every channel read.
+-- Insert paths bump it next to last_video_at; the reconcile_videos_count job repairs drift.
+
+ALTER TABLE channels ADD COLUMN IF NOT EXISTS videos_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE channels c SET videos_count = counted.videos
+FROM (SELECT channel_id, COUNT(*) AS videos FROM videos GROUP BY channel_id) counted
+WHERE c.id = counted.channel_id;
@@ -0,0 +1,3 @@
+-- Channel video listing filtered by type; the unfiltered listing uses idx_videos_channel_created
+
+CREATE INDEX IF NOT EXISTS idx_videos_channel_type_created ON videos(channel_id, video_type, created_at DESC, id DESC);
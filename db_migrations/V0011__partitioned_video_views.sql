@@ -0,0 +1,64 @@
+-- Range-partition video_views by month on viewed_at so old raw views can be detached
+-- and dropped or archived whole, and add daily per-video rollups for analytics.
+-- manage_view_partitions creates upcoming months; rollup_views fills video_views_daily.
+
+ALTER TABLE video_views RENAME TO video_views_unpartitioned;
+ALTER TABLE video_views_unpartitioned RENAME CONSTRAINT video_views_pkey TO video_views_unpartitioned_pkey;
+ALTER SEQUENCE video_views_id_seq OWNED BY NONE;
+
+CREATE TABLE video_views (
+    id INTEGER NOT NULL DEFAULT nextval('video_views_id_seq'),
+    user_id INTEGER REFERENCES users(id),
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    viewed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, viewed_at)
+) PARTITION BY RANGE (viewed_at);
+
+ALTER SEQUENCE video_views_id_seq OWNED BY video_views.id;
+
+-- Catches rows outside every monthly range so inserts never fail; it should stay empty
+CREATE TABLE IF NOT EXISTS video_views_default PARTITION OF video_views DEFAULT;
+
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(
+            date_trunc('month', LEAST((SELECT MIN(viewed_at) FROM video_views_unpartitioned), CURRENT_TIMESTAMP)),
+            date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '2 months',
+            INTERVAL '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF video_views FOR VALUES FROM (%L) TO (%L)',
+            'video_views_p' || to_char(month_start, 'YYYYMM'), month_start, (month_start + INTERVAL '1 month')::date
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO video_views (id, user_id, video_id, viewed_at)
+SELECT id, user_id, video_id, COALESCE(viewed_at, CURRENT_TIMESTAMP) FROM video_views_unpartitioned;
+
+DROP TABLE video_views_unpartitioned;
+
+CREATE INDEX IF NOT EXISTS idx_video_views_video ON video_views(video_id);
+CREATE INDEX IF NOT EXISTS idx_video_views_user ON video_views(user_id);
+-- Views arrive in time order, so a BRIN index narrows a day inside its month cheaply
+CREATE INDEX IF NOT EXISTS idx_video_views_viewed_at ON video_views USING brin (viewed_at);
+
+CREATE TABLE IF NOT EXISTS video_views_daily (
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    day DATE NOT NULL,
+    views INTEGER NOT NULL DEFAULT 0,
+    unique_viewers INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (video_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS view_rollup_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    rolled_through DATE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO view_rollup_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
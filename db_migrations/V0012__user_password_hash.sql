@@ -0,0 +1,4 @@
+-- Password hashes for login. Accounts created before this migration have none and cannot
+-- log in until a password is set for them; login never accepts a missing hash.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS password_hash TEXT;
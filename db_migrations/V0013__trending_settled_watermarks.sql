@@ -0,0 +1,25 @@
+-- update_trending used to follow id watermarks, but sequence values can commit out of order,
+-- so rows committed late below the watermark were never counted. It now follows when rows
+-- were written and only reads rows older than a settle window, like rollup_views.
+-- reacted_at also moves when a reaction flips, so a dislike turned into a like counts.
+
+ALTER TABLE video_views ADD COLUMN IF NOT EXISTS recorded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_video_views_recorded ON video_views(recorded_at, id);
+
+ALTER TABLE video_likes ADD COLUMN IF NOT EXISTS reacted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_video_likes_reacted ON video_likes(reacted_at, id);
+
+-- Existing rows all carry this migration's timestamp, so the old id watermarks carry over
+-- as the tie-breaker: rows at or below them are already counted
+ALTER TABLE trending_state
+    ADD COLUMN IF NOT EXISTS views_through TIMESTAMP NOT NULL DEFAULT '1970-01-01',
+    ADD COLUMN IF NOT EXISTS views_through_id INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS likes_through TIMESTAMP NOT NULL DEFAULT '1970-01-01',
+    ADD COLUMN IF NOT EXISTS likes_through_id INTEGER NOT NULL DEFAULT 0;
+
+UPDATE trending_state SET
+    views_through = CURRENT_TIMESTAMP, views_through_id = last_view_id,
+    likes_through = CURRENT_TIMESTAMP, likes_through_id = last_like_id
+WHERE id = 1;
+
+ALTER TABLE trending_state DROP COLUMN IF EXISTS last_view_id, DROP COLUMN IF EXISTS last_like_id;
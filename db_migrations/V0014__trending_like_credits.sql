@@ -0,0 +1,20 @@
+-- update_trending counted every like it read, so toggling like/unlike or like/dislike kept
+-- adding TRENDING_LIKE_WEIGHT. A like now scores only the first time a (user, video) pair
+-- likes; unlike deletes the video_likes row, so the record has to live elsewhere.
+
+CREATE TABLE IF NOT EXISTS trending_like_credits (
+    user_id INTEGER NOT NULL,
+    video_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, video_id)
+);
+
+-- Likes at or below the watermark have already been counted
+INSERT INTO trending_like_credits (user_id, video_id)
+SELECT l.user_id, l.video_id
+FROM video_likes l, trending_state s
+WHERE s.id = 1 AND l.is_like AND (l.reacted_at, l.id) <= (s.likes_through, s.likes_through_id)
+ON CONFLICT DO NOTHING;
+
+-- Natural log of the factor every score has been divided by in rebases so far. Trending
+-- cursors carry it, so a page requested after a rebase rescales its starting score.
+ALTER TABLE trending_state ADD COLUMN IF NOT EXISTS score_log_scale DOUBLE PRECISION NOT NULL DEFAULT 0;
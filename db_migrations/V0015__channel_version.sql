@@ -0,0 +1,5 @@
+-- Per-channel version for the channel GET ETag, so a revalidation reads one integer
+-- instead of hashing the row. Every statement that changes a column the channel GET
+-- returns bumps it in the same UPDATE.
+
+ALTER TABLE channels ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
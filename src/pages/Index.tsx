@@ -24,6 +24,27 @@ const API_URLS = {
   channel: 'https://functions.poehali.dev/7fe1f93a-f70c-4770-86c0-b926b9e2151c'
 };
 
+// Write responses carry X-Read-Primary-Until ("<until>:<signature>"); echoing it on reads
+// keeps them on the primary until read replicas have caught up with the user's own change
+let readPrimaryUntil: string | null = null;
+
+const rememberWrite = (response: Response) => {
+  const until = response.headers.get('X-Read-Primary-Until');
+  if (until) readPrimaryUntil = until;
+};
+
+const readConsistencyHeaders = (): Record<string, string> =>
+  readPrimaryUntil && Number(readPrimaryUntil.split(':')[0]) * 1000 > Date.now()
+    ? { 'X-Read-Primary-Until': readPrimaryUntil }
+    : {};
+
+// Signed tokens are only sent when the session has one; sessions saved before tokens
+// existed have none and are dropped on load, so their owners sign in again
+const authHeaders = (user: any): Record<string, string> =>
+  user?.id
+    ? { 'X-User-Id': user.id.toString(), ...(user.auth_token ? { 'X-Auth-Token': user.auth_token } : {}) }
+    : {};
+
 interface Video {
   id: number;
   title: string;
@@ -79,7 +100,12 @@ const Index = () => {
   useEffect(() => {
     const savedUser = localStorage.getItem('user');
     if (savedUser) {
-      setUser(JSON.parse(savedUser));
+      const parsed = JSON.parse(savedUser);
+      if (parsed.auth_token) {
+        setUser(parsed);
+      } else {
+        localStorage.removeItem('user');
+      }
     }
     loadVideos();
   }, []);
@@ -90,14 +116,21 @@ const Index = () => {
     }
   }, [user]);
 
+  // An expired or rejected token answers 401: forget the session so the user signs in again
+  const expireSession = (response: Response) => {
+    if (response.status !== 401 || !localStorage.getItem('user')) return false;
+    setUser(null);
+    localStorage.removeItem('user');
+    toast({ title: 'Сессия истекла, войдите снова', variant: 'destructive' });
+    return true;
+  };
+
   const loadVideos = async () => {
     try {
-      const headers: HeadersInit = { 'Content-Type': 'application/json' };
-      if (user?.id) {
-        headers['X-User-Id'] = user.id.toString();
-      }
+      const headers: Record<string, string> = { 'Content-Type': 'application/json', ...readConsistencyHeaders(), ...authHeaders(user) };
       
       const response = await fetch(API_URLS.videos, { headers });
+      expireSession(response);
       const data = await response.json();
       setVideos(data.videos || []);
     } catch (error) {
@@ -111,9 +144,11 @@ const Index = () => {
     try {
       const response = await fetch(`${API_URLS.channel}?channel_id=${user.channel_id}`, {
         headers: {
-          'X-User-Id': user.id.toString()
+          ...authHeaders(user),
+          ...readConsistencyHeaders()
         }
       });
+      if (expireSession(response)) return;
       const data = await response.json();
       if (response.ok && data.channel) {
         setChannelForm({
@@ -138,6 +173,7 @@ const Index = () => {
           ...authForm
         })
       });
+      rememberWrite(response);
       const data = await response.json();
       
       if (response.ok) {
@@ -217,7 +253,7 @@ const Index = () => {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': user.id.toString()
+          ...authHeaders(user)
         },
         body: JSON.stringify({
           title: uploadForm.title,
@@ -231,6 +267,8 @@ const Index = () => {
           channel_id: user.channel_id
         })
       });
+      rememberWrite(response);
+      if (expireSession(response)) return;
       
       setUploadProgress(90);
       const data = await response.json();
@@ -261,17 +299,18 @@ const Index = () => {
     // Record view
     if (user?.id) {
       try {
-        await fetch(API_URLS.actions, {
+        const response = await fetch(API_URLS.actions, {
           method: 'POST',
           headers: { 
             'Content-Type': 'application/json',
-            'X-User-Id': user.id.toString()
+            ...authHeaders(user)
           },
           body: JSON.stringify({
             action: 'view',
             video_id: video.id
           })
         });
+        if (expireSession(response)) return;
         
         // Update local video views
         setVideos(prevVideos => 
@@ -299,13 +338,15 @@ const Index = () => {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': user.id.toString()
+          ...authHeaders(user)
         },
         body: JSON.stringify({
           action: 'like',
           video_id: selectedVideo.id
         })
       });
+      rememberWrite(response);
+      if (expireSession(response)) return;
 
       const data = await response.json();
       
@@ -349,13 +390,15 @@ const Index = () => {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': user.id.toString()
+          ...authHeaders(user)
         },
         body: JSON.stringify({
           action: 'dislike',
           video_id: selectedVideo.id
         })
       });
+      rememberWrite(response);
+      if (expireSession(response)) return;
 
       const data = await response.json();
       
@@ -399,13 +442,15 @@ const Index = () => {
         method: 'POST',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': user.id.toString()
+          ...authHeaders(user)
         },
         body: JSON.stringify({
           action: 'subscribe',
           channel_id: selectedVideo.channel_id
         })
       });
+      rememberWrite(response);
+      if (expireSession(response)) return;
 
       const data = await response.json();
       
@@ -442,13 +487,15 @@ const Index = () => {
         method: 'PUT',
         headers: { 
           'Content-Type': 'application/json',
-          'X-User-Id': user.id.toString()
+          ...authHeaders(user)
         },
         body: JSON.stringify({
           channel_id: user.channel_id,
           ...channelForm
         })
       });
+      rememberWrite(response);
+      if (expireSession(response)) return;
 
       const data = await response.json();
       